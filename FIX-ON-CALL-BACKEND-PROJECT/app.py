@@ -7,6 +7,23 @@ import logging
 import os
 from datetime import datetime
 from database import db, migrate
+from schema import MIGRATIONS_DIR, prepare_schema
+from utils.spatial_index import mechanic_index
+from utils.location_updates import location_buffer
+from utils.jobs import job_queue
+from utils.alert_fanout import alert_buffer
+from utils.broker import broker
+from utils.stats import stat_counters
+from utils.revenue import revenue_rollup
+from utils.cache import response_cache
+from utils.principals import principal_cache
+from utils.replicas import STICKY_HEADER, replica_router
+from utils.support_search import support_search
+from utils.support_archive import support_archiver
+from utils.support_chat import message_buffer
+from utils.support_socket import chat_presence
+from utils.streaming import sock, stream_tickets_only_open_streams
+from utils.outbox import notification_outbox
 
 # Initialize extensions
 jwt = JWTManager()
@@ -23,15 +40,45 @@ def create_app(config_class=Config):
     
     # Initialize extensions
     db.init_app(app)
-    migrate.init_app(app, db)
+    replica_router.init_app(app)
+    migrate.init_app(app, db, directory=MIGRATIONS_DIR)
     jwt.init_app(app)
+    jwt.token_verification_loader(stream_tickets_only_open_streams)
     mail.init_app(app)
+    mechanic_index.init_app(app)
+    location_buffer.init_app(
+        app,
+        interval=app.config['LOCATION_FLUSH_INTERVAL_SECONDS'],
+        max_items=app.config['LOCATION_FLUSH_MAX_ITEMS']
+    )
+    job_queue.init_app(app, workers=app.config['JOB_WORKERS'], max_queue=app.config['JOB_QUEUE_SIZE'])
+    broker.init_app(app)
+    stat_counters.init_app(app, reconcile_interval=app.config['STATS_RECONCILE_INTERVAL_SECONDS'])
+    revenue_rollup.init_app(app, reconcile_interval=app.config['STATS_RECONCILE_INTERVAL_SECONDS'])
+    response_cache.init_app(app)
+    principal_cache.init_app(app)
+    support_search.init_app(app)
+    alert_buffer.init_app(
+        app,
+        interval=app.config['ALERT_FANOUT_INTERVAL_SECONDS'],
+        max_items=app.config['ALERT_FANOUT_MAX_ITEMS']
+    )
+    message_buffer.init_app(
+        app,
+        interval=app.config['SUPPORT_MESSAGE_FLUSH_SECONDS'],
+        max_items=app.config['SUPPORT_MESSAGE_BATCH_SIZE']
+    )
+    chat_presence.init_app(app)
+    support_archiver.init_app(app)
+    notification_outbox.init_app(app)
+    sock.init_app(app)
     allowed_origins = app.config.get("CORS_ALLOWED_ORIGINS", [])
     cors.init_app(app, resources={
         r"/api/*": {
             "origins": allowed_origins,
             "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", STICKY_HEADER],
+            "expose_headers": [STICKY_HEADER],
             "supports_credentials": False
         }
     })
@@ -41,32 +88,37 @@ def create_app(config_class=Config):
     
     # Import models to ensure they're registered
     with app.app_context():
-        from models import user, service, booking, payment, support
+        from models import user, service, booking, payment, support, stats, outbox
         from models.user import User
-        db.create_all()
+        if not prepare_schema():
+            # The queries below would fail on columns the database does not have yet
+            app.logger.warning('Database schema is out of date: run "flask db upgrade"')
+        else:
+            stat_counters.ensure_initialized()
+            revenue_rollup.ensure_initialized()
 
-        # Development convenience: keep a default admin account available.
-        default_admin_email = "info@fixoncall.com"
-        default_admin_password = "1362"
-        default_admin_phone = "+254726392725"
+            # Development convenience: keep a default admin account available.
+            default_admin_email = "info@fixoncall.com"
+            default_admin_password = "1362"
+            default_admin_phone = "+254726392725"
 
-        default_admin = User.query.filter_by(email=default_admin_email).first()
-        if not default_admin:
-            default_admin = User(
-                email=default_admin_email,
-                name="Fix On Call Admin",
-                phone=default_admin_phone,
-                user_type="admin",
-                is_active=True,
-            )
-            default_admin.set_password(default_admin_password)
-            db.session.add(default_admin)
-            db.session.commit()
-        else:
-            # Keep requested simplified admin password in sync.
-            if not default_admin.check_password(default_admin_password):
+            default_admin = User.query.filter_by(email=default_admin_email).first()
+            if not default_admin:
+                default_admin = User(
+                    email=default_admin_email,
+                    name="Fix On Call Admin",
+                    phone=default_admin_phone,
+                    user_type="admin",
+                    is_active=True,
+                )
                 default_admin.set_password(default_admin_password)
+                db.session.add(default_admin)
                 db.session.commit()
+            else:
+                # Keep requested simplified admin password in sync.
+                if not default_admin.check_password(default_admin_password):
+                    default_admin.set_password(default_admin_password)
+                    db.session.commit()
     
     # Import and register blueprints
     from routes.auth import auth_bp
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Measure GET /api/admin/dashboard latency (p50/p99) on a seeded database.
+
+Run from the backend directory:
+    python benchmarks/bench_dashboard.py [--services 100000] [--users 20000] [--payments 50000]
+        [--requests 50] [--database-url postgresql+psycopg://...]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--services', type=int, default=100000)
+parser.add_argument('--users', type=int, default=20000)
+parser.add_argument('--payments', type=int, default=50000)
+parser.add_argument('--requests', type=int, default=50)
+parser.add_argument('--database-url')
+args = parser.parse_args()
+
+database_url = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+os.environ.setdefault('DATABASE_URL', database_url)
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from app import create_app
+from config import Config
+from database import db
+from models.payment import Payment
+from models.service import Service
+from models.user import User
+from utils.revenue import revenue_rollup
+from utils.stats import stat_counters
+
+SERVICE_TYPES = ['breakdown', 'towing', 'fuel_delivery', 'tyre_change', 'battery_jump', 'lockout']
+STATUSES = ['pending', 'accepted', 'in_progress', 'completed', 'completed', 'cancelled']
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = database_url
+
+
+def insert_chunked(model, rows, chunk=5000):
+    for start in range(0, len(rows), chunk):
+        db.session.execute(insert(model), rows[start:start + chunk])
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    now = datetime.utcnow()
+    insert_chunked(User, [
+        {
+            'email': f'bench{i}@example.com',
+            'password_hash': 'x',
+            'name': f'User {i}',
+            'phone': '0712345678',
+            'user_type': rng.choice(['driver', 'driver', 'driver', 'mechanic', 'partner']),
+        }
+        for i in range(args.users)
+    ])
+    insert_chunked(Service, [
+        {
+            'user_id': rng.randint(1, args.users),
+            'service_type': rng.choice(SERVICE_TYPES),
+            'status': rng.choice(STATUSES),
+            'location': LOCATION,
+            'created_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+        }
+        for _ in range(args.services)
+    ])
+    insert_chunked(Payment, [
+        {
+            'service_id': rng.randint(1, args.services),
+            'user_id': rng.randint(1, args.users),
+            'amount': rng.randint(500, 20000),
+            'status': rng.choice(['completed', 'completed', 'pending', 'failed']),
+            'created_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+        }
+        for _ in range(args.payments)
+    ])
+    admin = User(email='bench-admin@example.com', name='Admin', phone='0712345678', user_type='admin')
+    admin.set_password('1234')
+    db.session.add(admin)
+    db.session.commit()
+    # Core bulk inserts skip the counter and rollup hooks; count the seeded rows once
+    stat_counters.reconcile()
+    revenue_rollup.reconcile()
+    return create_access_token(identity=str(admin.id))
+
+
+def main():
+    rng = random.Random(11)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        token = seed(rng)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    samples = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        response = client.get('/api/admin/dashboard', headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_json()
+
+    samples.sort()
+    dialect = app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]
+    print(f'{args.requests} requests, {args.users} users, {args.services} services, '
+          f'{args.payments} payments, {dialect}')
+    print(f'p50 {statistics.median(samples):.2f}ms  p99 {samples[int(len(samples) * 0.99) - 1]:.2f}ms  '
+          f'max {samples[-1]:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
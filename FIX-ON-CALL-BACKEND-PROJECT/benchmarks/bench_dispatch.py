@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark global dispatch (min-cost assignment) against greedy first-come assignment.
+
+Run from the backend directory:
+    python benchmarks/bench_dispatch.py [--sizes 500 1000 2000 4000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils.dispatch import INFEASIBLE, DispatchJob, DispatchMechanic, build_cost_matrix, solve_assignment
+
+NAIROBI = (-1.2921, 36.8219)
+SPREAD_DEG = 0.3
+SERVICE_TYPES = ['breakdown', 'towing', 'fuel_delivery', 'tyre_change', 'battery_jump']
+SPECIALIZATIONS = [['engine'], ['electrical'], ['towing'], ['tyres'], []]
+
+
+def make_problem(jobs_count, mechanics_count, rng, now):
+    jobs = [
+        DispatchJob(
+            i,
+            NAIROBI[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            NAIROBI[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            rng.choice(SERVICE_TYPES),
+            rng.choice(['low', 'medium', 'medium', 'high']),
+            now - timedelta(minutes=rng.uniform(0, 30)),
+        )
+        for i in range(jobs_count)
+    ]
+    mechanics = [
+        DispatchMechanic(
+            i,
+            NAIROBI[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            NAIROBI[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            rng.choice(SPECIALIZATIONS),
+            rng.choice([10, 15, 20]),
+        )
+        for i in range(mechanics_count)
+    ]
+    return jobs, mechanics
+
+
+def greedy_assignment(jobs, mechanics, now):
+    """Oldest job first, each takes the cheapest mechanic still free"""
+    cost, distances, eta = build_cost_matrix(jobs, mechanics, now)
+    taken = np.zeros(len(mechanics), dtype=bool)
+    pairs = []
+    for row in sorted(range(len(jobs)), key=lambda r: jobs[r].created_at):
+        row_cost = np.where(taken, np.inf, cost[row])
+        col = int(np.argmin(row_cost))
+        if row_cost[col] < INFEASIBLE:
+            taken[col] = True
+            pairs.append((row, col))
+    return pairs, eta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000])
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    print(f"{'jobs x mechanics':>18} {'global':>10} {'greedy':>10} {'global ETA':>12} {'greedy ETA':>12} "
+          f"{'assigned g/gr':>14}")
+    for size in args.sizes:
+        jobs, mechanics = make_problem(size, size, rng, now)
+
+        start = time.perf_counter()
+        assignments = solve_assignment(jobs, mechanics, now)
+        global_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pairs, eta = greedy_assignment(jobs, mechanics, now)
+        greedy_s = time.perf_counter() - start
+
+        global_eta = sum(a.eta_minutes for a in assignments) / max(len(assignments), 1)
+        greedy_eta = sum(int(eta[r, c]) for r, c in pairs) / max(len(pairs), 1)
+        print(f"{f'{size} x {size}':>18} {global_s:>9.2f}s {greedy_s:>9.2f}s {global_eta:>10.1f}m "
+              f"{greedy_eta:>10.1f}m {len(assignments):>6}/{len(pairs):<6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark nearby-mechanic lookup: linear haversine scan vs. the grid index.
+
+Run from the backend directory:
+    python benchmarks/bench_mechanic_index.py [--sizes 1000 10000 100000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.geolocation import find_nearby_locations
+from utils.spatial_index import MechanicIndex
+
+NAIROBI = (-1.2921, 36.8219)
+SPREAD_DEG = 0.5  # roughly a 110 km square around the city centre
+
+
+def make_mechanics(count, rng):
+    mechanics = []
+    for i in range(count):
+        mechanics.append({
+            'id': i,
+            'location': {
+                'latitude': NAIROBI[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+                'longitude': NAIROBI[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            },
+            'specialization': ['engine'],
+        })
+    return mechanics
+
+
+def time_queries(fn, origins, repeat):
+    samples = []
+    for _ in range(repeat):
+        for origin in origins:
+            start = time.perf_counter()
+            fn(origin)
+            samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--radius', type=float, default=10)
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'mechanics':>10} {'linear p50':>12} {'index p50':>12} {'index p99':>12} {'knn(5) p50':>12} {'build':>10}")
+    for size in args.sizes:
+        mechanics = make_mechanics(size, rng)
+        origins = [
+            {'latitude': NAIROBI[0] + rng.uniform(-0.3, 0.3), 'longitude': NAIROBI[1] + rng.uniform(-0.3, 0.3)}
+            for _ in range(args.queries)
+        ]
+
+        index = MechanicIndex()
+        start = time.perf_counter()
+        index.rebuild(
+            (m['id'], m['location']['latitude'], m['location']['longitude'], m['specialization']) for m in mechanics
+        )
+        build_ms = (time.perf_counter() - start) * 1000
+
+        linear_p50, _ = time_queries(
+            lambda o: find_nearby_locations(o, [dict(m) for m in mechanics], args.radius), origins[:10], 1
+        )
+        index_p50, index_p99 = time_queries(
+            lambda o: index.radius_search(o['latitude'], o['longitude'], args.radius), origins, 3
+        )
+        knn_p50, _ = time_queries(
+            lambda o: index.nearest(o['latitude'], o['longitude'], 5, max_radius_km=args.radius), origins, 3
+        )
+        print(f"{size:>10} {linear_p50:>10.2f}ms {index_p50:>10.2f}ms {index_p99:>10.2f}ms "
+              f"{knn_p50:>10.2f}ms {build_ms:>8.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compare sending a burst of notification emails one SMTP connection per email
+(the old inline send_email) with draining the outbox in batches over one
+connection each, against the local SMTP sink.
+
+Run from the backend directory:
+    python benchmarks/bench_outbox.py [--emails 500] [--batch-size 50] [--connect-ms 30]
+        [--database-url postgresql+psycopg://...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--emails', type=int, default=500)
+parser.add_argument('--batch-size', type=int, default=50)
+# Stand-in for the handshake with a real, remote SMTP server
+parser.add_argument('--connect-ms', type=float, default=30)
+parser.add_argument('--database-url')
+args = parser.parse_args()
+
+database_url = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+os.environ.setdefault('DATABASE_URL', database_url)
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import insert
+
+from app import create_app
+from config import Config
+from database import db
+from models.outbox import OUTBOX_EMAIL, OutboxMessage
+from utils.outbox import notification_outbox
+from utils.smtp_sink import SMTPSink
+
+
+def per_email(count):
+    """The straightforward version: mail.send() opens and closes a connection per email"""
+    mail = current_app.extensions['mail']
+    for i in range(count):
+        mail.send(Message(
+            subject=f'Update {i}', recipients=[f'driver{i}@example.com'], body='Your mechanic is on the way',
+            sender=current_app.config['MAIL_DEFAULT_SENDER'],
+        ))
+
+
+def main():
+    with SMTPSink(greeting_delay=args.connect_ms / 1000) as sink:
+        class BenchConfig(Config):
+            TESTING = True
+            SQLALCHEMY_DATABASE_URI = database_url
+            MAIL_SERVER = sink.host
+            MAIL_PORT = sink.port
+            MAIL_USE_TLS = False
+            MAIL_USERNAME = None
+            MAIL_PASSWORD = None
+            MAIL_SUPPRESS_SEND = False
+            MAIL_DEBUG = False
+            OUTBOX_BATCH_SIZE = args.batch_size
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            db.session.execute(db.text('DELETE FROM notification_outbox'))
+            db.session.commit()
+
+            start = time.perf_counter()
+            per_email(args.emails)
+            naive_s = time.perf_counter() - start
+            naive_connections = sink.connections
+
+            db.session.execute(insert(OutboxMessage), [
+                {'channel': OUTBOX_EMAIL, 'recipient': f'driver{i}@example.com', 'subject': f'Update {i}',
+                 'body': 'Your mechanic is on the way'}
+                for i in range(args.emails)
+            ])
+            db.session.commit()
+            start = time.perf_counter()
+            sent = notification_outbox.drain()
+            outbox_s = time.perf_counter() - start
+            stats = notification_outbox.stats()
+
+    dialect = database_url.split(':')[0]
+    print(f'{args.emails} emails, outbox batches of {args.batch_size}, {args.connect_ms:g}ms per connect, {dialect}')
+    print(f'per-email: {naive_s:.2f}s ({naive_connections} connections, {args.emails / naive_s:.0f} emails/s)')
+    print(f'outbox:    {outbox_s:.2f}s ({stats["connections"]} connections, {sent / outbox_s:.0f} emails/s, '
+          f'{stats["emails_per_connection"]} emails/connection)')
+
+
+if __name__ == '__main__':
+    main()
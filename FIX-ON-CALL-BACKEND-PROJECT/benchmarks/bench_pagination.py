@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Compare offset and cursor pagination of GET /api/admin/services on a deep page.
+
+Run from the backend directory:
+    python benchmarks/bench_pagination.py [--services 200000] [--per-page 20] [--depth 0.9]
+        [--requests 20] [--database-url postgresql+psycopg://...]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--services', type=int, default=200000)
+parser.add_argument('--per-page', type=int, default=20)
+parser.add_argument('--depth', type=float, default=0.9, help='fraction of the list before the measured page')
+parser.add_argument('--requests', type=int, default=20)
+parser.add_argument('--database-url')
+args = parser.parse_args()
+
+database_url = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+os.environ.setdefault('DATABASE_URL', database_url)
+os.environ.setdefault('RESPONSE_CACHE_TTL_SECONDS', '0')
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from app import create_app
+from config import Config
+from database import db
+from models.service import Service
+from models.user import User
+from utils.pagination import encode_cursor
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = database_url
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    admin = User(email='bench-admin@example.com', name='Admin', phone='0712345678', user_type='admin')
+    admin.set_password('1234')
+    db.session.add(admin)
+    db.session.flush()
+    now = datetime.utcnow()
+    rows = [
+        {
+            'user_id': admin.id,
+            'service_type': 'towing',
+            'status': rng.choice(['pending', 'completed']),
+            'location': LOCATION,
+            'created_at': now - timedelta(seconds=rng.randint(0, 3600 * 24 * 365)),
+        }
+        for _ in range(args.services)
+    ]
+    for start in range(0, len(rows), 5000):
+        db.session.execute(insert(Service), rows[start:start + 5000])
+    db.session.commit()
+    # Fresh planner statistics for the row estimate
+    db.session.execute(db.text('ANALYZE services' if db.engine.dialect.name == 'postgresql' else 'ANALYZE'))
+    db.session.commit()
+
+    # Cursor of the row just before the measured page, as a client would hold it
+    offset = int(args.services * args.depth)
+    before = Service.query.order_by(Service.created_at.desc(), Service.id.desc()).offset(offset - 1).first()
+    return create_access_token(identity=str(admin.id)), offset // args.per_page + 1, encode_cursor(
+        before.created_at, before.id
+    )
+
+
+def measure(client, url, headers):
+    samples = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.get_json()
+    samples.sort()
+    return statistics.median(samples), samples[-1], response.get_json()
+
+
+def main():
+    rng = random.Random(14)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        token, page, cursor = seed(rng)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    dialect = app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]
+    print(f'{args.services} services, page {page} of {args.per_page}, {args.requests} requests, {dialect}')
+    offset_p50, offset_max, offset_page = measure(
+        client, f'/api/admin/services?page={page}&per_page={args.per_page}', headers
+    )
+    cursor_p50, cursor_max, cursor_page = measure(
+        client, f'/api/admin/services?cursor={cursor}&per_page={args.per_page}', headers
+    )
+    estimate_p50, _, estimate_page = measure(
+        client, f'/api/admin/services?cursor={cursor}&per_page={args.per_page}&total=estimate', headers
+    )
+    assert [s['id'] for s in offset_page['services']] == [s['id'] for s in cursor_page['services']]
+    print(f'offset             p50 {offset_p50:.2f}ms  max {offset_max:.2f}ms')
+    print(f'cursor             p50 {cursor_p50:.2f}ms  max {cursor_max:.2f}ms')
+    print(f'cursor + estimate  p50 {estimate_p50:.2f}ms  (total ~{estimate_page["pagination"]["total"]})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Measure POST /api/services/request latency (p50/p99) through the test client.
+
+Run from the backend directory:
+    python benchmarks/bench_request_service.py [--mechanics 5000] [--requests 300]
+        [--database-url postgresql+psycopg://...] [--respond-async [--defer-jobs]]
+
+By default each response carries its nearby mechanics. --respond-async
+sends Prefer: respond-async, leaving the lookup to the job queue;
+--defer-jobs then leaves those jobs queued until every request has been
+timed, which isolates the request path from worker threads sharing the GIL.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--mechanics', type=int, default=5000)
+parser.add_argument('--requests', type=int, default=300)
+parser.add_argument('--database-url')
+parser.add_argument('--respond-async', action='store_true')
+parser.add_argument('--defer-jobs', action='store_true')
+args = parser.parse_args()
+
+database_url = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+os.environ.setdefault('DATABASE_URL', database_url)
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from app import create_app
+from config import Config
+from database import db
+from models.user import User
+from utils.jobs import job_queue
+
+NAIROBI = (-1.2921, 36.8219)
+
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = database_url
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    driver = User(email='bench-driver@example.com', name='Driver', phone='0712345678', user_type='driver')
+    driver.set_password('1234')
+    db.session.add(driver)
+    rows = []
+    for i in range(args.mechanics):
+        lat = NAIROBI[0] + rng.uniform(-0.3, 0.3)
+        lon = NAIROBI[1] + rng.uniform(-0.3, 0.3)
+        rows.append({
+            'email': f'bench-mech{i}@example.com',
+            'password_hash': driver.password_hash,
+            'name': f'Mechanic {i}',
+            'phone': '0712345678',
+            'user_type': 'mechanic',
+            'is_active': True,
+            'is_available': True,
+            'specialization': ['engine'],
+            'location': {'latitude': lat, 'longitude': lon},
+            # Bulk inserts skip the ORM hook that derives lat/lon
+            'lat': lat,
+            'lon': lon,
+        })
+    db.session.execute(insert(User), rows)
+    db.session.commit()
+    return create_access_token(identity=str(driver.id))
+
+
+def main():
+    rng = random.Random(3)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        token = seed(rng)
+    # TESTING keeps workers off by default; run them as in production
+    if not args.defer_jobs:
+        job_queue.start()
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    if args.respond_async:
+        headers['Prefer'] = 'respond-async'
+
+    samples = []
+    for i in range(args.requests):
+        payload = {
+            'service_type': 'breakdown' if i % 2 else 'towing',
+            'location': {
+                'latitude': NAIROBI[0] + rng.uniform(-0.2, 0.2),
+                'longitude': NAIROBI[1] + rng.uniform(-0.2, 0.2),
+            },
+        }
+        start = time.perf_counter()
+        response = client.post('/api/services/request', json=payload, headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 201, response.get_json()
+        assert args.respond_async or response.get_json()['nearby_mechanics']
+
+    drain_start = time.perf_counter()
+    job_queue.join()
+    drain_ms = (time.perf_counter() - drain_start) * 1000
+
+    samples.sort()
+    print(f'{args.requests} requests, {args.mechanics} mechanics, {app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0]}')
+    print(f'p50 {statistics.median(samples):.2f}ms  p99 {samples[int(len(samples) * 0.99) - 1]:.2f}ms  '
+          f'max {samples[-1]:.2f}ms')
+    print(f'background jobs: {job_queue.submitted} submitted, {job_queue.ran_inline} ran inline, '
+          f'{job_queue.failed} failed, drained {drain_ms:.0f}ms after the last response')
+    job_queue.stop()
+
+
+if __name__ == '__main__':
+    main()
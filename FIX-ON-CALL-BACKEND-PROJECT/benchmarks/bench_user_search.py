@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Measure GET /api/admin/users?search= latency (p50/p99) on a large users table.
+
+Run from the backend directory:
+    python benchmarks/bench_user_search.py [--users 1000000] [--requests 20]
+        [--database-url postgresql+psycopg://...]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--users', type=int, default=1000000)
+parser.add_argument('--requests', type=int, default=20)
+parser.add_argument('--database-url')
+args = parser.parse_args()
+
+database_url = args.database_url or f'sqlite:///{tempfile.mkdtemp()}/bench.db'
+os.environ.setdefault('DATABASE_URL', database_url)
+os.environ.setdefault('RESPONSE_CACHE_TTL_SECONDS', '0')
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from app import create_app
+from config import Config
+from database import db
+from models.user import User
+from utils.search import search_text_for
+
+FIRST = ['Mary', 'John', 'Wanjiku', 'Otieno', 'Achieng', 'Kamau', 'Njeri', 'Mwangi', 'Akinyi', 'Kiprop']
+LAST = ['Odhiambo', 'Kariuki', 'Mutua', 'Chebet', 'Omondi', 'Wambui', 'Kiptoo', 'Nyambura', 'Ouma', 'Waweru']
+# (label, search term): a rare email, a name pair (~1%), a phone typed in another format
+# than stored, and a word every user matches
+SEARCHES = [
+    ('email', 'user512345@'),
+    ('name', 'mary kariuki'),
+    ('phone', None),
+    ('common', 'example'),
+]
+
+
+class BenchConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = database_url
+
+
+def seed(rng):
+    db.drop_all()
+    db.create_all()
+    chunk = []
+    for i in range(args.users):
+        name = f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+        email = f'user{i}@example.com'
+        phone = f'+2547{rng.randrange(10 ** 8):08d}'
+        chunk.append({
+            'email': email, 'password_hash': 'x', 'name': name, 'phone': phone, 'user_type': 'driver',
+            'search_text': search_text_for(name, email, phone),
+        })
+        if len(chunk) == 10000:
+            db.session.execute(insert(User), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(User), chunk)
+    admin = User(email='bench-admin@example.com', name='Admin', phone='0712345678', user_type='admin')
+    admin.set_password('1234')
+    db.session.add(admin)
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE users' if db.engine.dialect.name == 'postgresql' else 'ANALYZE'))
+    db.session.commit()
+    target = db.session.get(User, args.users // 2)
+    # Stored as +2547..., searched as 07...
+    local_phone = '0' + target.phone[4:]
+    return create_access_token(identity=str(admin.id)), local_phone
+
+
+def main():
+    rng = random.Random(15)
+    app = create_app(BenchConfig)
+    with app.app_context():
+        token, local_phone = seed(rng)
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    dialect = app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0]
+    print(f'{args.users} users, {args.requests} requests per search, {dialect}')
+    for label, term in SEARCHES:
+        term = term or local_phone
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.get('/api/admin/users', headers=headers,
+                                  query_string={'search': term, 'cursor': '', 'per_page': 20})
+            samples.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.get_json()
+        samples.sort()
+        found = len(response.get_json()['users'])
+        print(f'{label:6} {term!r:22} p50 {statistics.median(samples):8.2f}ms  '
+              f'p99 {samples[int(len(samples) * 0.99) - 1]:8.2f}ms  ({found} on first page)')
+
+
+if __name__ == '__main__':
+    main()
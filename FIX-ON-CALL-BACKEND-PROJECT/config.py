@@ -29,6 +29,28 @@ class Config:
         'pool_recycle': 3600,
         'pool_pre_ping': True,
     }
+
+    # Optional read replicas (comma-separated URLs) for dashboards, admin lists,
+    # exports and history pages; each gets its own pool. Lag is measured in the
+    # background every REPLICA_LAG_CHECK_SECONDS; replicas lagging more than
+    # REPLICA_MAX_LAG_SECONDS, or not checked for REPLICA_LAG_STALE_SECONDS, are
+    # skipped. A client that just wrote reads from the primary for
+    # REPLICA_STICKY_SECONDS. REPLICA_LAG_QUERY overrides the lag probe (SQL
+    # returning seconds behind the primary)
+    DATABASE_REPLICA_URLS = [
+        _normalize_database_url(url.strip())
+        for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    REPLICA_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('REPLICA_POOL_SIZE', 10)),
+        'pool_recycle': 3600,
+        'pool_pre_ping': True,
+    }
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+    REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', 10))
+    REPLICA_LAG_STALE_SECONDS = float(os.getenv('REPLICA_LAG_STALE_SECONDS', 30))
+    REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+    REPLICA_LAG_QUERY = os.getenv('REPLICA_LAG_QUERY')
     
     # JWT Configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-super-secret-jwt-key-change-this')
@@ -67,6 +89,92 @@ class Config:
     # Google Maps
     GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
+    # Mechanic spatial index (per process)
+    MECHANIC_INDEX_CELL_KM = float(os.getenv('MECHANIC_INDEX_CELL_KM', 2.0))
+    MECHANIC_INDEX_REFRESH_SECONDS = int(os.getenv('MECHANIC_INDEX_REFRESH_SECONDS', 300))
+
+    # Mechanic GPS pings are buffered in memory and written in bulk
+    LOCATION_FLUSH_INTERVAL_SECONDS = float(os.getenv('LOCATION_FLUSH_INTERVAL_SECONDS', 2.0))
+    LOCATION_FLUSH_MAX_ITEMS = int(os.getenv('LOCATION_FLUSH_MAX_ITEMS', 500))
+
+    # Background jobs (per process); a full queue makes callers run the job themselves
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 1000))
+
+    # Emergency alerts are fanned out to nearby mechanics in batches
+    ALERT_FANOUT_INTERVAL_SECONDS = float(os.getenv('ALERT_FANOUT_INTERVAL_SECONDS', 0.5))
+    ALERT_FANOUT_MAX_ITEMS = int(os.getenv('ALERT_FANOUT_MAX_ITEMS', 200))
+
+    # Dashboard counters are recounted from scratch this often (0 disables)
+    STATS_RECONCILE_INTERVAL_SECONDS = float(os.getenv('STATS_RECONCILE_INTERVAL_SECONDS', 3600))
+
+    # Event broker backend: 'postgres' relays events between worker processes
+    # through LISTEN/NOTIFY, 'local' stays in-process, 'auto' picks by database
+    BROKER_BACKEND = os.getenv('BROKER_BACKEND', 'auto')
+
+    # Server-sent event streams; clients reconnect after SSE_MAX_STREAM_SECONDS.
+    # EventSource cannot set headers, so stream endpoints also accept
+    # ?ticket=<stream ticket> from POST /api/auth/stream-ticket, valid for
+    # STREAM_TICKET_SECONDS and for nothing but opening streams
+    STREAM_TICKET_SECONDS = int(os.getenv('STREAM_TICKET_SECONDS', 60))
+    JWT_QUERY_STRING_NAME = 'ticket'
+    SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+    SSE_MAX_STREAM_SECONDS = float(os.getenv('SSE_MAX_STREAM_SECONDS', 300))
+
+    # Support chat message pages (?after_id / ?before_id) and long polls (?wait=<seconds>)
+    SUPPORT_MESSAGES_PER_PAGE = int(os.getenv('SUPPORT_MESSAGES_PER_PAGE', 50))
+    SUPPORT_MAX_MESSAGES_PER_PAGE = int(os.getenv('SUPPORT_MAX_MESSAGES_PER_PAGE', 200))
+    SUPPORT_MAX_WAIT_SECONDS = float(os.getenv('SUPPORT_MAX_WAIT_SECONDS', 30))
+
+    # Support chat messages (REST and WebSocket) are written in micro-batches of
+    # everything posted within SUPPORT_MESSAGE_FLUSH_SECONDS, then broadcast.
+    # Bodies stay under the Postgres broker's NOTIFY payload limit
+    SUPPORT_MESSAGE_FLUSH_SECONDS = float(os.getenv('SUPPORT_MESSAGE_FLUSH_SECONDS', 0.05))
+    SUPPORT_MESSAGE_BATCH_SIZE = int(os.getenv('SUPPORT_MESSAGE_BATCH_SIZE', 200))
+    SUPPORT_MESSAGE_COMMIT_TIMEOUT = float(os.getenv('SUPPORT_MESSAGE_COMMIT_TIMEOUT', 10))
+    SUPPORT_MAX_MESSAGE_CHARS = int(os.getenv('SUPPORT_MAX_MESSAGE_CHARS', 4000))
+    # Chat presence is refreshed by every socket at a third of this and
+    # forgotten after it, so a crashed worker's participants fade out
+    SUPPORT_PRESENCE_TTL_SECONDS = float(os.getenv('SUPPORT_PRESENCE_TTL_SECONDS', 30))
+
+    # Conversations closed this long ago move to the archive tables, in batches
+    # that take at most SUPPORT_ARCHIVE_DUTY_CYCLE of the archiver's time; the
+    # archiver runs every SUPPORT_ARCHIVE_INTERVAL_SECONDS (0: only on demand)
+    SUPPORT_ARCHIVE_AFTER_DAYS = float(os.getenv('SUPPORT_ARCHIVE_AFTER_DAYS', 90))
+    SUPPORT_ARCHIVE_BATCH_SIZE = int(os.getenv('SUPPORT_ARCHIVE_BATCH_SIZE', 500))
+    SUPPORT_ARCHIVE_DUTY_CYCLE = float(os.getenv('SUPPORT_ARCHIVE_DUTY_CYCLE', 0.5))
+    SUPPORT_ARCHIVE_INTERVAL_SECONDS = float(os.getenv('SUPPORT_ARCHIVE_INTERVAL_SECONDS', 0))
+
+    # Emails and SMS are queued in the notification_outbox table and sent by
+    # OUTBOX_WORKERS threads per process, in batches of OUTBOX_BATCH_SIZE with
+    # one SMTP connection per batch. Temporary failures are retried after
+    # OUTBOX_BACKOFF_SECONDS, doubling up to OUTBOX_MAX_BACKOFF_SECONDS; after
+    # OUTBOX_MAX_ATTEMPTS (or a permanent refusal) a message is dead-lettered.
+    # A worker's claim on a batch expires after OUTBOX_CLAIM_SECONDS
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 2))
+    OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+    OUTBOX_POLL_SECONDS = float(os.getenv('OUTBOX_POLL_SECONDS', 2))
+    OUTBOX_CLAIM_SECONDS = float(os.getenv('OUTBOX_CLAIM_SECONDS', 300))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+    OUTBOX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_BACKOFF_SECONDS', 30))
+    OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv('OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+    # Sent messages are kept this long, purged every OUTBOX_PURGE_INTERVAL_SECONDS (0 disables)
+    OUTBOX_RETENTION_DAYS = float(os.getenv('OUTBOX_RETENTION_DAYS', 7))
+    OUTBOX_PURGE_INTERVAL_SECONDS = float(os.getenv('OUTBOX_PURGE_INTERVAL_SECONDS', 3600))
+
+    # Admin read endpoints are cached for this long and invalidated on writes
+    # (0 disables). 'redis' shares the cache between workers; 'auto' uses it
+    # when RESPONSE_CACHE_REDIS_URL is set
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 30))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 512))
+    RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'auto')
+    RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL')
+
+    # Role / active-flag lookups for authorization are cached per worker for
+    # this long (0 disables); a suspension reaches other workers within it
+    PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv('PRINCIPAL_CACHE_TTL_SECONDS', 60))
+    PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv('PRINCIPAL_CACHE_MAX_ENTRIES', 10000))
+
     # CORS
     CORS_ALLOWED_ORIGINS = _parse_origins(os.getenv(
         'CORS_ALLOWED_ORIGINS',
@@ -4,6 +4,7 @@ Database initialization script for Fix On Call
 Creates all tables and indexes for PostgreSQL
 """
 
+from flask_migrate import upgrade
 from app import create_app
 from database import db
 from models import User, Service, Booking, Payment, Notification, EmergencyAlert
@@ -21,6 +22,9 @@ def init_database():
         # Create all tables
         db.create_all()
         
+        # Bring tables created by an older release up to date
+        upgrade()
+        
         # Create additional indexes for performance
         print("📊 Creating indexes...")
         
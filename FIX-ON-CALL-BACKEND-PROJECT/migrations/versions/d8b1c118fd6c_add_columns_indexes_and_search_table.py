@@ -0,0 +1,402 @@
+"""Add the columns, tables, indexes and search table introduced since the first release
+
+Databases made by an older release were created with db.create_all(), which
+never alters an existing table. Each step checks the live schema first, so
+this also applies cleanly to a database that already has some of them.
+
+The schema and the backfills are written out as of this revision, without
+the models or app helpers, so later model changes do not alter it.
+
+Revision ID: d8b1c118fd6c
+Revises:
+Create Date: 2026-10-17 18:40:12.415733
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b1c118fd6c'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+CLOSED_STATUSES = ('closed', 'resolved')
+COUNTRY_CODE = '254'
+SEARCH_TABLE = 'support_search'
+SEARCH_DDL = {
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "conversation_id INTEGER PRIMARY KEY, "
+        "header TSVECTOR NOT NULL DEFAULT ''::tsvector, "
+        "body TSVECTOR NOT NULL DEFAULT ''::tsvector)",
+        f"CREATE INDEX IF NOT EXISTS idx_support_search_document ON {SEARCH_TABLE} USING gin ((header || body))",
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(header, body)",
+    ],
+}
+
+# (index, table, columns) added to tables of the first release
+NEW_INDEXES = [
+    ('idx_users_type_lat_lon', 'users', ['user_type', 'lat', 'lon']),
+    ('idx_users_created_id', 'users', ['created_at', 'id']),
+    ('idx_services_created_id', 'services', ['created_at', 'id']),
+    ('idx_services_status_created_id', 'services', ['status', 'created_at', 'id']),
+    ('idx_services_user_created_id', 'services', ['user_id', 'created_at', 'id']),
+    ('idx_bookings_user_created_id', 'bookings', ['user_id', 'created_at', 'id']),
+    ('idx_bookings_mechanic_created_id', 'bookings', ['mechanic_id', 'created_at', 'id']),
+    ('idx_notifications_recipient_created_id', 'notifications', ['recipient_id', 'created_at', 'id']),
+    ('idx_support_conversations_updated_id', 'support_conversations', ['updated_at', 'id']),
+    ('idx_support_conversations_status_updated_id', 'support_conversations', ['status', 'updated_at', 'id']),
+    ('ix_support_conversations_closed_at', 'support_conversations', ['closed_at']),
+    ('idx_support_messages_conversation_id_id', 'support_messages', ['conversation_id', 'id']),
+]
+
+users = sa.table(
+    'users',
+    sa.column('id', sa.Integer), sa.column('name', sa.String), sa.column('email', sa.String),
+    sa.column('phone', sa.String), sa.column('location', sa.JSON), sa.column('current_location', sa.JSON),
+    sa.column('lat', sa.Float), sa.column('lon', sa.Float), sa.column('search_text', sa.Text),
+)
+conversations = sa.table(
+    'support_conversations',
+    sa.column('id', sa.Integer), sa.column('status', sa.String), sa.column('tags', sa.String),
+    sa.column('customer_name', sa.String), sa.column('customer_email', sa.String),
+    sa.column('customer_phone', sa.String), sa.column('request_id', sa.String),
+    sa.column('updated_at', sa.DateTime), sa.column('closed_at', sa.DateTime),
+    sa.column('last_message', sa.Text), sa.column('last_message_at', sa.DateTime),
+    sa.column('message_count', sa.Integer),
+)
+messages = sa.table(
+    'support_messages',
+    sa.column('id', sa.Integer), sa.column('conversation_id', sa.Integer),
+    sa.column('body', sa.Text), sa.column('created_at', sa.DateTime),
+)
+conversation_tags = sa.table(
+    'support_conversation_tags', sa.column('conversation_id', sa.Integer), sa.column('tag', sa.String),
+)
+
+
+# ----------------------------------------------------------------------
+# Text and position helpers, as of this revision
+# ----------------------------------------------------------------------
+def coordinates(location):
+    if not isinstance(location, dict):
+        return None
+    try:
+        latitude, longitude = float(location['latitude']), float(location['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def words(value):
+    return re.findall(r'[^\W_]+', (value or '').lower())
+
+
+def normalize_phone(value):
+    digits = re.sub(r'\D', '', value or '')
+    if not digits or digits.startswith(COUNTRY_CODE):
+        return digits
+    if digits.startswith('0'):
+        return COUNTRY_CODE + digits[1:]
+    if digits[0] in '17':
+        return COUNTRY_CODE + digits
+    return digits
+
+
+def search_text(name, email, phone):
+    found = words(name) + words(email)
+    phone = normalize_phone(phone)
+    if phone:
+        found.append(phone)
+    return ' '.join(dict.fromkeys(found))
+
+
+# ----------------------------------------------------------------------
+# Backfills
+# ----------------------------------------------------------------------
+def batches(bind, table, *columns, where=None):
+    """Rows of a table in id order, BATCH_SIZE at a time"""
+    last_id = 0
+    while True:
+        query = sa.select(table.c.id, *columns).where(table.c.id > last_id)
+        if where is not None:
+            query = query.where(where)
+        rows = bind.execute(query.order_by(table.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def backfill_user_coordinates(bind):
+    """lat/lon from current_location when it has coordinates, otherwise from location"""
+    statement = users.update().where(users.c.id == sa.bindparam('user_id')).values(
+        lat=sa.bindparam('new_lat'), lon=sa.bindparam('new_lon')
+    )
+    for rows in batches(bind, users, users.c.location, users.c.current_location):
+        values = []
+        for row in rows:
+            position = coordinates(row.current_location) or coordinates(row.location)
+            if position:
+                values.append({'user_id': row.id, 'new_lat': position[0], 'new_lon': position[1]})
+        if values:
+            bind.execute(statement, values)
+
+
+def backfill_user_search_text(bind):
+    statement = users.update().where(users.c.id == sa.bindparam('user_id')).values(
+        search_text=sa.bindparam('new_search_text')
+    )
+    for rows in batches(bind, users, users.c.name, users.c.email, users.c.phone):
+        bind.execute(statement, [
+            {'user_id': row.id, 'new_search_text': search_text(row.name, row.email, row.phone)} for row in rows
+        ])
+
+
+def backfill_support_tags(bind):
+    """One lower-cased row per tag in the comma-separated tags column"""
+    for rows in batches(bind, conversations, conversations.c.tags, where=conversations.c.tags.isnot(None)):
+        values = [
+            {'conversation_id': row.id, 'tag': tag}
+            for row in rows
+            for tag in sorted({t.strip().lower() for t in row.tags.split(',') if t.strip()})
+        ]
+        if values:
+            bind.execute(conversation_tags.insert(), values)
+
+
+def backfill_support_message_summary(bind):
+    conversation_messages = messages.c.conversation_id == conversations.c.id
+    latest = sa.select(messages.c.created_at).where(conversation_messages).order_by(
+        messages.c.created_at.desc(), messages.c.id.desc()
+    ).limit(1)
+    bind.execute(conversations.update().values(
+        message_count=sa.select(sa.func.count()).where(conversation_messages).scalar_subquery(),
+        last_message_at=latest.scalar_subquery(),
+        last_message=latest.with_only_columns(messages.c.body).scalar_subquery(),
+    ))
+
+
+def backfill_support_closed_at(bind):
+    """Date closed conversations by their last update"""
+    bind.execute(conversations.update().where(
+        conversations.c.status.in_(CLOSED_STATUSES), conversations.c.closed_at.is_(None)
+    ).values(closed_at=conversations.c.updated_at))
+
+
+def backfill_support_search(bind):
+    """A document per conversation: its customer fields and request id, then its messages"""
+    if bind.dialect.name == 'postgresql':
+        statement = sa.text(
+            f"INSERT INTO {SEARCH_TABLE} (conversation_id, header, body) VALUES "
+            "(:id, setweight(to_tsvector('simple', :header), 'A'), to_tsvector('simple', :body))"
+        )
+    else:
+        statement = sa.text(f'INSERT INTO {SEARCH_TABLE} (rowid, header, body) VALUES (:id, :header, :body)')
+    fields = (conversations.c.customer_name, conversations.c.customer_email,
+              conversations.c.customer_phone, conversations.c.request_id)
+    for rows in batches(bind, conversations, *fields):
+        bodies = {}
+        for conversation_id, body in bind.execute(
+            sa.select(messages.c.conversation_id, messages.c.body)
+            .where(messages.c.conversation_id.in_([row.id for row in rows]))
+            .order_by(messages.c.conversation_id, messages.c.created_at, messages.c.id)
+        ):
+            bodies.setdefault(conversation_id, []).append(' '.join(words(body)))
+        bind.execute(statement, [{
+            'id': row.id,
+            'header': ' '.join(filter(None, [
+                search_text(row.customer_name, row.customer_email, row.customer_phone),
+                ' '.join(words(row.request_id)),
+            ])),
+            'body': ' '.join(bodies.get(row.id, [])),
+        } for row in rows])
+
+
+# ----------------------------------------------------------------------
+# Schema
+# ----------------------------------------------------------------------
+def create_tables(bind):
+    """The tables added since the first release, those missing; returns the names created"""
+    existing = set(sa.inspect(bind).get_table_names())
+    created = []
+
+    def create(name, *columns, indexes=()):
+        if name in existing:
+            return
+        op.create_table(name, *columns)
+        for index, index_columns in indexes:
+            op.create_index(index, name, index_columns)
+        created.append(name)
+
+    create(
+        'stat_counters',
+        sa.Column('name', sa.String(100), primary_key=True),
+        sa.Column('shard', sa.SmallInteger(), primary_key=True),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    create(
+        'revenue_daily',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('shard', sa.SmallInteger(), primary_key=True),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('payment_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    create(
+        'support_conversation_tags',
+        sa.Column('conversation_id', sa.Integer(),
+                  sa.ForeignKey('support_conversations.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('tag', sa.String(100), primary_key=True),
+        indexes=[('ix_support_conversation_tags_tag', ['tag', 'conversation_id'])],
+    )
+    create(
+        'support_conversations_archive',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('channel', sa.String(30), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('user_id', sa.Integer()),
+        sa.Column('customer_name', sa.String(150), nullable=False),
+        sa.Column('customer_email', sa.String(150)),
+        sa.Column('customer_phone', sa.String(30)),
+        sa.Column('inquiry_type', sa.String(100)),
+        sa.Column('request_id', sa.String(100)),
+        sa.Column('assigned_to', sa.String(100)),
+        sa.Column('tags', sa.String(255)),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+        sa.Column('last_message', sa.Text()),
+        sa.Column('last_message_at', sa.DateTime()),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('closed_at', sa.DateTime()),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        indexes=[
+            ('ix_support_conversations_archive_user_id', ['user_id']),
+            ('ix_support_conversations_archive_request_id', ['request_id']),
+            ('ix_support_conversations_archive_closed_at', ['closed_at']),
+            ('ix_support_conversations_archive_archived_at', ['archived_at']),
+        ],
+    )
+    create(
+        'support_messages_archive',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('conversation_id', sa.Integer(),
+                  sa.ForeignKey('support_conversations_archive.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('sender', sa.String(20), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime()),
+        indexes=[('idx_support_messages_archive_conversation_id_id', ['conversation_id', 'id'])],
+    )
+    create(
+        'notification_outbox',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('channel', sa.String(10), nullable=False),
+        sa.Column('recipient', sa.String(255), nullable=False),
+        sa.Column('subject', sa.String(255)),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.Column('claim_token', sa.String(32)),
+        sa.Column('last_error', sa.Text()),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('sent_at', sa.DateTime()),
+        indexes=[
+            ('idx_notification_outbox_status_next_attempt', ['status', 'next_attempt_at', 'id']),
+            ('ix_notification_outbox_sent_at', ['sent_at']),
+        ],
+    )
+    return created
+
+
+def add_columns(bind):
+    """The columns added to tables of the first release, those missing; returns the backfills they need"""
+    inspector = sa.inspect(bind)
+    user_columns = {c['name'] for c in inspector.get_columns('users')}
+    conversation_columns = {c['name'] for c in inspector.get_columns('support_conversations')}
+    backfills = []
+
+    if not {'lat', 'lon'} <= user_columns:
+        for name in ('lat', 'lon'):
+            if name not in user_columns:
+                op.add_column('users', sa.Column(name, sa.Float()))
+        backfills.append(backfill_user_coordinates)
+    if 'search_text' not in user_columns:
+        op.add_column('users', sa.Column('search_text', sa.Text()))
+        backfills.append(backfill_user_search_text)
+
+    for name, type_ in [('last_message', sa.Text()), ('last_message_at', sa.DateTime())]:
+        if name not in conversation_columns:
+            op.add_column('support_conversations', sa.Column(name, type_))
+    if 'message_count' not in conversation_columns:
+        op.add_column('support_conversations',
+                      sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+        backfills.append(backfill_support_message_summary)
+    if 'closed_at' not in conversation_columns:
+        op.add_column('support_conversations', sa.Column('closed_at', sa.DateTime()))
+        backfills.append(backfill_support_closed_at)
+    return backfills
+
+
+def is_empty(bind, table):
+    return bind.execute(sa.text(f'SELECT 1 FROM {table} LIMIT 1')).first() is None
+
+
+def upgrade():
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    backfills = add_columns(bind)
+    create_tables(bind)
+
+    inspector = sa.inspect(bind)
+    existing = {
+        table: {i['name'] for i in inspector.get_indexes(table)} for table in {t for _, t, _ in NEW_INDEXES}
+    }
+    for name, table, columns in NEW_INDEXES:
+        if name not in existing[table]:
+            op.create_index(name, table, columns)
+    if dialect == 'postgresql' and 'idx_users_search' not in existing['users']:
+        op.create_index(
+            'idx_users_search', 'users', [sa.text("to_tsvector('simple', coalesce(search_text, ''))")],
+            postgresql_using='gin'
+        )
+
+    if is_empty(bind, 'support_conversation_tags'):
+        backfills.append(backfill_support_tags)
+    if dialect in SEARCH_DDL:
+        for statement in SEARCH_DDL[dialect]:
+            op.execute(statement)
+        if is_empty(bind, SEARCH_TABLE):
+            backfills.append(backfill_support_search)
+
+    for backfill in backfills:
+        backfill(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    op.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    for table in ('notification_outbox', 'support_messages_archive', 'support_conversations_archive',
+                  'support_conversation_tags', 'revenue_daily', 'stat_counters'):
+        op.drop_table(table)
+
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('idx_users_search', table_name='users')
+    for name, table, _ in reversed(NEW_INDEXES):
+        op.drop_index(name, table_name=table)
+    with op.batch_alter_table('users') as batch:
+        for column in ('search_text', 'lon', 'lat'):
+            batch.drop_column(column)
+    with op.batch_alter_table('support_conversations') as batch:
+        for column in ('closed_at', 'message_count', 'last_message_at', 'last_message'):
+            batch.drop_column(column)
@@ -2,7 +2,11 @@ from models.user import User
 from models.service import Service, EmergencyAlert
 from models.booking import Booking
 from models.payment import Payment, Notification
-from models.support import SupportConversation, SupportMessage
+from models.support import (
+    SupportConversation, SupportConversationArchive, SupportConversationTag, SupportMessage, SupportMessageArchive
+)
+from models.stats import StatCounter, RevenueDaily
+from models.outbox import OutboxMessage
 
 __all__ = [
     'User',
@@ -12,5 +16,11 @@ __all__ = [
     'Payment',
     'Notification',
     'SupportConversation',
+    'SupportConversationTag',
     'SupportMessage',
+    'SupportConversationArchive',
+    'SupportMessageArchive',
+    'StatCounter',
+    'RevenueDaily',
+    'OutboxMessage',
 ]
@@ -4,6 +4,11 @@ from sqlalchemy.dialects.postgresql import JSON
 
 class Booking(db.Model):
     __tablename__ = 'bookings'
+    __table_args__ = (
+        # Keyset pagination order (created_at DESC, id DESC) for drivers and mechanics
+        db.Index('idx_bookings_user_created_id', 'user_id', 'created_at', 'id'),
+        db.Index('idx_bookings_mechanic_created_id', 'mechanic_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
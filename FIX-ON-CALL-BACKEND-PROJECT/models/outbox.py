@@ -0,0 +1,49 @@
+from datetime import datetime
+from database import db
+
+# Channels
+OUTBOX_EMAIL = 'email'
+OUTBOX_SMS = 'sms'
+
+# States: pending -> sending -> sent, or back to pending for a retry, or dead once retries run out
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENDING = 'sending'
+OUTBOX_SENT = 'sent'
+OUTBOX_DEAD = 'dead'
+
+class OutboxMessage(db.Model):
+    """An email or SMS queued for the outbox workers (utils.outbox)"""
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        # Workers claim due messages (pending, or sending with an expired claim) in this order
+        db.Index('idx_notification_outbox_status_next_attempt', 'status', 'next_attempt_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False, default=OUTBOX_EMAIL)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255))
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=OUTBOX_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # When a worker may next pick the message up: the retry time while pending,
+    # the end of the claim while sending
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'channel': self.channel,
+            'recipient': self.recipient,
+            'subject': self.subject,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+        }
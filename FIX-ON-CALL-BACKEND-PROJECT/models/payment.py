@@ -36,6 +36,10 @@ class Payment(db.Model):
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # Keyset pagination order (created_at DESC, id DESC) per recipient
+        db.Index('idx_notifications_recipient_created_id', 'recipient_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -4,6 +4,12 @@ from sqlalchemy.dialects.postgresql import JSON
 
 class Service(db.Model):
     __tablename__ = 'services'
+    __table_args__ = (
+        # Keyset pagination order (created_at DESC, id DESC): admin list, by status, per-user history
+        db.Index('idx_services_created_id', 'created_at', 'id'),
+        db.Index('idx_services_status_created_id', 'status', 'created_at', 'id'),
+        db.Index('idx_services_user_created_id', 'user_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -0,0 +1,38 @@
+from datetime import datetime
+from database import db
+
+class StatCounter(db.Model):
+    """One shard of a named counter; a counter's value is the sum over its shards"""
+    __tablename__ = 'stat_counters'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, default=0)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'shard': self.shard,
+            'value': self.value,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+class RevenueDaily(db.Model):
+    """One shard of a day's completed-payment revenue (bucketed by payment created_at)"""
+    __tablename__ = 'revenue_daily'
+    
+    day = db.Column(db.Date, primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat() if self.day else None,
+            'shard': self.shard,
+            'amount': self.amount,
+            'payment_count': self.payment_count,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
@@ -1,9 +1,24 @@
 from datetime import datetime
+from sqlalchemy.orm import validates
 from database import db
 
 
+# Statuses after which a conversation can be archived (once closed_at is old enough)
+CLOSED_STATUSES = ("closed", "resolved")
+
+
+def split_tags(value):
+    """Tags from the comma-separated tags column, as entered"""
+    return [t.strip() for t in (value or "").split(",") if t.strip()]
+
+
 class SupportConversation(db.Model):
     __tablename__ = "support_conversations"
+    __table_args__ = (
+        # Inbox order (updated_at DESC, id DESC), overall and per status
+        db.Index("idx_support_conversations_updated_id", "updated_at", "id"),
+        db.Index("idx_support_conversations_status_updated_id", "status", "updated_at", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     channel = db.Column(db.String(30), nullable=False, default="live_chat", index=True)
@@ -18,6 +33,12 @@ class SupportConversation(db.Model):
     tags = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Summary of the messages, kept in step by record_message() so lists never load them
+    last_message = db.Column(db.Text, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    # When the conversation last entered a closed status; None while open
+    closed_at = db.Column(db.DateTime, nullable=True, index=True)
 
     messages = db.relationship(
         "SupportMessage",
@@ -26,9 +47,55 @@ class SupportConversation(db.Model):
         order_by="SupportMessage.created_at.asc()",
         lazy=True,
     )
+    # One row per lower-cased tag, kept in step with the tags column for indexed filtering
+    tag_links = db.relationship(
+        "SupportConversationTag",
+        cascade="all, delete-orphan",
+        lazy=True,
+    )
+
+    @validates("status")
+    def validate_status(self, key, value):
+        if value in CLOSED_STATUSES:
+            if self.status not in CLOSED_STATUSES or self.closed_at is None:
+                self.closed_at = datetime.utcnow()
+        else:
+            self.closed_at = None
+        return value
+
+    @validates("tags")
+    def validate_tags(self, key, value):
+        self._set_tag_links(value)
+        return value
+
+    def sync_tag_links(self):
+        """Rebuild tag_links from the tags column (for rows written before the tag table existed)"""
+        self._set_tag_links(self.tags)
+
+    def _set_tag_links(self, value):
+        wanted = {t.lower() for t in split_tags(value)}
+        for link in list(self.tag_links):
+            if link.tag not in wanted:
+                self.tag_links.remove(link)
+        current = {link.tag for link in self.tag_links}
+        for tag in sorted(wanted - current):
+            self.tag_links.append(SupportConversationTag(tag=tag))
+
+    def record_message(self, message):
+        """Update the message summary for a new message of this conversation"""
+        self.record_messages([message])
+
+    def record_messages(self, messages):
+        """Update the message summary for new messages of this conversation, in posting order"""
+        # The newest message; the last posted among equal timestamps
+        latest = max(reversed(messages), key=lambda m: m.created_at)
+        self.last_message = latest.body
+        self.last_message_at = latest.created_at
+        # Incremented in SQL so concurrent posts are all counted
+        self.message_count = SupportConversation.message_count + len(messages)
+        self.updated_at = latest.created_at
 
     def to_dict(self):
-        last_message = self.messages[-1] if self.messages else None
         return {
             "id": self.id,
             "channel": self.channel,
@@ -40,17 +107,34 @@ class SupportConversation(db.Model):
             "inquiry_type": self.inquiry_type,
             "request_id": self.request_id,
             "assigned_to": self.assigned_to or "Unassigned",
-            "tags": [t.strip() for t in (self.tags or "").split(",") if t.strip()],
-            "last_message": last_message.body if last_message else "",
-            "last_message_at": last_message.created_at.isoformat() if last_message else None,
+            "tags": split_tags(self.tags),
+            "last_message": self.last_message or "",
+            "last_message_at": self.last_message_at.isoformat() if self.last_message_at else None,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
-            "message_count": len(self.messages),
+            "message_count": self.message_count or 0,
+            "closed_at": self.closed_at.isoformat() if self.closed_at else None,
         }
 
 
+class SupportConversationTag(db.Model):
+    __tablename__ = "support_conversation_tags"
+    __table_args__ = (
+        db.Index("ix_support_conversation_tags_tag", "tag", "conversation_id"),
+    )
+
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey("support_conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    tag = db.Column(db.String(100), primary_key=True)
+
+
 class SupportMessage(db.Model):
     __tablename__ = "support_messages"
+    __table_args__ = (
+        # A conversation's messages in id order, for ?after_id / ?before_id pages
+        db.Index("idx_support_messages_conversation_id_id", "conversation_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(
@@ -69,3 +153,49 @@ class SupportMessage(db.Model):
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
 
+
+
+class SupportConversationArchive(db.Model):
+    """Closed conversations moved out of support_conversations by utils.support_archive"""
+    __tablename__ = "support_conversations_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    channel = db.Column(db.String(30), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+    customer_name = db.Column(db.String(150), nullable=False)
+    customer_email = db.Column(db.String(150), nullable=True)
+    customer_phone = db.Column(db.String(30), nullable=True)
+    inquiry_type = db.Column(db.String(100), nullable=True)
+    request_id = db.Column(db.String(100), nullable=True, index=True)
+    assigned_to = db.Column(db.String(100), nullable=True)
+    tags = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    last_message = db.Column(db.Text, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    closed_at = db.Column(db.DateTime, nullable=True, index=True)
+    archived_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        data = SupportConversation.to_dict(self)
+        data["archived_at"] = self.archived_at.isoformat() if self.archived_at else None
+        return data
+
+
+class SupportMessageArchive(db.Model):
+    __tablename__ = "support_messages_archive"
+    __table_args__ = (
+        db.Index("idx_support_messages_archive_conversation_id_id", "conversation_id", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey("support_conversations_archive.id", ondelete="CASCADE"), nullable=False
+    )
+    sender = db.Column(db.String(20), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+
+    to_dict = SupportMessage.to_dict
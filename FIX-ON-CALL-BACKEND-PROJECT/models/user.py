@@ -1,10 +1,24 @@
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from database import db
+from sqlalchemy import event
 from sqlalchemy.dialects.postgresql import JSON
+from utils.geolocation import extract_coordinates
+from utils.search import search_text_for
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('idx_users_type_lat_lon', 'user_type', 'lat', 'lon'),
+        # Keyset pagination order (created_at DESC, id DESC)
+        db.Index('idx_users_created_id', 'created_at', 'id'),
+        # Word-prefix search over search_text (see utils.search); Postgres only
+        db.Index(
+            'idx_users_search',
+            db.text("to_tsvector('simple', coalesce(search_text, ''))"),
+            postgresql_using='gin'
+        ).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
@@ -36,6 +50,11 @@ class User(db.Model):
     tools_available = db.Column(JSON)
     hourly_rate = db.Column(db.Float)
     current_location = db.Column(JSON)
+    # Numeric mirror of current_location (falling back to location) for indexed bounding-box queries
+    lat = db.Column(db.Float)
+    lon = db.Column(db.Float)
+    # Normalized name/email words and international phone digits for admin search
+    search_text = db.Column(db.Text)
     
     # Partner specific fields
     company_name = db.Column(db.String(200))
@@ -54,6 +73,14 @@ class User(db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
+    def sync_coordinates(self):
+        """Copy the effective position from the JSON location fields into lat/lon"""
+        position = extract_coordinates(self.current_location) or extract_coordinates(self.location)
+        self.lat, self.lon = position if position else (None, None)
+    
+    def sync_search_text(self):
+        self.search_text = search_text_for(self.name, self.email, self.phone)
+    
     def to_dict(self):
         data = {
             'id': self.id,
@@ -95,3 +122,10 @@ class User(db.Model):
             })
         
         return data
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def _sync_user_derived_columns(mapper, connection, target):
+    target.sync_coordinates()
+    target.sync_search_text()
@@ -1,86 +1,64 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.user import User
 from models.service import Service
-from models.payment import Payment
-from models.support import SupportConversation
+from models.support import SupportConversationArchive, SupportMessageArchive
 from database import db
-from datetime import datetime
-from sqlalchemy import func
+from datetime import date, datetime, timedelta
+from utils.bulk_actions import BULK_ACTIONS, BULK_BATCH_SIZE, InvalidSelection, iter_bulk_action, run_bulk_action
+from utils.cache import response_cache
+from utils.dispatch import run_dispatch
+from utils.export import EXPORT_FORMATS, InvalidExport, export_query, stream_export
+from utils.outbox import notification_outbox, queue_summary
+from utils.pagination import InvalidCursor, paginate_request
+from utils.principals import require_role
+from utils.replicas import replica_reads, replica_router
+from utils.search import search_clause, search_is_selective
+from utils.support_archive import search_archive, support_archiver, table_sizes
+from utils.revenue import GRANULARITIES, revenue_rollup
+from utils.stats import ACTIVE_SERVICE_STATUSES, stat_counters
 
 admin_bp = Blueprint('admin', __name__)
 
-def is_admin(user_id):
-    user = User.query.get(user_id)
-    return user and user.user_type == 'admin'
+# Longest range served at day granularity (one bucket per day)
+MAX_REVENUE_DAYS = 366 * 3
+# Longest archive run served by one request; larger backlogs take several
+MAX_ARCHIVE_REQUEST_SECONDS = 25
 
 @admin_bp.route('/dashboard', methods=['GET'])
 @jwt_required()
+@require_role('admin')
+@response_cache.cached('users', 'services', 'payments', 'support')
+@replica_reads
 def dashboard():
     try:
-        jwt_identity = get_jwt_identity()
-        try:
-            current_user_id = int(jwt_identity)
-        except (TypeError, ValueError):
-            return jsonify({'success': False, 'error': 'Invalid token identity'}), 401
-        
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-        
-        total_users = User.query.count()
-        total_mechanics = User.query.filter_by(user_type='mechanic').count()
-        total_partners = User.query.filter_by(user_type='partner').count()
-        approved_partner_apps = SupportConversation.query.filter_by(channel='partner_application').all()
-        approved_partner_apps_count = sum(
-            1 for app in approved_partner_apps
-            if any(tag.strip().lower() == 'approved' for tag in (app.tags or '').split(','))
-        )
-        total_partners += approved_partner_apps_count
-        total_services = Service.query.count()
-        active_services = Service.query.filter(
-            Service.status.in_(['pending', 'accepted', 'confirmed', 'dispatched', 'arrived', 'in_progress', 'in_service'])
-        ).count()
+        # Materialized counters: a handful of rows instead of recounting the tables
+        counters = stat_counters.read()
+        total_users = counters.get('users', 0)
+        total_mechanics = counters.get('users:type:mechanic', 0)
+        total_partners = counters.get('users:type:partner', 0) + counters.get('partner_applications:approved', 0)
+        total_services = counters.get('services', 0)
+        active_services = sum(counters.get(f'services:status:{status}', 0) for status in ACTIVE_SERVICE_STATUSES)
         
         recent_services = Service.query.order_by(Service.created_at.desc()).limit(10).all()
         
-        service_types = db.session.query(
-            Service.service_type, func.count(Service.id).label('count')
-        ).group_by(Service.service_type).order_by(func.count(Service.id).desc()).all()
+        service_types = sorted(
+            ((name[len('services:type:'):], count) for name, count in counters.items()
+             if name.startswith('services:type:') and count),
+            key=lambda item: item[1],
+            reverse=True
+        )
 
-        # Revenue trend: last 12 months, grouped by month from completed payments
+        # Revenue trend: 12 months from March, summed in SQL from the daily rollup
         now = datetime.utcnow()
-        # Keep dashboard trend anchored from March.
-        trend_start = datetime(now.year, 3, 1)
-
-        # Aggregate in Python to avoid DB-specific date functions causing 500s.
-        revenue_rows = db.session.query(
-            Payment.created_at,
-            Payment.amount
-        ).filter(
-            Payment.status == 'completed',
-            Payment.created_at >= trend_start
-        ).all()
-
-        revenue_map = {}
-        for created_at, amount in revenue_rows:
-            if not created_at:
-                continue
-            key = created_at.strftime('%Y-%m')
-            revenue_map[key] = revenue_map.get(key, 0.0) + float(amount or 0.0)
-
+        trend_start = date(now.year, 3, 1)
+        trend_end = date(now.year + 1, 3, 1) - timedelta(days=1)
         month_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        revenue_trend = []
-        cursor = trend_start
-        for _ in range(12):
-            key = cursor.strftime('%Y-%m')
-            revenue_trend.append({
-                'label': month_labels[cursor.month - 1],
-                'value': round(revenue_map.get(key, 0), 2)
-            })
-            if cursor.month == 12:
-                cursor = datetime(cursor.year + 1, 1, 1)
-            else:
-                cursor = datetime(cursor.year, cursor.month + 1, 1)
+        revenue_trend = [
+            {'label': month_labels[bucket['start'].month - 1], 'value': bucket['amount']}
+            for bucket in revenue_rollup.series(trend_start, trend_end, 'month')
+        ]
         
         return jsonify({
             'success': True,
@@ -100,53 +78,42 @@ def dashboard():
 
 @admin_bp.route('/users', methods=['GET'])
 @jwt_required()
+@require_role('admin')
+@response_cache.cached('users')
+@replica_reads
 def get_users():
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-        
         user_type = request.args.get('user_type')
         is_active = request.args.get('is_active')
         search = request.args.get('search')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
         query = User.query
         
         if user_type:
             query = query.filter_by(user_type=user_type)
         if is_active:
             query = query.filter_by(is_active=is_active.lower() == 'true')
+        # Few matches: find them through the search index and sort; many: filter the newest-first walk
+        selective = bool(search) and search_is_selective(search, db.engine.dialect.name)
         if search:
-            query = query.filter(
-                db.or_(
-                    User.name.ilike(f'%{search}%'),
-                    User.email.ilike(f'%{search}%'),
-                    User.phone.ilike(f'%{search}%')
-                )
-            )
+            query = query.filter(search_clause(User.search_text, search, indexed=selective))
         
-        pagination = query.order_by(User.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        users, pagination = paginate_request(query, User.created_at, User.id, sort_matches=selective)
         
         return jsonify({
             'success': True,
-            'users': [u.to_dict() for u in pagination.items],
-            'pagination': {'page': page, 'per_page': per_page, 'total': pagination.total, 'pages': pagination.pages}
+            'users': [u.to_dict() for u in users],
+            'pagination': pagination
         }), 200
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @admin_bp.route('/users/<int:user_id>/toggle-active', methods=['POST'])
 @jwt_required()
+@require_role('admin')
 def toggle_user_active(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-        
         user = User.query.get(user_id)
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
@@ -166,13 +133,9 @@ def toggle_user_active(user_id):
 
 @admin_bp.route('/users/<int:user_id>/suspend', methods=['POST'])
 @jwt_required()
+@require_role('admin')
 def suspend_user(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
-
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-
         user = User.query.get(user_id)
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
@@ -188,13 +151,9 @@ def suspend_user(user_id):
 
 @admin_bp.route('/users/<int:user_id>/ban', methods=['POST'])
 @jwt_required()
+@require_role('admin')
 def ban_user(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
-
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-
         user = User.query.get(user_id)
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
@@ -210,13 +169,9 @@ def ban_user(user_id):
 
 @admin_bp.route('/users/<int:user_id>/activate', methods=['POST'])
 @jwt_required()
+@require_role('admin')
 def activate_user(user_id):
     try:
-        current_user_id = int(get_jwt_identity())
-
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-
         user = User.query.get(user_id)
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
@@ -230,19 +185,67 @@ def activate_user(user_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@admin_bp.route('/users/bulk', methods=['POST'])
+@jwt_required()
+@require_role('admin')
+def bulk_user_action():
+    """
+    Suspend, ban, activate or toggle many users with one set-based update
+    Body: {'action', 'user_ids': [...]} or {'action', 'filter': {user_type, created_from,
+    created_to, is_active}}; 'stream': true runs committed batches of 'batch_size' ids
+    above 'after_id' and streams NDJSON progress lines instead.
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+
+        data = request.get_json(silent=True) or {}
+        action = data.get('action')
+        if action not in BULK_ACTIONS:
+            return jsonify({'success': False, 'error': f'action must be one of {", ".join(BULK_ACTIONS)}'}), 400
+        selection = {'user_ids': data.get('user_ids'), 'filters': data.get('filter')}
+
+        if not data.get('stream'):
+            result = run_bulk_action(action, actor_id=current_user_id, **selection)
+            return jsonify({'success': True, **result}), 200
+
+        batch_size = data.get('batch_size', BULK_BATCH_SIZE)
+        after_id = data.get('after_id', 0)
+        if not isinstance(batch_size, int) or not 1 <= batch_size <= BULK_BATCH_SIZE:
+            return jsonify({'success': False, 'error': f'batch_size must be between 1 and {BULK_BATCH_SIZE}'}), 400
+        if not isinstance(after_id, int):
+            return jsonify({'success': False, 'error': 'after_id must be an integer'}), 400
+        progress = iter_bulk_action(
+            action, actor_id=current_user_id, batch_size=batch_size, after_id=after_id, **selection
+        )
+
+        def lines():
+            try:
+                for event in progress:
+                    yield json.dumps(event) + '\n'
+            except Exception as e:
+                # Earlier batches stay committed; the client resumes from the last reported last_id
+                db.session.rollback()
+                yield json.dumps({'event': 'error', 'error': str(e)}) + '\n'
+
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+    except InvalidSelection as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @admin_bp.route('/services', methods=['GET'])
 @jwt_required()
+@require_role('admin')
+@response_cache.cached('services')
+@replica_reads
 def admin_services():
     try:
-        current_user_id = int(get_jwt_identity())
-        
-        if not is_admin(current_user_id):
-            return jsonify({'success': False, 'error': 'Admin access required'}), 403
-        
         status = request.args.get('status')
         service_type = request.args.get('service_type')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         
         query = Service.query
         
@@ -251,12 +254,261 @@ def admin_services():
         if service_type:
             query = query.filter_by(service_type=service_type)
         
-        pagination = query.order_by(Service.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        services, pagination = paginate_request(query, Service.created_at, Service.id)
+        
+        return jsonify({
+            'success': True,
+            'services': [s.to_dict() for s in services],
+            'pagination': pagination
+        }), 200
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/dispatch', methods=['POST'])
+@jwt_required()
+@require_role('admin')
+def dispatch_pending_services():
+    """Match all pending services to available mechanics in one optimisation pass"""
+    try:
+        data = request.get_json(silent=True) or {}
+        max_jobs = data.get('max_jobs', 5000)
+        if isinstance(max_jobs, bool) or not isinstance(max_jobs, int) or max_jobs < 1:
+            return jsonify({'success': False, 'error': 'max_jobs must be a positive integer'}), 400
+        result = run_dispatch(
+            max_jobs=min(max_jobs, 10000),
+            dry_run=bool(data.get('dry_run', False))
+        )
+        
+        return jsonify({
+            'success': True,
+            'committed': result.committed,
+            'assignments': [a._asdict() for a in result.assignments],
+            'unassigned_service_ids': result.unassigned,
+            'solve_ms': result.solve_ms
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/stats/reconcile', methods=['POST'])
+@jwt_required()
+@require_role('admin')
+def reconcile_stats():
+    """Recount the dashboard counters from scratch and report (and by default fix) drift"""
+    try:
+        data = request.get_json(silent=True) or {}
+        fix = bool(data.get('fix', True))
+        drift = stat_counters.reconcile(fix=fix)
+        revenue_drift = revenue_rollup.reconcile(fix=fix)
+        if fix and (drift or revenue_drift):
+            # Corrections are Core upserts: cached dashboards would not notice them
+            response_cache.invalidate('users', 'services', 'payments', 'support')
+        
+        return jsonify({
+            'success': True,
+            'drift': drift,
+            'revenue_drift': {
+                day.isoformat(): {'amount': amount, 'payment_count': count}
+                for day, (amount, count) in sorted(revenue_drift.items())
+            },
+            'fixed': bool(drift or revenue_drift) and fix
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+def cache_stats():
+    """Response cache hit/miss counters for this worker"""
+    try:
+        return jsonify({'success': True, 'cache': response_cache.stats()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/replicas', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+def replica_stats():
+    """Read replica lag / health and routed read counters for this worker"""
+    try:
+        return jsonify({'success': True, 'enabled': replica_router.enabled, **replica_router.stats()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/revenue', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+@response_cache.cached('payments')
+@replica_reads
+def revenue_series():
+    """Completed-payment revenue per day, week or month over start..end (inclusive, YYYY-MM-DD)"""
+    try:
+        granularity = request.args.get('granularity', 'month')
+        if granularity not in GRANULARITIES:
+            return jsonify({'success': False, 'error': f'granularity must be one of {", ".join(GRANULARITIES)}'}), 400
+        
+        try:
+            end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+            start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=364)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'start and end must be YYYY-MM-DD dates'}), 400
+        if start > end:
+            return jsonify({'success': False, 'error': 'start must not be after end'}), 400
+        if granularity == 'day' and (end - start).days > MAX_REVENUE_DAYS:
+            return jsonify({'success': False, 'error': f'day granularity is limited to {MAX_REVENUE_DAYS} days'}), 400
         
+        series = revenue_rollup.series(start, end, granularity)
         return jsonify({
             'success': True,
-            'services': [s.to_dict() for s in pagination.items],
-            'pagination': {'page': page, 'per_page': per_page, 'total': pagination.total, 'pages': pagination.pages}
+            'granularity': granularity,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'total': round(sum(bucket['amount'] for bucket in series), 2),
+            'series': [
+                {'start': bucket['start'].isoformat(), 'amount': bucket['amount'], 'payment_count': bucket['payment_count']}
+                for bucket in series
+            ]
         }), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/export/<dataset>', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+@replica_reads
+def export_dataset(dataset):
+    """Stream services, payments or users as CSV or NDJSON (?format, ?start/?end YYYY-MM-DD inclusive, ?status)"""
+    try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'success': False, 'error': f'format must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+        try:
+            start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+            end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'start and end must be YYYY-MM-DD dates'}), 400
+        query = export_query(dataset, start, end, request.args.get('status'))
+        
+        filename = f'{dataset}-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}'
+        return Response(stream_with_context(stream_export(query, export_format)), mimetype=EXPORT_FORMATS[export_format], headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+    except InvalidExport as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/support/archive', methods=['POST'])
+@jwt_required()
+@require_role('admin')
+def archive_support_conversations():
+    """
+    Move conversations closed more than 'older_than_days' ago to the archive tables
+    Body (all optional): older_than_days, batch_size, max_batches, max_seconds (at most
+    MAX_ARCHIVE_REQUEST_SECONDS), after_id. Repeat until 'finished' is true.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        limits = {}
+        for name, types in [('older_than_days', (int, float)), ('max_seconds', (int, float)),
+                            ('batch_size', int), ('max_batches', int), ('after_id', int)]:
+            value = data.get(name)
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, types) or value < 0:
+                return jsonify({'success': False, 'error': f'{name} must be a non-negative number'}), 400
+            limits[name] = value
+        limits['max_seconds'] = min(limits.get('max_seconds', MAX_ARCHIVE_REQUEST_SECONDS), MAX_ARCHIVE_REQUEST_SECONDS)
+        
+        report = support_archiver.run(**limits)
+        return jsonify({'success': True, **report}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/support/archive', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+@replica_reads
+def archived_conversations():
+    """Search archived conversations (?q= in customer fields, request id or any message), newest archived first"""
+    try:
+        query = search_archive(request.args.get('q', '').strip())
+        conversations, pagination = paginate_request(
+            query, SupportConversationArchive.archived_at, SupportConversationArchive.id
+        )
+        return jsonify({
+            'success': True,
+            'conversations': [c.to_dict() for c in conversations],
+            'pagination': pagination
+        }), 200
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/support/archive/<int:conversation_id>', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+@replica_reads
+def archived_conversation(conversation_id):
+    """An archived conversation with its messages"""
+    try:
+        conversation = db.session.get(SupportConversationArchive, conversation_id)
+        if not conversation:
+            return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+        messages = SupportMessageArchive.query.filter_by(conversation_id=conversation_id).order_by(
+            SupportMessageArchive.id
+        ).all()
+        return jsonify({
+            'success': True,
+            'conversation': conversation.to_dict(),
+            'messages': [m.to_dict() for m in messages]
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/support/sizes', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+def support_table_sizes():
+    """Row counts and on-disk sizes of the hot and archive support tables"""
+    try:
+        return jsonify({'success': True, 'tables': table_sizes()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/notifications/outbox', methods=['GET'])
+@jwt_required()
+@require_role('admin')
+def outbox_stats():
+    """Notification outbox backlog by status and this worker's send throughput"""
+    try:
+        return jsonify({'success': True, 'queue': queue_summary(), 'workers': notification_outbox.stats()}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin_bp.route('/notifications/outbox/requeue', methods=['POST'])
+@jwt_required()
+@require_role('admin')
+def requeue_outbox():
+    """Retry dead-lettered notifications; body (optional): ids, else every dead one"""
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if ids is not None and (
+            not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)
+        ):
+            return jsonify({'success': False, 'error': 'ids must be a list of integers'}), 400
+        
+        requeued = notification_outbox.requeue_dead(ids)
+        return jsonify({'success': True, 'requeued': requeued}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -1,8 +1,10 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from models.user import User
 from database import db
 from datetime import timedelta, datetime
+from utils.principals import token_claims
+from utils.streaming import create_stream_ticket
 from utils.validators import validate_email, validate_password, validate_phone
 
 auth_bp = Blueprint('auth', __name__)
@@ -67,7 +69,9 @@ def register():
         db.session.add(user)
         db.session.commit()
         
-        token = create_access_token(identity=str(user.id), expires_delta=timedelta(hours=24))
+        token = create_access_token(
+            identity=str(user.id), additional_claims=token_claims(user), expires_delta=timedelta(hours=24)
+        )
         
         return jsonify({
             'success': True,
@@ -99,7 +103,9 @@ def login():
         user.last_login = datetime.utcnow()
         db.session.commit()
         
-        token = create_access_token(identity=str(user.id), expires_delta=timedelta(hours=24))
+        token = create_access_token(
+            identity=str(user.id), additional_claims=token_claims(user), expires_delta=timedelta(hours=24)
+        )
         
         return jsonify({
             'success': True,
@@ -168,3 +174,13 @@ def update_profile():
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@auth_bp.route('/stream-ticket', methods=['POST'])
+@jwt_required()
+def stream_ticket():
+    """Short-lived ticket for opening an event stream (EventSource cannot send the Authorization header)"""
+    return jsonify({
+        'success': True,
+        'ticket': create_stream_ticket(),
+        'expires_in': current_app.config['STREAM_TICKET_SECONDS']
+    }), 200
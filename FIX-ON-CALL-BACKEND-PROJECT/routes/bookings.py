@@ -2,9 +2,14 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.booking import Booking
 from models.service import Service
-from models.user import User
 from database import db
 from datetime import datetime
+from utils.principals import current_principal, current_user_has_role
+from utils.broker import booking_channel, broker
+from utils.streaming import sse_response, stream_jwt_required
+from utils.pagination import InvalidCursor, paginate_request
+from utils.tracking import booking_finished, booking_status, publish_booking_status, status_message
+from utils.replicas import replica_reads
 
 bookings_bp = Blueprint('bookings', __name__)
 
@@ -50,14 +55,37 @@ def get_booking(booking_id):
             return jsonify({'success': False, 'error': 'Booking not found'}), 404
         
         if booking.user_id != current_user_id and booking.mechanic_id != current_user_id:
-            user = User.query.get(current_user_id)
-            if not user or user.user_type != 'admin':
+            if not current_user_has_role('admin'):
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 403
         
         return jsonify({'success': True, 'booking': booking.to_dict()}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bookings_bp.route('/<int:booking_id>/stream', methods=['GET'])
+@stream_jwt_required
+def stream_booking_status(booking_id):
+    """Server-sent events: the booking's current status, then every change until it finishes"""
+    current_user_id = int(get_jwt_identity())
+    subscription = broker.subscribe(booking_channel(booking_id))
+    try:
+        booking = Booking.query.get(booking_id)
+        if not booking:
+            subscription.close()
+            return jsonify({'success': False, 'error': 'Booking not found'}), 404
+        
+        if booking.user_id != current_user_id and booking.mechanic_id != current_user_id:
+            if not current_user_has_role('admin'):
+                subscription.close()
+                return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        current = status_message(booking_status(booking))
+        db.session.remove()
+        return sse_response(subscription, initial=[current], until=booking_finished)
+    except Exception as e:
+        subscription.close()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bookings_bp.route('/<int:booking_id>/cancel', methods=['POST'])
 @jwt_required()
 def cancel_booking(booking_id):
@@ -80,7 +108,9 @@ def cancel_booking(booking_id):
         booking.cancellation_reason = data.get('reason', '')
         booking.updated_at = datetime.utcnow()
         
+        tracked = booking_status(booking)
         db.session.commit()
+        publish_booking_status(tracked)
         
         return jsonify({'success': True, 'message': 'Booking cancelled successfully'}), 200
     except Exception as e:
@@ -89,27 +119,28 @@ def cancel_booking(booking_id):
 
 @bookings_bp.route('/my-bookings', methods=['GET'])
 @jwt_required()
+@replica_reads
 def my_bookings():
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
-        
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        principal = current_principal()
+        role = principal.role if principal else None
         
-        if user.user_type == 'driver':
+        if role == 'driver':
             query = Booking.query.filter_by(user_id=current_user_id)
-        elif user.user_type == 'mechanic':
+        elif role == 'mechanic':
             query = Booking.query.filter_by(mechanic_id=current_user_id)
         else:
             return jsonify({'success': False, 'error': 'Invalid user type'}), 400
         
-        pagination = query.order_by(Booking.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        bookings, pagination = paginate_request(query, Booking.created_at, Booking.id, default_per_page=10)
         
         return jsonify({
             'success': True,
-            'bookings': [b.to_dict() for b in pagination.items],
-            'pagination': {'page': page, 'per_page': per_page, 'total': pagination.total, 'pages': pagination.pages}
+            'bookings': [b.to_dict() for b in bookings],
+            'pagination': pagination
         }), 200
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -3,6 +3,10 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.payment import Notification
 from database import db
 from datetime import datetime
+from utils.broker import broker, user_channel
+from utils.streaming import sse_response, stream_jwt_required
+from utils.pagination import InvalidCursor, paginate_request
+from utils.replicas import replica_reads
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -36,24 +40,25 @@ def send_notification():
 
 @notifications_bp.route('/my-notifications', methods=['GET'])
 @jwt_required()
+@replica_reads
 def my_notifications():
     try:
         current_user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         
-        pagination = Notification.query.filter_by(recipient_id=current_user_id).order_by(
-            Notification.created_at.desc()
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        notifications, pagination = paginate_request(
+            Notification.query.filter_by(recipient_id=current_user_id), Notification.created_at, Notification.id
+        )
         
         unread = Notification.query.filter_by(recipient_id=current_user_id, is_read=False).count()
         
         return jsonify({
             'success': True,
-            'notifications': [n.to_dict() for n in pagination.items],
+            'notifications': [n.to_dict() for n in notifications],
             'unread_count': unread,
-            'pagination': {'page': page, 'per_page': per_page, 'total': pagination.total, 'pages': pagination.pages}
+            'pagination': pagination
         }), 200
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -91,3 +96,10 @@ def mark_all_read():
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@notifications_bp.route('/stream', methods=['GET'])
+@stream_jwt_required
+def notification_stream():
+    """Server-sent events: push new notifications to the user as they are created"""
+    current_user_id = int(get_jwt_identity())
+    return sse_response(broker.subscribe(user_channel(current_user_id)))
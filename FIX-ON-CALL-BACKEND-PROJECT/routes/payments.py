@@ -2,9 +2,9 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models.payment import Payment
 from models.service import Service
-from models.user import User
 from database import db
 from datetime import datetime
+from utils.principals import current_user_has_role
 
 payments_bp = Blueprint('payments', __name__)
 
@@ -53,8 +53,7 @@ def get_payment(payment_id):
             return jsonify({'success': False, 'error': 'Payment not found'}), 404
         
         if payment.user_id != current_user_id:
-            user = User.query.get(current_user_id)
-            if not user or user.user_type != 'admin':
+            if not current_user_has_role('admin'):
                 return jsonify({'success': False, 'error': 'Unauthorized'}), 403
         
         return jsonify({'success': True, 'payment': payment.to_dict()}), 200
@@ -4,13 +4,26 @@ from models.service import Service, EmergencyAlert
 from models.user import User
 from database import db
 from datetime import datetime
-from utils.geolocation import find_nearby_locations
+from utils.principals import current_user_has_role, require_role
+from sqlalchemy.exc import OperationalError
+from utils.mechanic_lookup import query_mechanics_in_radius
+from utils.location_updates import parse_ping, record_location
+from utils.dispatch import CLAIM_SERVICE_NOT_FOUND, CLAIM_SERVICE_NOT_PENDING, claim_assignment
+from utils.jobs import JOB_DONE, JOB_FAILED, job_queue
+from utils.service_requests import enqueue_service_request, nearby_job_id, nearby_mechanics_for
+from utils.alert_fanout import queue_alert
+from utils.broker import broker, service_channel
+from utils.streaming import sse_response, stream_jwt_required
+from utils.pagination import InvalidCursor, paginate_request
+from utils.tracking import publish_service_status, service_finished, service_status, status_message
+from utils.replicas import replica_reads
 
 services_bp = Blueprint('services', __name__)
 
 SERVICE_TYPES = ['breakdown', 'towing', 'fuel_delivery', 'tyre_change', 'battery_jump', 'lockout', 'mechanic_dispatch']
 STATUSES = ['pending', 'accepted', 'in_progress', 'completed', 'cancelled']
 TRACKER_STATUSES = ['confirmed', 'dispatched', 'arrived', 'in_service', 'rejected']
+MAX_LOCATION_POINTS = 100
 
 @services_bp.route('/request', methods=['POST'])
 @jwt_required()
@@ -39,10 +52,11 @@ def request_service():
         )
         
         db.session.add(service)
-        db.session.commit()
         
-        # Create emergency alert if breakdown
+        # Create emergency alert if breakdown (same transaction as the service)
+        alert = None
         if data['service_type'] == 'breakdown':
+            db.session.flush()
             alert = EmergencyAlert(
                 service_id=service.id,
                 user_id=current_user_id,
@@ -50,28 +64,63 @@ def request_service():
                 priority='high'
             )
             db.session.add(alert)
-            db.session.commit()
         
-        # Find nearby mechanics
-        mechanics = User.query.filter_by(user_type='mechanic', is_available=True, is_active=True).all()
-        mechanics_data = [m.to_dict() for m in mechanics]
+        db.session.commit()
         
-        if data['location'].get('latitude') and data['location'].get('longitude'):
-            mechanics_with_location = [m for m in mechanics_data if m.get('location')]
-            nearby = find_nearby_locations(data['location'], mechanics_with_location, 10)
-            mechanics_data = nearby[:5]
+        if alert:
+            queue_alert(alert)
         
-        return jsonify({
+        result = {
             'success': True,
             'message': 'Service requested successfully',
             'service': service.to_dict(),
-            'nearby_mechanics': mechanics_data
-        }), 201
+            'nearby_mechanics_url': f'/api/services/{service.id}/nearby-mechanics'
+        }
+        headers = {}
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            # Prefer: respond-async: the lookup runs on the job queue, fetched later from nearby_mechanics_url
+            result['job_id'] = enqueue_service_request(service.id)
+            headers['Preference-Applied'] = 'respond-async'
+        else:
+            # One spatial index lookup, not a scan of every mechanic
+            result['nearby_mechanics'] = nearby_mechanics_for(data['location'])
+        
+        return jsonify(result), 201, headers
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@services_bp.route('/<int:service_id>/nearby-mechanics', methods=['GET'])
+@jwt_required()
+def get_nearby_mechanics(service_id):
+    """Nearby mechanics found for a service request (202 while still being computed)"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        service = Service.query.get(service_id)
+        if not service:
+            return jsonify({'success': False, 'error': 'Service not found'}), 404
+        
+        if service.user_id != current_user_id and not current_user_has_role('admin'):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        job = job_queue.result(nearby_job_id(service_id))
+        if job and job.status not in (JOB_DONE, JOB_FAILED):
+            response = jsonify({'success': True, 'status': job.status, 'nearby_mechanics': []})
+            response.headers['Retry-After'] = '1'
+            return response, 202
+        
+        if job and job.status == JOB_DONE:
+            mechanics_data = job.result['nearby_mechanics']
+        else:
+            # Result expired, lives in another worker process, or the job failed: compute it now
+            mechanics_data = nearby_mechanics_for(service.location)
+        
+        return jsonify({'success': True, 'status': JOB_DONE, 'nearby_mechanics': mechanics_data}), 200
+        
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @services_bp.route('/available-mechanics', methods=['GET'])
 @jwt_required()
 def get_available_mechanics():
@@ -85,19 +134,37 @@ def get_available_mechanics():
         if not latitude or not longitude:
             return jsonify({'success': False, 'error': 'Latitude and longitude are required'}), 400
         
-        query = User.query.filter_by(user_type='mechanic', is_available=True, is_active=True)
+        nearby = query_mechanics_in_radius(latitude, longitude, radius, specialization=specialization)
         
-        if specialization:
-            query = query.filter(User.specialization.contains([specialization]))
+        return jsonify({'success': True, 'count': len(nearby), 'mechanics': nearby}), 200
         
-        mechanics = query.all()
-        mechanics_data = [m.to_dict() for m in mechanics]
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@services_bp.route('/mechanics/location', methods=['POST'])
+@jwt_required()
+@require_role('mechanic')
+def report_location():
+    """Report a mechanic's live GPS position (single point or a batch of points)"""
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        points = data['points'] if 'points' in data else [data]
         
-        location = {'latitude': latitude, 'longitude': longitude}
-        mechanics_with_location = [m for m in mechanics_data if m.get('location')]
-        nearby = find_nearby_locations(location, mechanics_with_location, radius)
+        if not isinstance(points, list) or not points:
+            return jsonify({'success': False, 'error': 'points must be a non-empty list'}), 400
+        if len(points) > MAX_LOCATION_POINTS:
+            return jsonify({'success': False, 'error': f'At most {MAX_LOCATION_POINTS} points per request'}), 400
         
-        return jsonify({'success': True, 'count': len(nearby), 'mechanics': nearby}), 200
+        try:
+            pings = [parse_ping(current_user_id, point) for point in points]
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        # Last write wins: only the newest point of the batch matters
+        record_location(max(pings, key=lambda ping: ping.recorded_at))
+        
+        return jsonify({'success': True, 'accepted': len(pings)}), 202
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -107,30 +174,54 @@ def get_available_mechanics():
 def assign_service(service_id):
     """Assign service to a mechanic"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         
         if 'mechanic_id' not in data:
             return jsonify({'success': False, 'error': 'mechanic_id is required'}), 400
-        
-        service = Service.query.get(service_id)
-        if not service:
+        mechanic_id = data['mechanic_id']
+        if isinstance(mechanic_id, str) and mechanic_id.strip().isdigit():
+            mechanic_id = int(mechanic_id)
+        if isinstance(mechanic_id, bool) or not isinstance(mechanic_id, int) or mechanic_id <= 0:
+            return jsonify({'success': False, 'error': 'mechanic_id must be a positive integer'}), 400
+        
+        result = claim_assignment(service_id, mechanic_id)
+        
+        if result.assigned:
+            publish_service_status({
+                'id': service_id,
+                'status': result.service_status,
+                'assigned_to': mechanic_id,
+                'estimated_time': None,
+                'updated_at': datetime.utcnow().isoformat()
+            })
+            return jsonify({'success': True, 'message': 'Service assigned successfully'}), 200
+        if result.reason == CLAIM_SERVICE_NOT_FOUND:
             return jsonify({'success': False, 'error': 'Service not found'}), 404
-        
-        if service.status != 'pending':
-            return jsonify({'success': False, 'error': f'Service is already {service.status}'}), 400
-        
-        service.status = 'accepted'
-        service.assigned_to = data['mechanic_id']
-        service.assigned_at = datetime.utcnow()
-        
-        mechanic = User.query.get(data['mechanic_id'])
-        if mechanic:
-            mechanic.is_available = False
-        
-        db.session.commit()
-        
-        return jsonify({'success': True, 'message': 'Service assigned successfully'}), 200
-        
+        if result.reason == CLAIM_SERVICE_NOT_PENDING:
+            return jsonify({
+                'success': False,
+                'error': f'Service is already {result.service_status}',
+                'code': 'SERVICE_NOT_PENDING',
+                'retryable': False
+            }), 409
+        return jsonify({
+            'success': False,
+            'error': 'Mechanic is not available',
+            'code': 'MECHANIC_UNAVAILABLE',
+            'retryable': True
+        }), 409
+        
+    except OperationalError:
+        # Lock timeout / serialization failure: nothing was assigned, safe to retry
+        db.session.rollback()
+        response = jsonify({
+            'success': False,
+            'error': 'Assignment conflicted with a concurrent update, please retry',
+            'code': 'ASSIGNMENT_CONFLICT',
+            'retryable': True
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -164,7 +255,9 @@ def update_service_status(service_id):
             if mechanic:
                 mechanic.is_available = True
         
+        tracked = service_status(service)
         db.session.commit()
+        publish_service_status(tracked)
         
         return jsonify({'success': True, 'message': f'Service status updated to {data["status"]}'}), 200
         
@@ -172,31 +265,51 @@ def update_service_status(service_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@services_bp.route('/<int:service_id>/stream', methods=['GET'])
+@stream_jwt_required
+def stream_service_status(service_id):
+    """Server-sent events: the service's current status, then every change until it finishes"""
+    current_user_id = int(get_jwt_identity())
+    # Subscribe before reading the current state so no change slips in between
+    subscription = broker.subscribe(service_channel(service_id))
+    try:
+        service = Service.query.get(service_id)
+        if not service:
+            subscription.close()
+            return jsonify({'success': False, 'error': 'Service not found'}), 404
+        
+        if current_user_id not in (service.user_id, service.assigned_to):
+            if not current_user_has_role('admin'):
+                subscription.close()
+                return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        current = status_message(service_status(service))
+        db.session.remove()
+        return sse_response(subscription, initial=[current], until=service_finished)
+        
+    except Exception as e:
+        subscription.close()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @services_bp.route('/history', methods=['GET'])
 @jwt_required()
+@replica_reads
 def service_history():
     """Get user's service history"""
     try:
         current_user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
         
-        pagination = Service.query.filter_by(user_id=current_user_id).order_by(Service.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
+        services, pagination = paginate_request(
+            Service.query.filter_by(user_id=current_user_id), Service.created_at, Service.id, default_per_page=10
         )
         
-        services = [s.to_dict() for s in pagination.items]
-        
         return jsonify({
             'success': True,
-            'services': services,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
-            }
+            'services': [s.to_dict() for s in services],
+            'pagination': pagination
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
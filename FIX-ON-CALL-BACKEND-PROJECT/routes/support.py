@@ -1,6 +1,16 @@
-from flask import Blueprint, request, jsonify
+import json
+from datetime import datetime
+from flask import Blueprint, current_app, request, jsonify
 from database import db
-from models.support import SupportConversation, SupportMessage
+from models.support import SupportConversation, SupportConversationTag, SupportMessage
+from utils.pagination import MAX_PER_PAGE, InvalidCursor, paginate_request
+from utils.search import query_words
+from utils.streaming import sock
+from utils.support_chat import (
+    ConversationNotFound, MessageRejected, message_error, message_page, post_message, sender_error, wait_for_messages,
+)
+from utils.support_socket import error_event, serve_chat
+from utils.support_search import ranked_matches, substring_clause
 
 support_bp = Blueprint("support", __name__)
 
@@ -32,13 +42,14 @@ def create_conversation():
 
         first_message = (data.get("message") or "").strip()
         if first_message:
-            db.session.add(
-                SupportMessage(
-                    conversation_id=conversation.id,
-                    sender=data.get("sender", "user"),
-                    body=first_message,
-                )
+            message = SupportMessage(
+                conversation_id=conversation.id,
+                sender=data.get("sender", "user"),
+                body=first_message,
+                created_at=datetime.utcnow(),
             )
+            db.session.add(message)
+            conversation.record_message(message)
 
         db.session.commit()
         return jsonify({"success": True, "conversation": conversation.to_dict()}), 201
@@ -60,31 +71,54 @@ def list_conversations():
             query = query.filter_by(status=status)
         if channel:
             query = query.filter_by(channel=channel)
-
-        conversations = query.order_by(SupportConversation.updated_at.desc()).all()
-
-        items = []
-        for c in conversations:
-            row = c.to_dict()
-            if tag:
-                row_tags = [t.strip().lower() for t in row.get("tags", []) if t.strip()]
-                if tag not in row_tags:
-                    continue
+        if tag:
+            query = query.filter(SupportConversation.tag_links.any(SupportConversationTag.tag == tag))
+
+        # Clients that send no page, per_page or cursor (the admin inbox) get the whole list
+        paged = any(name in request.args for name in ("page", "per_page", "cursor"))
+
+        # Full-text search: best matches first, in offset pages
+        words = query_words(q)
+        matches = ranked_matches(words, db.engine.dialect.name) if words else None
+        if matches is not None:
+            if "cursor" in request.args:
+                raise InvalidCursor("Search results are ranked; page through them with page instead of cursor")
+            query = query.join(matches, matches.c.conversation_id == SupportConversation.id).order_by(
+                matches.c.rank.desc(), SupportConversation.updated_at.desc(), SupportConversation.id.desc()
+            )
+            if paged:
+                page = request.args.get("page", 1, type=int)
+                per_page = max(1, min(request.args.get("per_page", 50, type=int), MAX_PER_PAGE))
+                ranked = query.paginate(page=page, per_page=per_page, error_out=False)
+                conversations = ranked.items
+                pagination = {
+                    "page": page, "per_page": per_page, "total": ranked.total, "pages": ranked.pages,
+                    "has_more": ranked.has_next,
+                }
+            else:
+                conversations = query.all()
+                pagination = {"total": len(conversations), "has_more": False}
+        else:
             if q:
-                haystack = " ".join(
-                    [
-                        row.get("customer_name", ""),
-                        row.get("customer_phone", ""),
-                        row.get("customer_email", ""),
-                        row.get("request_id", ""),
-                        row.get("last_message", ""),
-                    ]
-                ).lower()
-                if q not in haystack:
-                    continue
-            items.append(row)
-
-        return jsonify({"success": True, "conversations": items}), 200
+                query = query.filter(substring_clause(q))
+            # One query per page: the message summary lives on the conversation row
+            if paged:
+                conversations, pagination = paginate_request(
+                    query, SupportConversation.updated_at, SupportConversation.id, default_per_page=50
+                )
+            else:
+                conversations = query.order_by(
+                    SupportConversation.updated_at.desc(), SupportConversation.id.desc()
+                ).all()
+                pagination = {"total": len(conversations), "has_more": False}
+
+        return jsonify({
+            "success": True,
+            "conversations": [c.to_dict() for c in conversations],
+            "pagination": pagination,
+        }), 200
+    except InvalidCursor as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -95,8 +129,34 @@ def list_messages(conversation_id):
     if not conversation:
         return jsonify({"success": False, "error": "Conversation not found"}), 404
 
-    messages = [m.to_dict() for m in conversation.messages]
-    return jsonify({"success": True, "messages": messages}), 200
+    args = request.args
+    if not any(name in args for name in ("after_id", "before_id", "limit", "wait")):
+        # Whole history, for clients that do not page
+        messages = [m.to_dict() for m in conversation.messages]
+        return jsonify({"success": True, "messages": messages}), 200
+
+    config = current_app.config
+    limit = max(1, min(args.get("limit", config["SUPPORT_MESSAGES_PER_PAGE"], type=int),
+                       config["SUPPORT_MAX_MESSAGES_PER_PAGE"]))
+    after_id = args.get("after_id", type=int)
+    before_id = args.get("before_id", type=int)
+    wait = min(args.get("wait", 0, type=float), config["SUPPORT_MAX_WAIT_SECONDS"])
+    if wait > 0 and before_id is None:
+        # Long poll: hold the request until a new message arrives or wait runs out
+        messages, has_more = wait_for_messages(conversation_id, after_id or 0, limit, wait)
+    else:
+        messages, has_more = message_page(conversation_id, after_id=after_id, before_id=before_id, limit=limit)
+
+    return jsonify({
+        "success": True,
+        "messages": [m.to_dict() for m in messages],
+        "pagination": {
+            "limit": limit,
+            "has_more": has_more,
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+        },
+    }), 200
 
 
 @support_bp.route("/conversations/<int:conversation_id>/messages", methods=["POST"])
@@ -107,25 +167,50 @@ def create_message(conversation_id):
             return jsonify({"success": False, "error": "Conversation not found"}), 404
 
         data = request.get_json() or {}
-        body = (data.get("body") or "").strip()
-        if not body:
-            return jsonify({"success": False, "error": "body is required"}), 400
-
-        message = SupportMessage(
-            conversation_id=conversation_id,
-            sender=data.get("sender", "user"),
-            body=body,
-        )
-        db.session.add(message)
-        conversation.updated_at = message.created_at
-        db.session.commit()
-
-        return jsonify({"success": True, "message": message.to_dict()}), 201
+        body = data.get("body")
+        body = body.strip() if isinstance(body, str) else ""
+        sender = data.get("sender", "user")
+        error = message_error(body, sender)
+        if error:
+            return jsonify({"success": False, "error": error}), 400
+
+        # Stored and broadcast with the rest of its micro-batch
+        db.session.rollback()
+        future = post_message(conversation_id, body, sender=sender)
+        message = future.result(timeout=current_app.config["SUPPORT_MESSAGE_COMMIT_TIMEOUT"])
+
+        return jsonify({"success": True, "message": message}), 201
+    except ConversationNotFound as e:
+        return jsonify({"success": False, "error": str(e)}), 404
+    except MessageRejected as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except TimeoutError:
+        return jsonify({"success": False, "error": "Message is queued but not stored yet"}), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@sock.route("/conversations/<int:conversation_id>/ws", bp=support_bp)
+def conversation_socket(ws, conversation_id):
+    """WebSocket chat: messages, typing and presence for one conversation"""
+    if not SupportConversation.query.get(conversation_id):
+        ws.send(json.dumps(error_event("Conversation not found")))
+        return
+    sender = request.args.get("sender", "user")
+    error = sender_error(sender)
+    if error:
+        ws.send(json.dumps(error_event(error)))
+        return
+    serve_chat(
+        ws,
+        conversation_id,
+        name=request.args.get("name", ""),
+        sender=sender,
+        after_id=request.args.get("after_id", type=int),
+    )
+
+
 @support_bp.route("/conversations/<int:conversation_id>", methods=["PATCH"])
 def update_conversation(conversation_id):
     try:
@@ -0,0 +1,156 @@
+"""
+Schema state and data backfills.
+
+Tables for a new database come from db.create_all(); changes to existing
+tables are Alembic migrations under migrations/, applied with
+`flask db upgrade`. Each migration carries its own copy of the backfills it
+needs; the ones here go through the models and can be re-run by hand.
+"""
+
+import os
+
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect, update
+
+from database import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def backfill_user_coordinates(batch_size=1000):
+    """Populate users.lat/lon from the JSON location fields in id-ordered batches"""
+    from models.user import User
+
+    updated = 0
+    last_id = 0
+    while True:
+        users = User.query.filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+        if not users:
+            break
+        for user in users:
+            user.sync_coordinates()
+        updated += sum(1 for user in users if user.lat is not None)
+        last_id = users[-1].id
+        db.session.commit()
+    return updated
+
+
+def backfill_user_search_text(batch_size=5000):
+    """Populate users.search_text from name, email and phone in id-ordered batches"""
+    from models.user import User
+    from utils.search import search_text_for
+
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.name, User.email, User.phone).filter(
+            User.id > last_id
+        ).order_by(User.id).limit(batch_size).all()
+        if not rows:
+            break
+        # Core bulk update by primary key: no per-row ORM load or update hooks
+        db.session.execute(update(User), [
+            {'id': row.id, 'search_text': search_text_for(row.name, row.email, row.phone)} for row in rows
+        ])
+        updated += len(rows)
+        last_id = rows[-1].id
+        db.session.commit()
+    return updated
+
+
+def backfill_support_tags(batch_size=1000):
+    """Populate support_conversation_tags from the comma-separated tags column in id-ordered batches"""
+    from models.support import SupportConversation
+
+    synced = 0
+    last_id = 0
+    while True:
+        conversations = SupportConversation.query.filter(
+            SupportConversation.id > last_id,
+            SupportConversation.tags.isnot(None)
+        ).order_by(SupportConversation.id).limit(batch_size).all()
+        if not conversations:
+            break
+        for conversation in conversations:
+            conversation.sync_tag_links()
+        synced += len(conversations)
+        last_id = conversations[-1].id
+        db.session.commit()
+    return synced
+
+
+def backfill_support_message_summary(batch_size=1000):
+    """Populate support_conversations.last_message/last_message_at/message_count in id-ordered batches"""
+    from models.support import SupportConversation, SupportMessage
+
+    conversation_messages = SupportMessage.conversation_id == SupportConversation.id
+    latest = db.select(SupportMessage).where(conversation_messages).order_by(
+        SupportMessage.created_at.desc(), SupportMessage.id.desc()
+    ).limit(1)
+    updated = 0
+    last_id = 0
+    while True:
+        ids = db.session.scalars(
+            db.select(SupportConversation.id).where(SupportConversation.id > last_id)
+            .order_by(SupportConversation.id).limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        # One set-based UPDATE per batch with correlated subqueries
+        db.session.execute(
+            update(SupportConversation).where(SupportConversation.id.in_(ids)).values(
+                message_count=db.select(db.func.count()).where(conversation_messages).scalar_subquery(),
+                last_message_at=latest.with_only_columns(SupportMessage.created_at).scalar_subquery(),
+                last_message=latest.with_only_columns(SupportMessage.body).scalar_subquery(),
+                # Keep the inbox order: no onupdate timestamp
+                updated_at=SupportConversation.updated_at,
+            ).execution_options(synchronize_session=False)
+        )
+        updated += len(ids)
+        last_id = ids[-1]
+        db.session.commit()
+    return updated
+
+
+def backfill_support_closed_at():
+    """Date closed conversations written before closed_at existed by their last update"""
+    from models.support import CLOSED_STATUSES, SupportConversation
+
+    result = db.session.execute(
+        update(SupportConversation).where(
+            SupportConversation.status.in_(CLOSED_STATUSES), SupportConversation.closed_at.is_(None)
+        ).values(
+            closed_at=SupportConversation.updated_at,
+            # Keep the inbox order: no onupdate timestamp
+            updated_at=SupportConversation.updated_at,
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def backfill_support_search(batch_size=500):
+    """Rebuild the support conversation full-text index from the conversations and their messages"""
+    from utils.support_search import support_search
+
+    return support_search.rebuild(batch_size=batch_size)
+
+
+def prepare_schema():
+    """Create missing tables; returns False while an existing database has migrations to apply
+
+    A new database is created at the latest revision and stamped as such. The
+    tables of one created by an older release may lack columns the models
+    query, until `flask db upgrade` adds them.
+    """
+    engine = db.engine
+    new_database = not inspect(engine).has_table('users')
+    db.create_all()
+    script = ScriptDirectory(MIGRATIONS_DIR)
+    with engine.begin() as connection:
+        context = MigrationContext.configure(connection)
+        if new_database:
+            context.stamp(script, 'head')
+            return True
+        return set(context.get_current_heads()) == set(script.get_heads())
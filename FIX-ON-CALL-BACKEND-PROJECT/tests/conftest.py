@@ -0,0 +1,42 @@
+import os
+import pytest
+from flask_jwt_extended import create_access_token
+from app import create_app
+from config import Config
+from database import db
+from models.user import User
+
+ADMIN_EMAIL = 'info@fixoncall.com'
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'sqlite://')
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+@pytest.fixture
+def config():
+    """The config the app is built from; a module overrides this fixture for settings of its own"""
+    return TestConfig
+
+@pytest.fixture
+def app(config):
+    app = create_app(config)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def token_for(app, user_id):
+    with app.app_context():
+        return create_access_token(identity=str(user_id))
+
+def headers_for(app, user_id):
+    return {'Authorization': f'Bearer {token_for(app, user_id)}'}
+
+def admin_headers(app):
+    with app.app_context():
+        return headers_for(app, User.query.filter_by(email=ADMIN_EMAIL).first().id)
@@ -0,0 +1,301 @@
+import json
+from datetime import date, datetime
+from database import db
+from models.payment import Payment
+from models.service import Service
+from models.support import SupportConversation
+from models.user import User
+from utils.dispatch import claim_assignment
+from utils.revenue import revenue_rollup
+from utils.search import normalize_phone, search_text_for
+from utils.spatial_index import mechanic_index
+from utils.stats import stat_counters
+from tests.conftest import admin_headers
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+def make_user(email, user_type='driver'):
+    user = User(email=email, name=email.split('@')[0], phone='+254712345678', user_type=user_type)
+    user.set_password('1234')
+    db.session.add(user)
+    return user
+
+def seed(app):
+    with app.app_context():
+        driver = make_user('driver@example.com')
+        mechanic = make_user('mech@example.com', 'mechanic')
+        make_user('partner@example.com', 'partner')
+        db.session.flush()
+        for service_type, status in [('towing', 'pending'), ('towing', 'completed'), ('breakdown', 'in_progress')]:
+            db.session.add(Service(user_id=driver.id, service_type=service_type, status=status, location=LOCATION))
+        db.session.add(SupportConversation(
+            channel='partner_application', customer_name='Garage', tags='priority, Approved'
+        ))
+        db.session.commit()
+        return driver.id, mechanic.id
+
+def test_counters_follow_inserts_updates_deletes_and_rollbacks(app):
+    driver_id, _ = seed(app)
+    with app.app_context():
+        counters = stat_counters.read()
+        assert counters['users'] == 4
+        assert counters['users:type:mechanic'] == 1
+        assert counters['services:type:towing'] == 2
+        assert counters['partner_applications:approved'] == 1
+
+        # Assigning to an expired attribute still moves the old status's count
+        service = Service.query.filter_by(status='pending').one()
+        db.session.commit()
+        service.status = 'accepted'
+        payment = Payment(service_id=service.id, user_id=driver_id, amount=1500)
+        db.session.add(payment)
+        db.session.commit()
+        counters = stat_counters.read()
+        assert counters['services:status:pending'] == 0
+        assert counters['services:status:accepted'] == 1
+        assert counters['payments:status:pending'] == 1
+
+        payment.status = 'completed'
+        db.session.delete(Service.query.filter_by(status='completed').one())
+        db.session.commit()
+        service.status = 'cancelled'
+        db.session.flush()
+        db.session.rollback()
+
+        counters = stat_counters.read()
+        assert counters['payments:status:completed'] == 1
+        assert counters['payments:status:pending'] == 0
+        assert counters['services'] == 2
+        assert counters.get('services:status:cancelled', 0) == 0
+        assert stat_counters.reconcile() == {}
+
+def test_dashboard_reads_counters(app, client):
+    seed(app)
+    response = client.get('/api/admin/dashboard', headers=admin_headers(app))
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['statistics'] == {
+        'total_users': 4,
+        'total_mechanics': 1,
+        'total_partners': 2,
+        'total_services': 3,
+        'active_services': 2
+    }
+    assert data['service_types'] == [{'_id': 'towing', 'count': 2}, {'_id': 'breakdown', 'count': 1}]
+
+def test_reconcile_reports_and_fixes_drift(app, client):
+    driver_id, mechanic_id = seed(app)
+    with app.app_context():
+        mechanic = db.session.get(User, mechanic_id)
+        mechanic.location = LOCATION
+        db.session.commit()
+        # Core UPDATEs bypass the hooks; claim_assignment reports its own deltas
+        pending = Service.query.filter_by(status='pending').one()
+        assert claim_assignment(pending.id, mechanic_id).assigned
+        assert stat_counters.reconcile() == {}
+
+        db.session.execute(db.text("UPDATE services SET status = 'completed' WHERE status = 'in_progress'"))
+        db.session.execute(db.text("DELETE FROM users WHERE user_type = 'partner'"))
+        db.session.commit()
+
+    headers = admin_headers(app)
+    response = client.post('/api/admin/stats/reconcile', headers=headers, json={'fix': False})
+    assert response.get_json()['drift'] == {
+        'services:status:in_progress': -1,
+        'services:status:completed': 1,
+        'users': -1,
+        'users:type:partner': -1,
+    }
+    assert response.get_json()['fixed'] is False
+    assert client.post('/api/admin/stats/reconcile', headers=headers).get_json()['fixed'] is True
+    assert client.post('/api/admin/stats/reconcile', headers=headers).get_json()['drift'] == {}
+    assert client.get('/api/admin/dashboard', headers=headers).get_json()['statistics']['active_services'] == 1
+
+def test_existing_rows_are_counted_on_first_start(app):
+    seed(app)
+    with app.app_context():
+        db.session.execute(db.text('DELETE FROM stat_counters'))
+        db.session.commit()
+        stat_counters.ensure_initialized()
+        assert stat_counters.read()['services'] == 3
+
+def seed_payments(app):
+    driver_id, _ = seed(app)
+    with app.app_context():
+        service_id = Service.query.first().id
+        payments = []
+        for created_at, amount in [
+            (datetime(2026, 3, 2, 9), 1000),   # Monday
+            (datetime(2026, 3, 8, 23), 250),   # Sunday, same week
+            (datetime(2026, 3, 9, 8), 400),    # next Monday
+            (datetime(2026, 4, 30, 12), 2000),
+        ]:
+            payment = Payment(service_id=service_id, user_id=driver_id, amount=amount, created_at=created_at)
+            db.session.add(payment)
+            payments.append(payment)
+        db.session.commit()
+        return [payment.id for payment in payments]
+
+def test_completing_payments_updates_the_revenue_rollup(app, client):
+    payment_ids = seed_payments(app)
+    headers = admin_headers(app)
+    with app.app_context():
+        assert revenue_rollup.read() == {}
+    for payment_id in payment_ids:
+        assert client.put(f'/api/payments/{payment_id}/status', headers=headers,
+                          json={'status': 'completed'}).status_code == 200
+    with app.app_context():
+        assert revenue_rollup.read()[date(2026, 3, 8)] == (250.0, 1)
+
+        # Refunds and corrections move the rollup too; rolled-back flushes do not
+        db.session.get(Payment, payment_ids[1]).status = 'refunded'
+        db.session.get(Payment, payment_ids[3]).amount = 2500
+        db.session.commit()
+        db.session.get(Payment, payment_ids[0]).status = 'failed'
+        db.session.flush()
+        db.session.rollback()
+
+        assert revenue_rollup.read()[date(2026, 3, 8)] == (0.0, 0)
+        assert revenue_rollup.reconcile() == {}
+        weeks = revenue_rollup.series(date(2026, 3, 1), date(2026, 3, 15), 'week')
+        assert [(w['start'], w['amount'], w['payment_count']) for w in weeks] == [
+            (date(2026, 2, 23), 0.0, 0),
+            (date(2026, 3, 2), 1000.0, 1),
+            (date(2026, 3, 9), 400.0, 1),
+        ]
+
+    response = client.get('/api/admin/revenue?start=2026-02-15&end=2026-05-10', headers=headers)
+    data = response.get_json()
+    assert response.status_code == 200
+    assert [(b['start'], b['amount']) for b in data['series']] == [
+        ('2026-02-01', 0.0), ('2026-03-01', 1400.0), ('2026-04-01', 2500.0), ('2026-05-01', 0.0)
+    ]
+    assert data['total'] == 3900.0
+    days = client.get('/api/admin/revenue?start=2026-04-29&end=2026-05-01&granularity=day', headers=headers)
+    assert [b['amount'] for b in days.get_json()['series']] == [0.0, 2500.0, 0.0]
+    assert client.get('/api/admin/revenue?granularity=year', headers=headers).status_code == 400
+    assert client.get('/api/admin/revenue?start=2026-05-01&end=2026-04-01', headers=headers).status_code == 400
+
+def test_revenue_reconcile_fixes_bulk_updates(app, client):
+    seed_payments(app)
+    with app.app_context():
+        db.session.execute(db.text("UPDATE payments SET status = 'completed'"))
+        db.session.commit()
+        assert revenue_rollup.reconcile(fix=False) == {
+            date(2026, 3, 2): (1000.0, 1),
+            date(2026, 3, 8): (250.0, 1),
+            date(2026, 3, 9): (400.0, 1),
+            date(2026, 4, 30): (2000.0, 1),
+        }
+        db.session.execute(db.text('DELETE FROM revenue_daily'))
+        db.session.commit()
+        revenue_rollup.ensure_initialized()
+        assert revenue_rollup.read()[date(2026, 4, 30)] == (2000.0, 1)
+
+    response = client.post('/api/admin/stats/reconcile', headers=admin_headers(app))
+    assert response.get_json()['revenue_drift'] == {}
+    trend = client.get('/api/admin/dashboard', headers=admin_headers(app)).get_json()['revenue_trend']
+    assert len(trend) == 12 and trend[0]['label'] == 'Mar'
+
+def test_normalized_search_text():
+    assert {normalize_phone(p) for p in ['0712 345 678', '+254-712-345-678', '712345678']} == {'254712345678'}
+    assert search_text_for('Mary-Jane Otieno', 'mj_otieno@Example.com', '0712345678') == (
+        'mary jane otieno mj example com 254712345678'
+    )
+
+def test_user_search_matches_words_and_any_phone_format(app, client):
+    with app.app_context():
+        for email, name, phone in [
+            ('mary@example.com', 'Mary Wanjiku', '+254712345678'),
+            ('john.kamau@garage.co.ke', 'John Kamau', '0722000111'),
+            ('marybeth@example.com', 'Marybeth Achieng', '0733444555'),
+        ]:
+            user = make_user(email)
+            user.name, user.phone = name, phone
+        db.session.commit()
+        # Renames keep the search column in step
+        user = User.query.filter_by(email='john.kamau@garage.co.ke').one()
+        user.name = 'John Kariuki'
+        db.session.commit()
+
+    headers = admin_headers(app)
+
+    def search(term):
+        response = client.get('/api/admin/users', headers=headers, query_string={'search': term})
+        assert response.status_code == 200
+        return sorted(u['email'] for u in response.get_json()['users'])
+
+    assert search('0712 345') == ['mary@example.com']
+    assert search('+254 722') == ['john.kamau@garage.co.ke']
+    assert search('mary') == ['mary@example.com', 'marybeth@example.com']
+    assert search('Mary wanj') == ['mary@example.com']
+    assert search('garage') == ['john.kamau@garage.co.ke']
+    assert search('kariuki') == ['john.kamau@garage.co.ke']
+    assert search('kamau jo') == ['john.kamau@garage.co.ke']
+    assert search('%') == []
+
+def test_bulk_action_by_ids_reports_each_outcome(app, client):
+    with app.app_context():
+        users = [make_user(f'bulk{i}@example.com') for i in range(3)]
+        mechanic = make_user('bulkmech@example.com', 'mechanic')
+        mechanic.location = LOCATION
+        users[2].is_active = False
+        db.session.commit()
+        ids = [u.id for u in users]
+        mechanic_id = mechanic.id
+        admin_id = User.query.filter_by(email='info@fixoncall.com').first().id
+        mechanic_index.rebuild([(mechanic_id, mechanic.lat, mechanic.lon, None)])
+
+    headers = admin_headers(app)
+    response = client.post('/api/admin/users/bulk', headers=headers, json={
+        'action': 'suspend', 'user_ids': ids + [mechanic_id, admin_id, 999999]
+    })
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['updated'] == 3
+    assert [r['outcome'] for r in data['results']] == [
+        'updated', 'updated', 'unchanged', 'updated', 'skipped', 'not_found'
+    ]
+    # Core updates still reach the mechanic index
+    assert mechanic_id not in mechanic_index
+    with app.app_context():
+        assert User.query.filter(User.id.in_(ids + [mechanic_id]), User.is_active.is_(True)).count() == 0
+        assert db.session.get(User, admin_id).is_active
+
+    data = client.post('/api/admin/users/bulk', headers=headers, json={
+        'action': 'toggle-active', 'user_ids': [ids[0], mechanic_id]
+    }).get_json()
+    assert [r['is_active'] for r in data['results']] == [True, True]
+    assert mechanic_id in mechanic_index
+
+    for body in [{'action': 'delete', 'user_ids': ids}, {'action': 'ban'},
+                 {'action': 'ban', 'filter': {}}, {'action': 'ban', 'filter': {'created_to': 'soon'}}]:
+        assert client.post('/api/admin/users/bulk', headers=headers, json=body).status_code == 400
+
+def test_bulk_action_by_filter_streams_batches(app, client):
+    with app.app_context():
+        for i in range(7):
+            user = make_user(f'old{i}@example.com')
+            user.created_at = datetime(2025, 6, i + 1)
+        make_user('new@example.com')
+        db.session.commit()
+
+    headers = admin_headers(app)
+    response = client.post('/api/admin/users/bulk', headers=headers, json={
+        'action': 'ban', 'stream': True, 'batch_size': 3,
+        'filter': {'user_type': 'driver', 'created_from': '2025-06-01', 'created_to': '2025-06-30'}
+    })
+    assert response.mimetype == 'application/x-ndjson'
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [e['event'] for e in events] == ['progress', 'progress', 'progress', 'done']
+    assert [e['processed'] for e in events[:3]] == [3, 6, 7]
+    assert events[-1]['updated'] == events[-1]['total'] == 7
+    with app.app_context():
+        banned = {u.email for u in User.query.filter(User.is_active.is_(False))}
+    assert banned == {f'old{i}@example.com' for i in range(7)}
+
+    # Re-running changes nothing
+    data = client.post('/api/admin/users/bulk', headers=headers, json={
+        'action': 'ban', 'filter': {'user_type': 'driver', 'created_to': '2025-06-30'}
+    }).get_json()
+    assert data['updated'] == 0 and data['results'] == []
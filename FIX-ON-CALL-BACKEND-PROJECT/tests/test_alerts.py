@@ -0,0 +1,117 @@
+import json
+import pytest
+from sqlalchemy import event
+from database import db
+from models.payment import Notification
+from models.user import User
+from utils.alert_fanout import AlertEvent, alert_buffer, fan_out_alerts
+from utils.broker import Broker, broker, user_channel
+from tests.conftest import TestConfig, headers_for
+
+class StreamConfig(TestConfig):
+    SSE_HEARTBEAT_SECONDS = 0.05
+    SSE_MAX_STREAM_SECONDS = 0.5
+
+NAIROBI = (-1.2921, 36.8219)
+
+@pytest.fixture
+def config():
+    return StreamConfig
+
+def make_user(email, user_type='mechanic', latitude=None, longitude=None, **fields):
+    user = User(
+        email=email,
+        name=email.split('@')[0],
+        phone='+254712345678',
+        user_type=user_type,
+        location={'latitude': latitude, 'longitude': longitude} if latitude is not None else None,
+        **fields
+    )
+    user.set_password('1234')
+    db.session.add(user)
+    return user
+
+def test_broker_delivers_to_channel_subscribers_and_drops_oldest():
+    local = Broker(max_pending=2)
+    with local.subscribe('user:1', 'user:2') as both, local.subscribe('user:2') as second:
+        local.publish('user:1', 'a')
+        local.publish_many([('user:2', 'b'), ('user:2', 'c'), ('user:3', 'x')])
+        assert (local.published, local.delivered) == (4, 5)
+        assert [both.get(0), both.get(0), both.get(0)] == [('user:2', 'b'), ('user:2', 'c'), None]
+        assert both.dropped == 1
+        assert second.get(0) == ('user:2', 'b')
+    assert local.subscriber_count('user:2') == 0
+
+def test_fan_out_notifies_mechanics_within_their_own_radius(app):
+    with app.app_context():
+        driver = make_user('driver@example.com', 'driver')
+        # ~5.6 km north of the alert
+        wide = make_user('wide@example.com', latitude=NAIROBI[0] + 0.05, longitude=NAIROBI[1], service_radius_km=10)
+        narrow = make_user('narrow@example.com', latitude=NAIROBI[0] + 0.05, longitude=NAIROBI[1], service_radius_km=3)
+        busy = make_user('busy@example.com', latitude=NAIROBI[0], longitude=NAIROBI[1], is_available=False)
+        far = make_user('far@example.com', latitude=NAIROBI[0] + 2, longitude=NAIROBI[1])
+        db.session.commit()
+        ids = {u.email: u.id for u in (driver, wide, narrow, busy, far)}
+
+        events = [
+            AlertEvent(1, 10, ids['driver@example.com'], NAIROBI[0], NAIROBI[1], 'high'),
+            AlertEvent(2, 11, ids['driver@example.com'], NAIROBI[0] + 0.06, NAIROBI[1], 'high'),
+        ]
+        commits = []
+        count_commit = lambda session: commits.append(session)
+        event.listen(db.session, 'after_commit', count_commit)
+        with broker.subscribe(user_channel(ids['wide@example.com'])) as inbox:
+            payloads = fan_out_alerts(events)
+            pushed = [inbox.get(0), inbox.get(0), inbox.get(0)]
+        event.remove(db.session, 'after_commit', count_commit)
+
+        # Alert 1 only reaches `wide`; alert 2 (~1.1 km away) reaches both
+        assert len(commits) == 1
+        assert sorted((p['recipient_id'], p['message'][:11]) for p in payloads) == sorted([
+            (ids['wide@example.com'], 'Service #10'),
+            (ids['wide@example.com'], 'Service #11'),
+            (ids['narrow@example.com'], 'Service #11'),
+        ])
+        assert Notification.query.filter_by(type='emergency_alert').count() == 3
+        assert [m[1]['event'] for m in pushed[:2]] == ['notification', 'notification']
+        assert pushed[2] is None
+
+def test_breakdown_request_queues_alert_fan_out(app, client):
+    with app.app_context():
+        driver = make_user('driver@example.com', 'driver')
+        mechanic = make_user('mech@example.com', latitude=NAIROBI[0] + 0.01, longitude=NAIROBI[1])
+        db.session.commit()
+        driver_id, mechanic_id = driver.id, mechanic.id
+        headers = headers_for(app, driver_id)
+
+    response = client.post('/api/services/request', headers=headers, json={
+        'service_type': 'breakdown',
+        'location': {'latitude': NAIROBI[0], 'longitude': NAIROBI[1]}
+    })
+    assert response.status_code == 201
+    assert len(alert_buffer) == 1
+    assert alert_buffer.flush() == 1
+
+    with app.app_context():
+        notification = Notification.query.filter_by(recipient_id=mechanic_id).one()
+        assert notification.sender_id == driver_id
+        assert notification.type == 'emergency_alert'
+
+def test_notification_stream_pushes_events(app, client):
+    with app.app_context():
+        mechanic = make_user('mech@example.com', latitude=NAIROBI[0], longitude=NAIROBI[1])
+        db.session.commit()
+        mechanic_id = mechanic.id
+        headers = headers_for(app, mechanic_id)
+
+    response = client.get('/api/notifications/stream', headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    broker.publish(user_channel(mechanic_id), {'event': 'notification', 'data': {'id': 7}})
+
+    body = b''.join(response.response).decode()
+    response.close()
+    assert body.startswith('retry: 3000')
+    assert 'event: notification\ndata: ' + json.dumps({'id': 7}) in body
+    assert ': keep-alive' in body
+    assert broker.subscriber_count(user_channel(mechanic_id)) == 0
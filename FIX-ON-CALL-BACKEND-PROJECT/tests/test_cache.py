@@ -0,0 +1,93 @@
+import time
+import pytest
+from database import db
+from models.service import Service
+from models.user import User
+from utils.cache import LocalBackend, response_cache
+from utils.dispatch import claim_assignment
+from utils.replicas import STICKY_HEADER
+from tests.conftest import headers_for
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+@pytest.fixture
+def ids(app):
+    with app.app_context():
+        users = {}
+        for email, user_type in [('driver@example.com', 'driver'), ('mech@example.com', 'mechanic')]:
+            user = User(email=email, name=email.split('@')[0], phone='+254712345678', user_type=user_type,
+                        location=LOCATION if user_type == 'mechanic' else None)
+            user.set_password('1234')
+            db.session.add(user)
+            users[user_type] = user
+        db.session.flush()
+        service = Service(user_id=users['driver'].id, service_type='towing', location=LOCATION)
+        db.session.add(service)
+        db.session.commit()
+        admin = User.query.filter_by(email='info@fixoncall.com').first()
+        return {'driver': users['driver'].id, 'mechanic': users['mechanic'].id, 'service': service.id,
+                'admin': admin.id}
+
+def test_local_backend_is_bounded_lru_with_ttl():
+    backend = LocalBackend(max_entries=2)
+    backend.set('a', 1, ttl=60)
+    backend.set('b', 2, ttl=60)
+    assert backend.get('a') == 1
+    backend.set('c', 3, ttl=60)
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == (1, None, 3)
+    assert backend.evictions == 1
+
+    backend.set('d', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get('d') is None
+
+def test_admin_services_are_cached_until_a_write_commits(app, client, ids):
+    admin = headers_for(app, ids['admin'])
+    first = client.get('/api/admin/services', headers=admin)
+    second = client.get('/api/admin/services', headers=admin)
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert second.get_json() == first.get_json()
+    assert client.get('/api/admin/services?status=pending', headers=admin).headers['X-Cache'] == 'MISS'
+
+    # A client reading its own recent writes goes past the cache without touching the entry
+    bypasses = response_cache.bypasses
+    sticky = {**admin, STICKY_HEADER: f'{time.time() + 5:.3f}'}
+    assert client.get('/api/admin/services', headers=sticky).headers['X-Cache'] == 'BYPASS'
+    assert response_cache.bypasses == bypasses + 1
+    assert client.get('/api/admin/services', headers=admin).headers['X-Cache'] == 'HIT'
+
+    # A cached response is never served to a non-admin
+    driver = headers_for(app, ids['driver'])
+    assert client.get('/api/admin/services', headers=driver).status_code == 403
+
+    # Rolled-back writes keep the entry; committed ones (ORM or Core) drop it
+    with app.app_context():
+        db.session.get(Service, ids['service']).status = 'cancelled'
+        db.session.flush()
+        db.session.rollback()
+    assert client.get('/api/admin/services', headers=admin).headers['X-Cache'] == 'HIT'
+
+    with app.app_context():
+        assert claim_assignment(ids['service'], ids['mechanic']).assigned
+    response = client.get('/api/admin/services', headers=admin)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['services'][0]['status'] == 'accepted'
+
+    response = client.put(f"/api/services/{ids['service']}/status", headers=driver, json={'status': 'cancelled'})
+    assert response.status_code == 200
+    assert client.get('/api/admin/services', headers=admin).get_json()['services'][0]['status'] == 'cancelled'
+
+def test_dashboard_invalidated_by_admin_user_actions(app, client, ids):
+    admin = headers_for(app, ids['admin'])
+    hits_before = response_cache.hits
+    assert client.get('/api/admin/dashboard', headers=admin).get_json()['statistics']['total_mechanics'] == 1
+    assert client.get('/api/admin/dashboard', headers=admin).headers['X-Cache'] == 'HIT'
+
+    assert client.post(f"/api/admin/users/{ids['driver']}/suspend", headers=admin).status_code == 200
+    assert client.get('/api/admin/users', headers=admin).headers['X-Cache'] == 'MISS'
+    assert client.get('/api/admin/dashboard', headers=admin).headers['X-Cache'] == 'MISS'
+
+    stats = client.get('/api/admin/cache/stats', headers=admin).get_json()['cache']
+    assert stats['backend'] == 'local'
+    assert stats['hits'] - hits_before == 1
+    assert stats['invalidations'] > 0
@@ -0,0 +1,169 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from app import create_app
+from database import db
+from models.service import Service
+from models.user import User
+from utils.dispatch import DispatchJob, DispatchMechanic, solve_assignment
+from tests.conftest import TestConfig, admin_headers
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+def job(job_id, lon, priority='medium', service_type='towing', waited=0):
+    return DispatchJob(job_id, 0.0, lon, service_type, priority, NOW - timedelta(minutes=waited))
+
+def mechanic(mechanic_id, lon, specialization=(), radius=50):
+    return DispatchMechanic(mechanic_id, 0.0, lon, list(specialization), radius)
+
+def test_global_assignment_beats_greedy():
+    # Greedy would give job 1 its nearest mechanic (A) and send B the long way to job 2
+    jobs = [job(1, 0.0), job(2, 0.2)]
+    mechanics = [mechanic('A', 0.1), mechanic('B', -0.15)]
+    assignments = solve_assignment(jobs, mechanics, NOW)
+    assert {(a.service_id, a.mechanic_id) for a in assignments} == {(1, 'B'), (2, 'A')}
+    assert sum(a.distance_km for a in assignments) < 30
+
+def test_priority_wins_when_mechanics_are_scarce():
+    jobs = [job(1, 0.0, priority='low'), job(2, 0.05, priority='high')]
+    assignments = solve_assignment(jobs, [mechanic('A', 0.01)], NOW)
+    assert [(a.service_id, a.mechanic_id) for a in assignments] == [(2, 'A')]
+
+def test_specialist_preferred_and_radius_respected():
+    jobs = [job(1, 0.0, service_type='battery_jump')]
+    mechanics = [mechanic('general', 0.04), mechanic('sparky', 0.045, ['electrical'])]
+    assert solve_assignment(jobs, mechanics, NOW)[0].mechanic_id == 'sparky'
+
+    assert solve_assignment([job(1, 0.0)], [mechanic('far', 1.0, radius=10)], NOW) == []
+
+def test_dispatch_endpoint_commits_assignments(app, client):
+    with app.app_context():
+        driver = User(email='driver@example.com', name='Driver', phone='0712345678', user_type='driver')
+        driver.set_password('1234')
+        db.session.add(driver)
+        for i, lon in enumerate([36.80, 36.90]):
+            m = User(email=f'mech{i}@example.com', name=f'Mech {i}', phone='0712345678', user_type='mechanic',
+                     location={'latitude': -1.29, 'longitude': lon}, service_radius_km=20)
+            m.set_password('1234')
+            db.session.add(m)
+        db.session.flush()
+        for lon in [36.81, 36.89, 37.5]:
+            db.session.add(Service(user_id=driver.id, service_type='towing',
+                                   location={'latitude': -1.29, 'longitude': lon}))
+        db.session.commit()
+    headers = admin_headers(app)
+
+    response = client.post('/api/admin/dispatch', json={'dry_run': True}, headers=headers)
+    assert response.get_json()['committed'] is False
+    assert len(response.get_json()['assignments']) == 2
+    for max_jobs in ['abc', None, [5], True, 0, -3]:
+        response = client.post('/api/admin/dispatch', json={'max_jobs': max_jobs}, headers=headers)
+        assert response.status_code == 400
+
+    response = client.post('/api/admin/dispatch', headers=headers)
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['committed'] is True
+    assert len(data['assignments']) == 2
+    assert len(data['unassigned_service_ids']) == 1
+
+    with app.app_context():
+        assert Service.query.filter_by(status='accepted').count() == 2
+        assert User.query.filter_by(user_type='mechanic', is_available=True).count() == 0
+        for service in Service.query.filter_by(status='accepted'):
+            assert service.mechanic.location['longitude'] == pytest.approx(service.location['longitude'], abs=0.02)
+
+def seed_jobs(services, mechanics):
+    driver = User(email='stress-driver@example.com', name='Driver', phone='0712345678', user_type='driver')
+    driver.set_password('1234')
+    db.session.add(driver)
+    for i in range(mechanics):
+        m = User(email=f'stress{i}@example.com', name=f'Mech {i}', phone='0712345678', user_type='mechanic',
+                 location={'latitude': -1.29, 'longitude': 36.8})
+        m.set_password('1234')
+        db.session.add(m)
+    db.session.flush()
+    for _ in range(services):
+        db.session.add(Service(user_id=driver.id, service_type='towing', location={'latitude': -1.29, 'longitude': 36.8}))
+    db.session.commit()
+    service_ids = [s.id for s in Service.query.all()]
+    mechanic_ids = [m.id for m in User.query.filter_by(user_type='mechanic')]
+    return service_ids, mechanic_ids
+
+def test_assign_endpoint_reports_conflicts(app, client):
+    with app.app_context():
+        (first, second), (mechanic_id, other_id) = seed_jobs(2, 2)
+    headers = admin_headers(app)
+
+    response = client.post(f'/api/services/{first}/assign', json={'mechanic_id': mechanic_id}, headers=headers)
+    assert response.status_code == 200
+
+    response = client.post(f'/api/services/{first}/assign', json={'mechanic_id': other_id}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['code'] == 'SERVICE_NOT_PENDING'
+    assert response.get_json()['retryable'] is False
+
+    response = client.post(f'/api/services/{second}/assign', json={'mechanic_id': mechanic_id}, headers=headers)
+    assert response.status_code == 409
+    assert response.get_json()['code'] == 'MECHANIC_UNAVAILABLE'
+    assert response.get_json()['retryable'] is True
+
+    assert client.post('/api/services/999/assign', json={'mechanic_id': other_id}, headers=headers).status_code == 404
+    for bad in [{}, {'mechanic_id': 'abc'}, {'mechanic_id': None}, {'mechanic_id': True}, {'mechanic_id': -3}]:
+        assert client.post(f'/api/services/{second}/assign', json=bad, headers=headers).status_code == 400
+    assert client.post(f'/api/services/{second}/assign', data='oops', headers=headers).status_code == 400
+
+    with app.app_context():
+        assert db.session.get(Service, second).status == 'pending'
+        assert db.session.get(User, other_id).is_available is True
+
+def test_concurrent_claims_never_double_assign(tmp_path):
+    import random
+    import threading
+    from sqlalchemy.exc import OperationalError
+    from utils.dispatch import claim_assignment
+
+    class StressConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', f'sqlite:///{tmp_path}/stress.db')
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 16}
+
+    stress_app = create_app(StressConfig)
+    with stress_app.app_context():
+        service_ids, mechanic_ids = seed_jobs(40, 25)
+
+    wins = []
+    wins_lock = threading.Lock()
+    start = threading.Barrier(16)
+
+    def dispatcher(seed):
+        rng = random.Random(seed)
+        start.wait()
+        for _ in range(60):
+            service_id, mechanic_id = rng.choice(service_ids), rng.choice(mechanic_ids)
+            with stress_app.app_context():
+                try:
+                    if claim_assignment(service_id, mechanic_id).assigned:
+                        with wins_lock:
+                            wins.append((service_id, mechanic_id))
+                except OperationalError:
+                    db.session.rollback()
+
+    threads = [threading.Thread(target=dispatcher, args=(seed,)) for seed in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with stress_app.app_context():
+        accepted = Service.query.filter_by(status='accepted').all()
+        busy = {m.id for m in User.query.filter_by(user_type='mechanic', is_available=False)}
+        db.session.remove()
+        db.drop_all()
+
+    assert wins, 'no dispatcher ever succeeded'
+    # Every reported win is in the database, and nothing else is
+    assert sorted(wins) == sorted((s.id, s.assigned_to) for s in accepted)
+    # No service and no mechanic was claimed twice
+    assert len({s for s, _ in wins}) == len(wins)
+    assert len({m for _, m in wins}) == len(wins)
+    assert busy == {m for _, m in wins}
@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+import pytest
+from sqlalchemy import String, case, cast, insert, literal, select
+from database import db
+from models.payment import Payment
+from models.service import Service
+from models.user import User
+from tests.conftest import admin_headers
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+EXPORT_ROWS = int(os.getenv('EXPORT_TEST_ROWS', 1000000))
+
+def test_export_filters_and_formats(app, client):
+    with app.app_context():
+        driver = User(email='driver@example.com', name='Driver, Jr.', phone='+254712345678', user_type='driver')
+        driver.set_password('1234')
+        db.session.add(driver)
+        db.session.flush()
+        for day, status in [(1, 'pending'), (2, 'completed'), (3, 'completed'), (20, 'completed')]:
+            db.session.add(Service(user_id=driver.id, service_type='towing', status=status, location=LOCATION,
+                                   created_at=datetime(2026, 3, day, 12)))
+        db.session.commit()
+    headers = admin_headers(app)
+
+    response = client.get('/api/admin/export/services?status=completed&start=2026-03-02&end=2026-03-03',
+                          headers=headers)
+    assert response.mimetype == 'text/csv'
+    assert 'attachment; filename="services-' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['created_at'] for row in rows] == ['2026-03-02T12:00:00', '2026-03-03T12:00:00']
+    assert json.loads(rows[0]['location']) == LOCATION
+
+    response = client.get('/api/admin/export/users?format=ndjson&status=active', headers=headers)
+    users = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert {u['email'] for u in users} == {'info@fixoncall.com', 'driver@example.com'}
+    assert 'password_hash' not in users[0]
+
+    for url in ['/api/admin/export/bookings', '/api/admin/export/users?status=banned',
+                '/api/admin/export/services?format=xml', '/api/admin/export/payments?start=March']:
+        assert client.get(url, headers=headers).status_code == 400
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def export_memory_growth(client, headers, url):
+    """(lines, RSS growth in bytes) while downloading an export chunk by chunk"""
+    baseline = peak = rss_bytes()
+    response = client.get(url, headers=headers, buffered=False)
+    lines = 0
+    try:
+        for chunk in response.response:
+            lines += chunk.count(b'\n')
+            peak = max(peak, rss_bytes())
+    finally:
+        response.close()
+    return lines, peak - baseline
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/statm'), reason='needs /proc to read the resident set size')
+def test_export_memory_stays_flat(app, client):
+    with app.app_context():
+        user_id = User.query.filter_by(email='info@fixoncall.com').first().id
+        service = Service(user_id=user_id, service_type='towing', location=LOCATION)
+        db.session.add(service)
+        db.session.flush()
+        # Generated in SQL: building a million parameter sets in Python would dominate the test
+        seq = select(literal(0).label('i')).cte('seq', recursive=True)
+        seq = seq.union_all(select(seq.c.i + 1).where(seq.c.i < EXPORT_ROWS - 1))
+        db.session.execute(insert(Payment).from_select(
+            ['service_id', 'user_id', 'amount', 'payment_method', 'status', 'transaction_id', 'created_at'],
+            select(
+                literal(service.id), literal(user_id), literal(1500.0), literal('mpesa'),
+                case((seq.c.i % 10 == 0, 'failed'), else_='completed'),
+                literal('TX') + cast(seq.c.i, String), literal(datetime(2026, 1, 1)),
+            )
+        ))
+        db.session.commit()
+    headers = admin_headers(app)
+
+    # A tenth of the rows, then all of them: memory must not grow with the row count
+    tenth, tenth_growth = export_memory_growth(client, headers, '/api/admin/export/payments?status=failed')
+    rows, growth = export_memory_growth(client, headers, '/api/admin/export/payments?format=ndjson')
+    # CSV has a header line, NDJSON none
+    assert (tenth, rows) == (EXPORT_ROWS // 10 + 1, EXPORT_ROWS)
+    assert growth < 8 * 1024 * 1024, (tenth_growth, growth)
@@ -0,0 +1,54 @@
+import random
+import pytest
+from utils.geolocation import (
+    batch_distances, calculate_distance, find_nearby_locations, get_estimated_time
+)
+
+NAIROBI = {'latitude': -1.2921, 'longitude': 36.8219}
+
+def random_points(count, seed=7):
+    rng = random.Random(seed)
+    return [(rng.uniform(-80, 80), rng.uniform(-179, 179)) for _ in range(count)]
+
+def test_batch_distances_match_scalar():
+    points = random_points(500) + [(NAIROBI['latitude'], NAIROBI['longitude'])]
+    result = batch_distances(
+        NAIROBI['latitude'], NAIROBI['longitude'], [p[0] for p in points], [p[1] for p in points]
+    )
+    expected = [calculate_distance(NAIROBI['latitude'], NAIROBI['longitude'], lat, lon) for lat, lon in points]
+    assert result.distances.tolist() == pytest.approx(expected, rel=1e-9, abs=1e-9)
+    assert result.mask.all()
+    assert result.nearest[0] == len(points) - 1
+
+def test_batch_distances_radius_mask_and_top_k():
+    points = random_points(300)
+    lats, lons = [p[0] for p in points], [p[1] for p in points]
+    result = batch_distances(0, 0, lats, lons, radius_km=5000, k=10)
+    scalar = [calculate_distance(0, 0, lat, lon) for lat, lon in points]
+
+    assert result.mask.tolist() == [d <= 5000 for d in scalar]
+    within = sorted((d, i) for i, d in enumerate(scalar) if d <= 5000)
+    assert result.nearest.tolist() == [i for _, i in within[:10]]
+
+    empty = batch_distances(0, 0, [], [], radius_km=1, k=3)
+    assert empty.distances.size == 0 and empty.nearest.size == 0
+
+def test_find_nearby_locations_does_not_mutate_input():
+    locations = [
+        {'id': 1, 'location': {'latitude': -1.30, 'longitude': 36.82}},
+        {'id': 2, 'location': {'latitude': -1.2925, 'longitude': 36.8220}},
+        {'id': 3, 'location': {'latitude': -2.5, 'longitude': 36.82}},
+        {'id': 4, 'location': {}},
+    ]
+    nearby = find_nearby_locations(NAIROBI, locations, 10)
+
+    assert [loc['id'] for loc in nearby] == [2, 1]
+    assert nearby[1]['distance_km'] == round(calculate_distance(-1.2921, 36.8219, -1.30, 36.82), 2)
+    assert all('distance_km' not in loc for loc in locations)
+    assert [loc['id'] for loc in find_nearby_locations(NAIROBI, locations, 10, limit=1)] == [2]
+
+def test_get_estimated_time_scalar_and_array():
+    assert get_estimated_time(0) == 0
+    assert get_estimated_time(10) == 15
+    assert get_estimated_time(-3) == 0
+    assert get_estimated_time([0, 10, 20, 1], avg_speed_kmh=60).tolist() == [0, 10, 20, 1]
@@ -0,0 +1,66 @@
+import threading
+import time
+from flask import Flask, current_app
+from utils.jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JobQueue
+
+def make_app(testing=False):
+    app = Flask(__name__)
+    app.config['TESTING'] = testing
+    return app
+
+def test_jobs_run_in_app_context_and_keep_results():
+    queue = JobQueue(workers=2)
+    queue.init_app(make_app())
+    try:
+        ok = queue.submit(lambda x: (current_app.name, x * 2), 21)
+        failing = queue.submit(lambda: 1 / 0, job_id='boom')
+        assert queue.join(timeout=5)
+        assert queue.result(ok).status == JOB_DONE
+        assert queue.result(ok).result == ('tests.test_jobs', 42)
+        assert failing == 'boom'
+        assert queue.result('boom').status == JOB_FAILED
+        assert 'division' in queue.result('boom').error
+        assert queue.result('unknown') is None
+    finally:
+        queue.stop()
+
+def test_full_queue_runs_job_in_caller():
+    queue = JobQueue(workers=1, max_queue=1)
+    queue.init_app(make_app())
+    release = threading.Event()
+    ran_in = []
+    try:
+        queue.submit(release.wait, 5)
+        # Wait until the only worker is busy, then fill the single queue slot
+        deadline = time.monotonic() + 5
+        while len(queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        queued = queue.submit(lambda: ran_in.append(threading.current_thread().name))
+        inline = queue.submit(lambda: ran_in.append(threading.current_thread().name))
+
+        assert queue.result(queued).status == JOB_QUEUED
+        assert queue.result(inline).status == JOB_DONE
+        assert ran_in == [threading.current_thread().name]
+        assert queue.ran_inline == 1
+    finally:
+        release.set()
+        queue.stop()
+    assert len(ran_in) == 2
+
+def test_stop_drains_queued_jobs():
+    queue = JobQueue(workers=2)
+    queue.init_app(make_app())
+    done = []
+    for i in range(50):
+        queue.submit(lambda i=i: (time.sleep(0.001), done.append(i)))
+    queue.stop()
+    assert sorted(done) == list(range(50))
+    assert not queue.running
+
+def test_testing_app_defers_jobs_until_join():
+    queue = JobQueue()
+    queue.init_app(make_app(testing=True))
+    job_id = queue.submit(lambda: 'later')
+    assert queue.result(job_id).status == JOB_QUEUED
+    assert queue.join()
+    assert queue.result(job_id).result == 'later'
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+import pytest
+from database import db
+from models.outbox import OUTBOX_DEAD, OUTBOX_PENDING, OUTBOX_SENDING, OUTBOX_SENT, OutboxMessage
+from utils.notifications import send_email, send_sms
+from utils.outbox import notification_outbox
+from utils.smtp_sink import SMTPSink
+from tests.conftest import TestConfig, admin_headers
+
+class MailConfig(TestConfig):
+    MAIL_SERVER = '127.0.0.1'
+    MAIL_USE_TLS = False
+    MAIL_USERNAME = None
+    MAIL_PASSWORD = None
+    # Testing apps suppress sends by default; these go to the sink
+    MAIL_SUPPRESS_SEND = False
+    MAIL_DEBUG = False
+    OUTBOX_BATCH_SIZE = 10
+    OUTBOX_MAX_ATTEMPTS = 3
+
+@pytest.fixture
+def sink():
+    with SMTPSink() as sink:
+        yield sink
+
+@pytest.fixture
+def config(sink):
+    return type('SinkConfig', (MailConfig,), {'MAIL_PORT': sink.port})
+
+def make_due(app):
+    """Let every pending retry happen now"""
+    with app.app_context():
+        OutboxMessage.query.filter_by(status=OUTBOX_PENDING).update({'next_attempt_at': datetime.utcnow()})
+        db.session.commit()
+
+def test_emails_are_queued_and_sent_in_batches_over_one_connection(app, sink):
+    with app.app_context():
+        for i in range(25):
+            assert send_email(f'driver{i}@example.com', f'Update {i}', f'Hello driver {i}')
+        assert send_sms('+254700000001', 'Mechanic on the way')
+        # Nothing leaves in the request thread
+        assert sink.messages == []
+        assert OutboxMessage.query.filter_by(status=OUTBOX_PENDING).count() == 26
+
+        assert notification_outbox.drain() == 26
+
+        assert OutboxMessage.query.filter_by(status=OUTBOX_SENT).count() == 26
+        assert OutboxMessage.query.filter(OutboxMessage.sent_at.is_(None)).count() == 0
+
+    assert len(sink.messages) == 25
+    # Batches of 10: three SMTP connections for 25 emails
+    assert sink.connections == 3
+    assert sorted(m.recipients[0] for m in sink.messages) == sorted(f'driver{i}@example.com' for i in range(25))
+    assert b'Subject: Update 0' in next(m.data for m in sink.messages if m.recipients == ['driver0@example.com'])
+
+    stats = notification_outbox.stats()
+    assert (stats['batches'], stats['sent'], stats['connections']) == (3, 26, 3)
+    assert stats['sent_per_second'] > 0 and stats['sent_per_busy_second'] > 0
+
+def test_failures_are_retried_with_backoff_then_dead_lettered(app, client, sink):
+    sink.refuse('busy@example.com', '451 Try again later')
+    sink.refuse('nobody@example.com', '550 No such user')
+    with app.app_context():
+        for recipient in ('ok@example.com', 'busy@example.com', 'nobody@example.com'):
+            send_email(recipient, 'Service update', 'Your mechanic is on the way')
+
+        before = datetime.utcnow()
+        assert notification_outbox.drain() == 3
+        rows = {m.recipient: m for m in OutboxMessage.query}
+        assert rows['ok@example.com'].status == OUTBOX_SENT
+        # A permanent refusal is dead-lettered at once
+        assert (rows['nobody@example.com'].status, rows['nobody@example.com'].attempts) == (OUTBOX_DEAD, 1)
+        assert '550' in rows['nobody@example.com'].last_error
+        # A temporary one is retried later, not in the same drain
+        busy = rows['busy@example.com']
+        assert (busy.status, busy.attempts) == (OUTBOX_PENDING, 1)
+        assert '451' in busy.last_error
+        delay = (busy.next_attempt_at - before).total_seconds()
+        assert 0.8 * notification_outbox.backoff <= delay <= 1.2 * notification_outbox.backoff + 5
+
+    # Backoff doubles per attempt, up to the cap
+    notification_outbox.jitter = 0
+    assert [notification_outbox.backoff_seconds(n) for n in (1, 2, 3)] == [30, 60, 120]
+    assert notification_outbox.backoff_seconds(20) == notification_outbox.max_backoff
+
+    for attempts, status in [(2, OUTBOX_PENDING), (3, OUTBOX_DEAD)]:
+        make_due(app)
+        with app.app_context():
+            assert notification_outbox.drain() == 1
+            busy = OutboxMessage.query.filter_by(recipient='busy@example.com').one()
+            assert (busy.status, busy.attempts) == (status, attempts)
+
+    headers = admin_headers(app)
+    data = client.get('/api/admin/notifications/outbox', headers=headers).get_json()
+    assert data['queue']['by_status'] == {OUTBOX_PENDING: 0, OUTBOX_SENDING: 0, OUTBOX_SENT: 1, OUTBOX_DEAD: 2}
+    assert (data['workers']['sent'], data['workers']['retried'], data['workers']['dead']) == (1, 2, 2)
+
+    # Requeued dead letters go out once the server takes them
+    sink.refused.clear()
+    response = client.post('/api/admin/notifications/outbox/requeue', headers=headers, json={'ids': 'all'})
+    assert response.status_code == 400
+    response = client.post('/api/admin/notifications/outbox/requeue', headers=headers, json={})
+    assert response.get_json()['requeued'] == 2
+    with app.app_context():
+        assert notification_outbox.drain() == 2
+        assert OutboxMessage.query.filter_by(status=OUTBOX_SENT).count() == 3
+    assert sorted(r for m in sink.messages for r in m.recipients) == [
+        'busy@example.com', 'nobody@example.com', 'ok@example.com'
+    ]
+
+def test_unreachable_server_and_expired_claims(app, sink):
+    with app.app_context():
+        send_email('driver@example.com', 'Service update', 'Hello')
+    sink.stop()
+    with app.app_context():
+        assert notification_outbox.drain() == 1
+        message = OutboxMessage.query.one()
+        assert (message.status, message.attempts) == (OUTBOX_PENDING, 1)
+        assert message.next_attempt_at > datetime.utcnow()
+
+        # A worker that died holding a claim: the message is picked up again once it expires
+        message.status, message.claim_token = OUTBOX_SENDING, 'gone'
+        message.next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert notification_outbox.drain() == 1
+        message = OutboxMessage.query.one()
+        assert (message.status, message.attempts, message.claim_token) == (OUTBOX_PENDING, 2, None)
+
+        # Old sent messages are purged, dead letters are kept
+        db.session.add_all([
+            OutboxMessage(recipient='a@example.com', body='x', status=OUTBOX_SENT,
+                          sent_at=datetime.utcnow() - timedelta(days=30)),
+            OutboxMessage(recipient='b@example.com', body='x', status=OUTBOX_SENT, sent_at=datetime.utcnow()),
+            OutboxMessage(recipient='c@example.com', body='x', status=OUTBOX_DEAD),
+        ])
+        db.session.commit()
+        assert notification_outbox.purge_sent() == 1
+        assert OutboxMessage.query.count() == 3
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytest
+from database import db
+from models.payment import Notification
+from models.service import Service
+from models.user import User
+from utils.pagination import decode_cursor, encode_cursor
+from tests.conftest import headers_for
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+@pytest.fixture
+def ids(app):
+    with app.app_context():
+        driver = User(email='driver@example.com', name='driver', phone='+254712345678', user_type='driver')
+        driver.set_password('1234')
+        db.session.add(driver)
+        db.session.flush()
+        start = datetime(2026, 1, 1)
+        # Pairs of rows share a created_at, so the id tiebreak matters
+        for i in range(25):
+            db.session.add(Service(user_id=driver.id, service_type='towing', location=LOCATION,
+                                   created_at=start + timedelta(minutes=i // 2)))
+            db.session.add(Notification(recipient_id=driver.id, title=f'n{i}', message='m',
+                                        created_at=start + timedelta(minutes=i // 2)))
+        db.session.commit()
+        admin = User.query.filter_by(email='info@fixoncall.com').first()
+        return {'driver': driver.id, 'admin': admin.id}
+
+def walk(client, url, headers, key):
+    pages, cursor = [], ''
+    while True:
+        data = client.get(f'{url}&cursor={cursor}', headers=headers).get_json()
+        pages.append([row['id'] for row in data[key]])
+        if not data['pagination']['has_more']:
+            assert data['pagination']['next_cursor'] is None
+            return pages
+        cursor = data['pagination']['next_cursor']
+
+def test_cursor_pages_cover_every_row_once_newest_first(app, client, ids):
+    driver = headers_for(app, ids['driver'])
+    pages = walk(client, '/api/services/history?per_page=10', driver, 'services')
+    assert [len(page) for page in pages] == [10, 10, 5]
+    with app.app_context():
+        expected = [s.id for s in Service.query.order_by(Service.created_at.desc(), Service.id.desc())]
+    assert [row for page in pages for row in page] == expected
+
+    pages = walk(client, '/api/notifications/my-notifications?per_page=7', driver, 'notifications')
+    assert sum(len(page) for page in pages) == 25
+
+    admin = headers_for(app, ids['admin'])
+    assert sum(map(len, walk(client, '/api/admin/services?status=pending&per_page=20', admin, 'services'))) == 25
+
+def test_totals_and_offset_mode(app, client, ids):
+    driver = headers_for(app, ids['driver'])
+    data = client.get('/api/services/history?per_page=10&cursor=', headers=driver).get_json()
+    assert 'total' not in data['pagination']
+    data = client.get('/api/services/history?per_page=10&cursor=&total=exact', headers=driver).get_json()
+    assert data['pagination']['total'] == 25
+    data = client.get('/api/services/history?per_page=10&cursor=&total=estimate', headers=driver).get_json()
+    assert data['pagination']['total'] > 0
+
+    # Old clients keep page/total/pages
+    data = client.get('/api/services/history?page=3&per_page=10', headers=driver).get_json()
+    assert data['pagination'] == {'page': 3, 'per_page': 10, 'total': 25, 'pages': 3}
+    assert len(data['services']) == 5
+
+def test_malformed_cursor_is_rejected(app, client, ids):
+    driver = headers_for(app, ids['driver'])
+    for cursor in ['not-a-cursor', encode_cursor(datetime(2026, 1, 1), 1)[:-3]]:
+        response = client.get(f'/api/bookings/my-bookings?cursor={cursor}', headers=driver)
+        assert response.status_code == 400
+    assert decode_cursor(encode_cursor(datetime(2026, 1, 1, 8, 30), 42)) == (datetime(2026, 1, 1, 8, 30), 42)
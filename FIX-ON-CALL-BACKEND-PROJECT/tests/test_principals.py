@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+import pytest
+from flask_jwt_extended import decode_token
+from sqlalchemy import event
+from database import db
+from models.payment import Payment
+from models.service import Service
+from models.user import User
+from utils.principals import principal_cache
+from tests.conftest import TestConfig, admin_headers
+
+class UncachedConfig(TestConfig):
+    RESPONSE_CACHE_TTL_SECONDS = 0
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+@pytest.fixture
+def config():
+    return UncachedConfig
+
+@pytest.fixture
+def ids(app):
+    with app.app_context():
+        users = {}
+        for email, user_type in [('driver@example.com', 'driver'), ('ops@example.com', 'admin')]:
+            user = User(email=email, name=email.split('@')[0], phone='+254712345678', user_type=user_type)
+            user.set_password('1234')
+            db.session.add(user)
+            users[user_type] = user
+        db.session.flush()
+        service = Service(user_id=users['driver'].id, service_type='towing', location=LOCATION)
+        db.session.add(service)
+        db.session.flush()
+        payment = Payment(service_id=service.id, user_id=users['driver'].id, amount=1500.0)
+        db.session.add(payment)
+        db.session.commit()
+        return {'driver': users['driver'].id, 'ops': users['admin'].id, 'payment': payment.id}
+
+def login(client, email):
+    response = client.post('/api/auth/login', json={'email': email, 'password': '1234'})
+    return {'Authorization': f'Bearer {response.get_json()["token"]}'}
+
+@contextmanager
+def count_queries(app):
+    statements = []
+    with app.app_context():
+        engine = db.engine
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def test_tokens_carry_role_claims_and_hot_path_skips_the_database(app, client, ids):
+    ops = login(client, 'ops@example.com')
+    driver = login(client, 'driver@example.com')
+    with app.app_context():
+        claims = decode_token(ops['Authorization'].split()[1])
+    assert (claims['role'], claims['active']) == ('admin', True)
+
+    assert client.get('/api/admin/cache/stats', headers=ops).status_code == 200
+    with count_queries(app) as statements:
+        # Warm principal: no user lookup
+        assert client.get('/api/admin/cache/stats', headers=ops).status_code == 200
+        # Role claim mismatch: refused before any lookup
+        assert client.get('/api/admin/cache/stats', headers=driver).status_code == 403
+    assert statements == []
+
+    # Owner and admin both read the payment; only the payment row is queried
+    with count_queries(app) as statements:
+        assert client.get(f'/api/payments/{ids["payment"]}', headers=driver).status_code == 200
+        assert client.get(f'/api/payments/{ids["payment"]}', headers=ops).status_code == 200
+    assert not [s for s in statements if 'FROM users' in s]
+
+def test_suspension_takes_effect_immediately(app, client, ids):
+    ops = login(client, 'ops@example.com')
+    # Tokens issued before the claims existed fall back to the cached lookup
+    legacy = admin_headers(app)
+    assert client.get('/api/admin/cache/stats', headers=ops).status_code == 200
+    assert ids['ops'] in principal_cache
+
+    # ORM update through the single-user endpoint
+    assert client.post(f'/api/admin/users/{ids["ops"]}/suspend', headers=legacy).status_code == 200
+    assert client.get('/api/admin/cache/stats', headers=ops).status_code == 403
+    assert client.post(f'/api/admin/users/{ids["ops"]}/activate', headers=legacy).status_code == 200
+    assert client.get('/api/admin/cache/stats', headers=ops).status_code == 200
+
+    # Core update through the bulk endpoint
+    response = client.post('/api/admin/users/bulk', headers=legacy, json={'action': 'ban', 'user_ids': [ids['ops']]})
+    assert response.get_json()['updated'] == 1
+    assert client.get('/api/admin/cache/stats', headers=ops).status_code == 403
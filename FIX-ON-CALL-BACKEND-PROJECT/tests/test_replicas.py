@@ -0,0 +1,169 @@
+import os
+import shutil
+import time
+import pytest
+from database import db
+from models.service import Service
+from models.user import User
+from utils.cache import response_cache
+from utils.replicas import STICKY_HEADER, replica_router
+from tests.conftest import TestConfig, admin_headers, headers_for
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+@pytest.fixture
+def paths(tmp_path):
+    return tmp_path / 'primary.db', tmp_path / 'replica.db'
+
+@pytest.fixture
+def config(paths):
+    primary, replica = paths
+
+    class ReplicaConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{primary}'
+        DATABASE_REPLICA_URLS = [f'sqlite:///{replica}']
+        REPLICA_ENGINE_OPTIONS = {}
+        REPLICA_STICKY_SECONDS = 60
+        RESPONSE_CACHE_TTL_SECONDS = 0
+
+    return ReplicaConfig
+
+@pytest.fixture(autouse=True)
+def replica_engines():
+    # Set up before the app, so the replica engines are disposed of after its teardown
+    yield
+    replica_router.dispose()
+
+def add_services(app, count):
+    with app.app_context():
+        driver = User.query.filter_by(email='driver@example.com').first()
+        if driver is None:
+            driver = User(email='driver@example.com', name='driver', phone='+254712345678', user_type='driver')
+            driver.set_password('1234')
+            db.session.add(driver)
+            db.session.flush()
+        for _ in range(count):
+            db.session.add(Service(user_id=driver.id, service_type='towing', location=LOCATION))
+        db.session.commit()
+        return driver.id
+
+def listed(client, headers):
+    response = client.get('/api/admin/services?page=1&per_page=50', headers=headers)
+    assert response.status_code == 200
+    return response.get_json()['pagination']['total']
+
+def test_reads_go_to_the_replica_and_writers_stick_to_the_primary(app, client, paths):
+    driver_id = add_services(app, 3)
+    # The replica is a snapshot of the primary, which then moves on
+    shutil.copy(*paths)
+    add_services(app, 2)
+    replica_router.refresh()
+    with app.app_context():
+        admin_id = User.query.filter_by(email='info@fixoncall.com').first().id
+    admin = headers_for(app, admin_id)
+
+    # The count and the page of one request come from the replica picked once
+    reads = replica_router.replica_reads
+    assert listed(client, admin) == 3
+    assert replica_router.replica_reads == reads + 1
+    driver = headers_for(app, driver_id)
+    data = client.get('/api/services/history?page=1', headers=driver).get_json()
+    assert data['pagination']['total'] == 3
+
+    # A write hands the client a header; sent back, it keeps that client's reads on the primary
+    response = client.post('/api/admin/users/bulk', headers=admin, json={'action': 'suspend', 'user_ids': [driver_id]})
+    assert response.get_json()['updated'] == 1
+    sticky_until = float(response.headers[STICKY_HEADER])
+    assert time.time() < sticky_until <= time.time() + 60
+    assert listed(client, {**admin, STICKY_HEADER: response.headers[STICKY_HEADER]}) == 5
+    assert listed(client, admin) == 3
+    assert client.get('/api/services/history?page=1', headers=driver).get_json()['pagination']['total'] == 3
+    # Reads alone hand out nothing, and neither an expired nor a made-up far-off time is honoured
+    assert STICKY_HEADER not in client.get('/api/services/history?page=1', headers=driver).headers
+    for until in (time.time() - 1, time.time() + 3600, 'soon'):
+        assert listed(client, {**admin, STICKY_HEADER: str(until)}) == 3
+
+    stats = client.get('/api/admin/replicas', headers=admin).get_json()
+    assert stats['enabled'] and stats['replica_reads'] > 0
+    assert stats['replicas'][0]['healthy']
+
+def test_cached_views_never_hold_a_lagging_replica_snapshot(app, client, paths, monkeypatch):
+    monkeypatch.setattr(response_cache, 'enabled', True)
+    monkeypatch.setattr(response_cache, 'ttl', 30)
+    driver_id = add_services(app, 3)
+    shutil.copy(*paths)
+    # The primary moves on; the replica stays three services behind
+    add_services(app, 2)
+    replica_router.refresh()
+    admin = admin_headers(app)
+    driver = headers_for(app, driver_id)
+    assert client.get('/api/services/history?page=1', headers=driver).get_json()['pagination']['total'] == 3
+
+    # A miss is built on the primary, so the entry matches the versions it is stored under
+    response = client.get('/api/admin/services?page=1&per_page=50', headers=admin)
+    assert (response.headers['X-Cache'], response.get_json()['pagination']['total']) == ('MISS', 5)
+    response = client.get('/api/admin/services?page=1&per_page=50', headers=admin)
+    assert (response.headers['X-Cache'], response.get_json()['pagination']['total']) == ('HIT', 5)
+
+    # After a write the next read is fresh, not the replica's snapshot
+    add_services(app, 1)
+    response = client.get('/api/admin/services?page=1&per_page=50', headers=admin)
+    assert (response.headers['X-Cache'], response.get_json()['pagination']['total']) == ('MISS', 6)
+
+    # A sticky client neither gets nor leaves an entry
+    sticky = {**admin, STICKY_HEADER: f'{time.time() + 30:.3f}'}
+    response = client.get('/api/admin/services?page=1&per_page=50', headers=sticky)
+    assert (response.headers['X-Cache'], response.get_json()['pagination']['total']) == ('BYPASS', 6)
+
+def test_lagging_or_unreachable_replicas_fall_back_to_the_primary(app, client, paths):
+    add_services(app, 3)
+    shutil.copy(*paths)
+    add_services(app, 2)
+    admin = admin_headers(app)
+    replica = replica_router.replicas[0]
+
+    # Until it has been checked a replica is not used
+    assert listed(client, admin) == 5
+
+    replica_router.lag_query = 'SELECT 30'
+    replica_router.check(replica)
+    assert listed(client, admin) == 5
+    assert replica.lag == 30 and not replica.healthy
+
+    replica_router.lag_query = None
+    replica_router.check(replica)
+    assert listed(client, admin) == 3
+    # Requests go by the last check and never probe the replica themselves
+    replica_router.lag_query = 'SELECT broken'
+    assert listed(client, admin) == 3
+    replica_router.lag_query = None
+    # A check too old to trust (the lag thread is stuck) is not gone by
+    replica.checked_at -= replica_router.lag_stale_seconds + 1
+    assert listed(client, admin) == 5
+
+    os.remove(paths[1])
+    os.mkdir(paths[1])  # a directory cannot be opened as a database
+    replica.engine.dispose()
+    replica_router.check(replica)
+    assert replica.error and not replica.healthy
+    assert listed(client, admin) == 5
+    assert replica_router.fallbacks > 0
+
+def test_lag_is_checked_in_the_background(app, paths):
+    add_services(app, 1)
+    shutil.copy(*paths)
+    replica = replica_router.replicas[0]
+    replica_router.lag_check_seconds = 0.05
+    replica_router.start()
+    try:
+        deadline = time.monotonic() + 5
+        while replica.checked_at is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first = replica.checked_at
+        assert first is not None and replica.healthy
+        while replica.checked_at == first and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert replica.checked_at > first
+    finally:
+        replica_router.stop()
+    assert not replica_router.running
@@ -0,0 +1,282 @@
+from datetime import datetime
+import pytest
+from flask_migrate import downgrade, stamp, upgrade
+from database import db
+from schema import prepare_schema
+from models.user import User
+from utils.geolocation import calculate_distance
+from utils.spatial_index import MechanicIndex, mechanic_index
+from tests.conftest import admin_headers, headers_for
+
+NAIROBI = (-1.2921, 36.8219)
+
+def make_mechanic(email, latitude, longitude, **fields):
+    mechanic = User(
+        email=email,
+        name=email.split('@')[0],
+        phone='+254712345678',
+        user_type='mechanic',
+        location={'latitude': latitude, 'longitude': longitude},
+        specialization=fields.pop('specialization', ['engine']),
+        **fields
+    )
+    mechanic.set_password('1234')
+    db.session.add(mechanic)
+    return mechanic
+
+def test_index_radius_search_matches_linear_scan():
+    index = MechanicIndex(cell_size_km=1.0)
+    points = {}
+    for i in range(400):
+        lat = NAIROBI[0] + ((i * 37) % 200 - 100) / 1000
+        lon = NAIROBI[1] + ((i * 91) % 200 - 100) / 1000
+        points[i] = (lat, lon)
+    index.rebuild((i, lat, lon, ['engine']) for i, (lat, lon) in points.items())
+
+    hits = index.radius_search(NAIROBI[0], NAIROBI[1], 5)
+    expected = sorted(
+        i for i, (lat, lon) in points.items() if calculate_distance(NAIROBI[0], NAIROBI[1], lat, lon) <= 5
+    )
+    assert sorted(i for i, _ in hits) == expected
+    assert [d for _, d in hits] == sorted(d for _, d in hits)
+
+def test_index_nearest_expands_until_k_found():
+    index = MechanicIndex(cell_size_km=1.0)
+    index.upsert(1, NAIROBI[0] + 0.3, NAIROBI[1])
+    index.upsert(2, NAIROBI[0] + 0.01, NAIROBI[1])
+    index.upsert(3, NAIROBI[0] - 0.1, NAIROBI[1], ['towing'])
+
+    assert [i for i, _ in index.nearest(NAIROBI[0], NAIROBI[1], 2)] == [2, 3]
+    assert [i for i, _ in index.nearest(NAIROBI[0], NAIROBI[1], 2, specialization='towing')] == [3]
+    assert index.nearest(NAIROBI[0], NAIROBI[1], 3, max_radius_km=5) == [(2, pytest.approx(1.11, abs=0.01))]
+
+    index.move(2, NAIROBI[0] + 0.5, NAIROBI[1])
+    index.remove(3)
+    assert [i for i, _ in index.nearest(NAIROBI[0], NAIROBI[1], 3)] == [1, 2]
+
+def test_index_follows_committed_user_changes(app):
+    with app.app_context():
+        mechanic = make_mechanic('near@example.com', NAIROBI[0] + 0.01, NAIROBI[1])
+        db.session.commit()
+        mechanic_index.ensure_loaded()
+        assert mechanic.id in mechanic_index
+
+        mechanic.current_location = {'latitude': NAIROBI[0] + 0.5, 'longitude': NAIROBI[1]}
+        db.session.commit()
+        assert mechanic_index.radius_search(NAIROBI[0], NAIROBI[1], 10) == []
+
+        mechanic.is_available = False
+        db.session.commit()
+        assert mechanic.id not in mechanic_index
+
+        mechanic.is_available = True
+        db.session.rollback()
+        assert mechanic.id not in mechanic_index
+
+def test_nearby_lookup_skips_stale_index_entries(app):
+    from utils.mechanic_lookup import find_nearby_mechanics
+
+    with app.app_context():
+        for i in range(6):
+            make_mechanic(f'm{i}@example.com', NAIROBI[0] + 0.01 * (i + 1), NAIROBI[1])
+        db.session.commit()
+        mechanic_index.ensure_loaded()
+        # Taken by another worker: the index of this one still lists them
+        db.session.execute(db.text(
+            "UPDATE users SET is_available = false WHERE email IN ('m0@example.com', 'm1@example.com', 'm2@example.com')"
+        ))
+        db.session.commit()
+
+        # The first round re-checks m0-m3 and finds one; the next goes further out
+        nearby = find_nearby_mechanics(NAIROBI[0], NAIROBI[1], 10, limit=2)
+        assert [m['email'] for m in nearby] == ['m3@example.com', 'm4@example.com']
+        assert [m['email'] for m in find_nearby_mechanics(NAIROBI[0], NAIROBI[1], 10)] == [
+            'm3@example.com', 'm4@example.com', 'm5@example.com'
+        ]
+
+def test_coordinates_follow_json_locations(app):
+    with app.app_context():
+        mechanic = make_mechanic('sync@example.com', NAIROBI[0], NAIROBI[1])
+        db.session.commit()
+        assert (mechanic.lat, mechanic.lon) == NAIROBI
+
+        mechanic.current_location = {'latitude': -1.3, 'longitude': 36.9}
+        db.session.commit()
+        assert (mechanic.lat, mechanic.lon) == (-1.3, 36.9)
+
+        mechanic.current_location = None
+        mechanic.location = {'address': 'unknown'}
+        db.session.commit()
+        assert (mechanic.lat, mechanic.lon) == (None, None)
+
+def test_migration_adds_and_backfills_coordinates(app):
+    with app.app_context():
+        make_mechanic('legacy@example.com', NAIROBI[0], NAIROBI[1])
+        db.session.commit()
+        # A database from before the coordinate columns, which no migration has touched
+        db.session.execute(db.text('DROP INDEX idx_users_type_lat_lon'))
+        db.session.execute(db.text('ALTER TABLE users DROP COLUMN lat'))
+        db.session.execute(db.text('ALTER TABLE users DROP COLUMN lon'))
+        db.session.commit()
+        db.session.expunge_all()
+        stamp(revision='base')
+        assert not prepare_schema()
+
+        upgrade()
+        row = db.session.execute(db.text(
+            "SELECT lat, lon FROM users WHERE email = 'legacy@example.com'"
+        )).one()
+        assert tuple(row) == NAIROBI
+        assert 'idx_users_type_lat_lon' in {i['name'] for i in db.inspect(db.engine).get_indexes('users')}
+        assert prepare_schema()
+
+        # Every step checks first, so it also applies to a database already up to date
+        stamp(revision='base')
+        upgrade()
+        assert prepare_schema()
+
+def test_migration_downgrade_removes_what_it_adds(app):
+    with app.app_context():
+        make_mechanic('legacy@example.com', NAIROBI[0], NAIROBI[1])
+        db.session.commit()
+        db.session.expunge_all()
+
+        downgrade(revision='base')
+        inspector = db.inspect(db.engine)
+        assert not {
+            'stat_counters', 'revenue_daily', 'support_conversation_tags', 'support_conversations_archive',
+            'support_messages_archive', 'notification_outbox', 'support_search'
+        } & set(inspector.get_table_names())
+        assert not {'lat', 'lon', 'search_text'} & {c['name'] for c in inspector.get_columns('users')}
+        assert not {'idx_users_created_id', 'idx_users_type_lat_lon'} & {
+            i['name'] for i in inspector.get_indexes('users')
+        }
+        assert not {'message_count', 'closed_at'} & {
+            c['name'] for c in inspector.get_columns('support_conversations')
+        }
+
+        upgrade()
+        row = db.session.execute(db.text(
+            "SELECT lat, lon, search_text FROM users WHERE email = 'legacy@example.com'"
+        )).one()
+        assert tuple(row) == NAIROBI + ('legacy example com 254712345678',)
+        assert prepare_schema()
+
+def test_available_mechanics_uses_bounding_box(app, client):
+    with app.app_context():
+        make_mechanic('close@example.com', NAIROBI[0] + 0.01, NAIROBI[1], specialization=['engine'])
+        make_mechanic('towing@example.com', NAIROBI[0] + 0.02, NAIROBI[1], specialization=['towing'])
+        make_mechanic('far@example.com', NAIROBI[0] + 1, NAIROBI[1])
+        db.session.commit()
+
+    response = client.get(
+        f'/api/services/available-mechanics?latitude={NAIROBI[0]}&longitude={NAIROBI[1]}&radius=10',
+        headers=admin_headers(app)
+    )
+    data = response.get_json()
+    assert response.status_code == 200
+    assert [m['email'] for m in data['mechanics']] == ['close@example.com', 'towing@example.com']
+    assert data['mechanics'][0]['distance_km'] == pytest.approx(1.11, abs=0.01)
+
+    response = client.get(
+        f'/api/services/available-mechanics?latitude={NAIROBI[0]}&longitude={NAIROBI[1]}&specialization=towing',
+        headers=admin_headers(app)
+    )
+    assert [m['email'] for m in response.get_json()['mechanics']] == ['towing@example.com']
+
+def test_request_service_returns_nearest_mechanics(app, client):
+    from models.service import EmergencyAlert
+    from utils.jobs import job_queue
+
+    with app.app_context():
+        for i in range(7):
+            make_mechanic(f'm{i}@example.com', NAIROBI[0] + 0.005 * (i + 1), NAIROBI[1])
+        db.session.commit()
+    headers = admin_headers(app)
+
+    nearest = [f'm{i}@example.com' for i in range(5)]
+    payload = {'service_type': 'breakdown', 'location': {'latitude': NAIROBI[0], 'longitude': NAIROBI[1]}}
+    response = client.post('/api/services/request', headers=headers, json=payload)
+    data = response.get_json()
+    assert response.status_code == 201
+    assert [m['email'] for m in data['nearby_mechanics']] == nearest
+    assert 'job_id' not in data and job_queue.submitted == 0
+    with app.app_context():
+        assert EmergencyAlert.query.filter_by(service_id=data['service']['id']).count() == 1
+
+    # Clients that prefer not to wait get the lookup later
+    response = client.post('/api/services/request', headers={**headers, 'Prefer': 'respond-async'}, json=payload)
+    data = response.get_json()
+    assert response.status_code == 201
+    assert response.headers['Preference-Applied'] == 'respond-async'
+    assert 'nearby_mechanics' not in data
+    url = data['nearby_mechanics_url']
+
+    # Still queued: the client is told to come back
+    response = client.get(url, headers=headers)
+    assert response.status_code == 202
+    assert response.headers['Retry-After'] == '1'
+
+    assert job_queue.join(timeout=5)
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert [m['email'] for m in response.get_json()['nearby_mechanics']] == nearest
+
+    # Without a stored result (another worker process, expired) it is computed on demand
+    job_queue.init_app(app)
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()['nearby_mechanics']) == 5
+
+def test_location_pings_are_coalesced_and_flushed(app, client):
+    from utils.location_updates import location_buffer
+
+    with app.app_context():
+        mechanic = make_mechanic('driver1@example.com', NAIROBI[0], NAIROBI[1])
+        db.session.commit()
+        mechanic_id = mechanic.id
+        mechanic_index.ensure_loaded()
+    headers = headers_for(app, mechanic_id)
+
+    response = client.post('/api/services/mechanics/location', headers=headers, json={'points': [
+        {'latitude': -1.30, 'longitude': 36.80, 'recorded_at': '2026-01-01T10:00:05Z', 'speed': 12},
+        {'latitude': -1.31, 'longitude': 36.81, 'recorded_at': '2026-01-01T10:00:00Z'},
+    ]})
+    assert response.status_code == 202
+    assert response.get_json()['accepted'] == 2
+
+    # An older single ping arriving late must not overwrite the newer one
+    response = client.post('/api/services/mechanics/location', headers=headers, json={
+        'latitude': -1.40, 'longitude': 36.90, 'recorded_at': '2026-01-01T09:59:00Z'
+    })
+    assert response.status_code == 202
+    assert client.post('/api/services/mechanics/location', headers=headers, json={'latitude': 200}).status_code == 400
+    # 12:59:30 at +03:00 is 09:59:30 UTC: still older than the newest ping
+    response = client.post('/api/services/mechanics/location', headers=headers, json={
+        'latitude': -1.50, 'longitude': 36.95, 'recorded_at': '2026-01-01T12:59:30+03:00'
+    })
+    assert response.status_code == 202
+    # Only mechanics report positions
+    response = client.post('/api/services/mechanics/location', headers=admin_headers(app), json={
+        'latitude': -1.30, 'longitude': 36.80
+    })
+    assert response.status_code == 403
+
+    # Visible to the in-process index before the database flush
+    assert mechanic_index.nearest(-1.30, 36.80, 1)[0][0] == mechanic_id
+    assert len(location_buffer) == 1
+    assert location_buffer.flush() == 1
+
+    with app.app_context():
+        mechanic = db.session.get(User, mechanic_id)
+        assert (mechanic.lat, mechanic.lon) == (-1.30, 36.80)
+        assert mechanic.current_location['speed'] == 12
+        assert mechanic.current_location['recorded_at'] == '2026-01-01T10:00:05'
+
+def test_location_ping_offsets_are_converted_to_utc():
+    from utils.location_updates import parse_ping
+
+    ping = parse_ping(1, {'latitude': -1.3, 'longitude': 36.8, 'recorded_at': '2026-01-01T13:00:00+03:00'})
+    assert ping.recorded_at == datetime(2026, 1, 1, 10, 0, 0)
+    ping = parse_ping(1, {'latitude': -1.3, 'longitude': 36.8, 'recorded_at': '2026-01-01T10:00:00'})
+    assert ping.recorded_at == datetime(2026, 1, 1, 10, 0, 0)
@@ -0,0 +1,215 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from database import db
+from models.support import SupportConversation, SupportConversationTag
+from schema import backfill_support_message_summary, backfill_support_search, backfill_support_tags
+from utils.broker import broker, support_channel
+from utils.stats import stat_counters
+from tests.conftest import admin_headers
+
+def tag_rows(app):
+    with app.app_context():
+        return sorted(db.session.query(SupportConversationTag.conversation_id, SupportConversationTag.tag).all())
+
+def test_tags_are_indexed_and_filtered_in_sql(app, client):
+    created = client.post('/api/support/conversations', json={
+        'customer_name': 'Garage', 'channel': 'partner_application', 'tags': ['Priority', 'Approved', 'approved ']
+    }).get_json()['conversation']
+    other = client.post('/api/support/conversations', json={'customer_name': 'Jane', 'tags': 'priority'})
+    other_id = other.get_json()['conversation']['id']
+
+    # The API shape is unchanged: tags come back as entered
+    assert created['tags'] == ['Priority', 'Approved', 'approved']
+    assert tag_rows(app) == [(created['id'], 'approved'), (created['id'], 'priority'), (other_id, 'priority')]
+
+    listed = client.get('/api/support/conversations?tag=PRIORITY').get_json()['conversations']
+    assert {c['id'] for c in listed} == {created['id'], other_id}
+    listed = client.get('/api/support/conversations?tag=approved').get_json()['conversations']
+    assert [c['id'] for c in listed] == [created['id']]
+
+    client.patch(f"/api/support/conversations/{created['id']}", json={'tags': ['priority']})
+    assert client.get('/api/support/conversations?tag=approved').get_json()['conversations'] == []
+    with app.app_context():
+        assert stat_counters.read().get('partner_applications:approved', 0) == 0
+        assert stat_counters.reconcile() == {}
+
+def test_backfill_indexes_rows_written_before_the_tag_table(app, client):
+    with app.app_context():
+        conversation = SupportConversation(channel='partner_application', customer_name='Garage', tags='Approved')
+        db.session.add(conversation)
+        db.session.commit()
+        db.session.execute(db.text('DELETE FROM support_conversation_tags'))
+        db.session.commit()
+
+        assert backfill_support_tags() == 1
+        assert stat_counters.recount()['partner_applications:approved'] == 1
+    assert tag_rows(app) == [(1, 'approved')]
+    assert len(client.get('/api/support/conversations?tag=approved').get_json()['conversations']) == 1
+
+def test_message_summary_is_kept_on_the_conversation(app, client):
+    created = client.post('/api/support/conversations', json={'customer_name': 'Jane', 'message': 'Car will not start'})
+    conversation = created.get_json()['conversation']
+    assert (conversation['message_count'], conversation['last_message']) == (1, 'Car will not start')
+    client.post('/api/support/conversations', json={'customer_name': 'Otieno'})
+    for body in ['Battery is new', 'Any update?']:
+        assert client.post(f"/api/support/conversations/{conversation['id']}/messages", json={'body': body}).status_code == 201
+
+    listed = client.get('/api/support/conversations?per_page=1&cursor=').get_json()
+    # The conversation with the latest message comes first
+    first = listed['conversations'][0]
+    assert (first['id'], first['message_count'], first['last_message']) == (conversation['id'], 3, 'Any update?')
+    assert listed['pagination']['has_more']
+    # Search covers every message, not only the last one
+    assert [c['customer_name'] for c in client.get('/api/support/conversations?q=battery').get_json()['conversations']] == ['Jane']
+    assert [c['customer_name'] for c in client.get('/api/support/conversations?q=UPDATE').get_json()['conversations']] == ['Jane']
+
+    # Rows written before the summary columns are filled in by the backfill
+    with app.app_context():
+        db.session.execute(db.text('UPDATE support_conversations SET message_count = 0, last_message = NULL, last_message_at = NULL'))
+        db.session.commit()
+        assert backfill_support_message_summary(batch_size=1) == 2
+        summary = db.session.get(SupportConversation, conversation['id']).to_dict()
+    assert (summary['message_count'], summary['last_message']) == (3, 'Any update?')
+    assert summary['last_message_at'] is not None
+
+def search(client, q, **params):
+    response = client.get('/api/support/conversations', query_string={'q': q, **params})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def test_search_is_ranked_and_indexed_as_messages_arrive(app, client):
+    conversations = {}
+    for name, phone, message in [
+        ('Jane Wanjiru', '0712 345 678', 'Flat tyre on Mombasa Road'),
+        ('Brian Otieno', '0722 000 111', 'Jane told me to ask about towing'),
+        ('Mary Akinyi', None, 'Engine overheating'),
+    ]:
+        created = client.post('/api/support/conversations', json={
+            'customer_name': name, 'customer_phone': phone, 'message': message
+        })
+        conversations[name.split()[0]] = created.get_json()['conversation']['id']
+
+    # A header match (the customer's name) outranks a mention in a message body
+    found = search(client, 'jane')
+    assert [c['id'] for c in found['conversations']] == [conversations['Jane'], conversations['Brian']]
+    assert found['pagination']['total'] == 2
+    # Every word must match, as a prefix
+    assert [c['id'] for c in search(client, 'jane tow')['conversations']] == [conversations['Brian']]
+    assert [c['id'] for c in search(client, 'mombasa')['conversations']] == [conversations['Jane']]
+    # Phone numbers match in any local format
+    assert [c['id'] for c in search(client, '+254 712 345678')['conversations']] == [conversations['Jane']]
+
+    # A new message is searchable at once, older messages stay searchable
+    client.post(f"/api/support/conversations/{conversations['Mary']}/messages", json={'body': 'Radiator leaking'})
+    assert [c['id'] for c in search(client, 'radiator')['conversations']] == [conversations['Mary']]
+    assert [c['id'] for c in search(client, 'overheating')['conversations']] == [conversations['Mary']]
+    # So is a changed header
+    with app.app_context():
+        db.session.get(SupportConversation, conversations['Mary']).customer_name = 'Mary Njeri'
+        db.session.commit()
+    assert [c['id'] for c in search(client, 'njeri')['conversations']] == [conversations['Mary']]
+
+    page = search(client, 'jane', per_page=1, page=2)
+    assert [c['id'] for c in page['conversations']] == [conversations['Brian']]
+    assert not page['pagination']['has_more']
+    assert search(client, 'jane', per_page=1)['pagination']['has_more']
+    assert search(client, 'nothing matches')['conversations'] == []
+
+    # The backfill rebuilds the index from the stored rows
+    with app.app_context():
+        db.session.execute(db.text('DELETE FROM support_search'))
+        db.session.commit()
+        assert backfill_support_search(batch_size=2) == 3
+    assert [c['id'] for c in search(client, 'radiator')['conversations']] == [conversations['Mary']]
+    assert [c['id'] for c in search(client, 'jane')['conversations']] == [conversations['Jane'], conversations['Brian']]
+
+    # Without paging parameters every conversation comes back, as the admin inbox expects
+    for i in range(55):
+        client.post('/api/support/conversations', json={'customer_name': f'Caller {i}'})
+    listed = client.get('/api/support/conversations').get_json()
+    assert len(listed['conversations']) == listed['pagination']['total'] == 58
+    assert not listed['pagination']['has_more']
+    assert len(client.get('/api/support/conversations?page=1').get_json()['conversations']) == 50
+    assert len(search(client, 'caller')['conversations']) == 55
+
+def test_messages_are_fetched_incrementally_and_long_polled(app, client):
+    created = client.post('/api/support/conversations', json={'customer_name': 'Jane', 'message': 'Hello'})
+    conversation_id = created.get_json()['conversation']['id']
+    url = f'/api/support/conversations/{conversation_id}/messages'
+    for i in range(1, 6):
+        client.post(url, json={'body': f'Message {i}'})
+    # Without cursor parameters the whole history is returned as before
+    history = [m['id'] for m in client.get(url).get_json()['messages']]
+    assert len(history) == 6
+
+    latest = client.get(url, query_string={'limit': 2}).get_json()
+    assert [m['id'] for m in latest['messages']] == history[-2:]
+    assert latest['pagination']['has_more']
+    older = client.get(url, query_string={'before_id': latest['pagination']['first_id'], 'limit': 3}).get_json()
+    assert [m['id'] for m in older['messages']] == history[1:4]
+    newer = client.get(url, query_string={'after_id': history[2], 'limit': 2}).get_json()
+    assert [m['id'] for m in newer['messages']] == history[3:5]
+    assert newer['pagination']['has_more']
+    assert client.get(url, query_string={'after_id': history[-1]}).get_json()['messages'] == []
+
+    # A long poll with nothing new times out empty
+    started = time.monotonic()
+    assert client.get(url, query_string={'after_id': history[-1], 'wait': 0.2}).get_json()['messages'] == []
+    assert time.monotonic() - started >= 0.2
+
+    # ... and returns as soon as a message is posted
+    poster = threading.Timer(0.2, lambda: app.test_client().post(url, json={'body': 'Still there?'}))
+    poster.start()
+    started = time.monotonic()
+    polled = client.get(url, query_string={'after_id': history[-1], 'wait': 10}).get_json()
+    poster.join()
+    assert time.monotonic() - started < 5
+    assert [m['body'] for m in polled['messages']] == ['Still there?']
+    assert broker.subscriber_count(support_channel(conversation_id)) == 0
+
+def test_closed_conversations_are_archived_in_resumable_batches(app, client):
+    headers = admin_headers(app)
+    ids = {}
+    for name, status in [('Old One', 'closed'), ('Old Two', 'resolved'), ('Recent', 'closed'), ('Open', 'open')]:
+        created = client.post('/api/support/conversations', json={
+            'customer_name': name, 'channel': 'partner_application', 'message': f'Radiator question from {name}'
+        })
+        ids[name] = created.get_json()['conversation']['id']
+        client.patch(f"/api/support/conversations/{ids[name]}", json={'status': status, 'tags': ['approved']})
+    client.post(f"/api/support/conversations/{ids['Old One']}/messages", json={'body': 'Thanks, sorted'})
+    with app.app_context():
+        assert db.session.get(SupportConversation, ids['Recent']).closed_at is not None
+        assert db.session.get(SupportConversation, ids['Open']).closed_at is None
+        long_ago = datetime.utcnow() - timedelta(days=120)
+        for name in ('Old One', 'Old Two', 'Open'):
+            db.session.get(SupportConversation, ids[name]).closed_at = long_ago if name != 'Open' else None
+        db.session.commit()
+        counters_before = stat_counters.read()
+
+    # One batch per request: the run stops early and the next one resumes
+    first = client.post('/api/admin/support/archive', headers=headers, json={'batch_size': 1, 'max_batches': 1})
+    report = first.get_json()
+    assert (report['conversations'], report['messages'], report['finished']) == (1, 2, False)
+    assert report['sizes']['before']['support_conversations']['rows'] == 4
+    assert report['sizes']['after']['support_conversations']['rows'] == 3
+    report = client.post('/api/admin/support/archive', headers=headers, json={'batch_size': 1}).get_json()
+    assert (report['conversations'], report['messages'], report['finished']) == (1, 1, True)
+    assert report['sizes']['after']['support_conversations_archive']['rows'] == 2
+    assert report['sizes']['after']['support_messages']['rows'] == 2
+
+    # Gone from the inbox and its search index, kept in the archive
+    remaining = client.get('/api/support/conversations').get_json()['conversations']
+    assert {c['customer_name'] for c in remaining} == {'Recent', 'Open'}
+    assert {c['customer_name'] for c in search(client, 'radiator')['conversations']} == {'Recent', 'Open'}
+    archived = client.get('/api/admin/support/archive', headers=headers, query_string={'q': 'sorted'}).get_json()
+    assert [c['customer_name'] for c in archived['conversations']] == ['Old One']
+    assert archived['conversations'][0]['message_count'] == 2
+    assert len(client.get('/api/admin/support/archive', headers=headers).get_json()['conversations']) == 2
+    detail = client.get(f"/api/admin/support/archive/{ids['Old One']}", headers=headers).get_json()
+    assert [m['body'] for m in detail['messages']] == ['Radiator question from Old One', 'Thanks, sorted']
+
+    # Archiving does not change the dashboard counters, and a recount agrees
+    with app.app_context():
+        assert stat_counters.read() == counters_before
+        assert stat_counters.reconcile() == {}
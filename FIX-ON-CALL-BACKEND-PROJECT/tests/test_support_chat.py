@@ -0,0 +1,209 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+import pytest
+from simple_websocket import Client
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from werkzeug.serving import make_server
+from database import db
+from models.support import SupportConversation, SupportMessage
+from utils.broker import broker, support_channel
+import utils.support_chat
+from utils.support_chat import MESSAGE_FLUSH_RETRIES, MessageRejected, PendingMessage, message_buffer
+from utils.support_socket import chat_presence
+from tests.conftest import TestConfig
+
+class ChatClient(Client):
+    def handshake(self):
+        super().handshake()
+        # The welcome can come in the same read as the handshake response, and
+        # simple-websocket leaves it unparsed until more data arrives
+        self.connected = self._handle_events()
+
+class FileConfig(TestConfig):
+    # The live server's threads each need their own connection, which an in-memory database cannot give
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL') or f'sqlite:///{tempfile.mkdtemp()}/chat.db'
+
+@pytest.fixture
+def config():
+    return FileConfig
+
+@pytest.fixture
+def server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'ws://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    thread.join(5)
+
+def new_conversation(client, name='Jane'):
+    return client.post('/api/support/conversations', json={'customer_name': name}).get_json()['conversation']['id']
+
+def close(ws):
+    if ws is not None and ws.connected:
+        ws.close()
+
+def next_event(ws, kind):
+    """The next event of a kind, skipping others"""
+    while True:
+        frame = ws.receive(timeout=5)
+        assert frame is not None, f'no {kind} event'
+        message = json.loads(frame)
+        if message['event'] == kind:
+            return message['data']
+
+def next_presence(ws, name, statuses):
+    """The next presence event of a participant with one of statuses, skipping others"""
+    while True:
+        presence = next_event(ws, 'presence')
+        if presence['name'] == name and presence['status'] in statuses:
+            return presence
+
+def test_messages_are_written_in_micro_batches(app, client):
+    first, second = new_conversation(client), new_conversation(client, 'Brian')
+    commits = []
+
+    def record(session):
+        commits.append(session)
+
+    with app.app_context():
+        event.listen(db.session, 'after_commit', record)
+    try:
+        with broker.subscribe(support_channel(first), support_channel(second)) as inbox:
+            pending = [
+                PendingMessage(conversation_id, 'user', body, datetime.utcnow(), client_id, Future())
+                for conversation_id, body, client_id in [
+                    (first, 'Car will not start', 'a'), (second, 'Flat tyre', None),
+                    (first, 'Battery is new', 'b'), (999999, 'Lost', None),
+                ]
+            ]
+            for item in pending:
+                message_buffer.add(item)
+            assert message_buffer.flush() == 4
+            broadcast = [inbox.get(timeout=1)[1]['data'] for _ in range(3)]
+    finally:
+        with app.app_context():
+            event.remove(db.session, 'after_commit', record)
+
+    # One transaction for the whole batch
+    assert len(commits) == 1
+    stored = [item.future.result(timeout=1) for item in pending[:3]]
+    assert [m['client_id'] for m in stored if 'client_id' in m] == ['a', 'b']
+    assert stored[0]['id'] < stored[1]['id'] < stored[2]['id']
+    assert [m['body'] for m in broadcast] == ['Car will not start', 'Flat tyre', 'Battery is new']
+    assert isinstance(pending[3].future.exception(timeout=1), LookupError)
+    with app.app_context():
+        conversation = db.session.get(SupportConversation, first)
+        assert (conversation.message_count, conversation.last_message) == (2, 'Battery is new')
+
+def test_a_message_that_cannot_be_stored_does_not_hold_up_the_rest(app, client, monkeypatch):
+    conversation_id = new_conversation(client)
+    url = f'/api/support/conversations/{conversation_id}/messages'
+    for bad in [{'body': 'Hi', 'sender': {'x': 1}}, {'body': 'Hi', 'sender': 'x' * 21}, {'body': 5}]:
+        assert client.post(url, json=bad).status_code == 400
+
+    # One that got past the checks fails on its own; the rest of its batch commits
+    pending = [
+        PendingMessage(conversation_id, sender, body, datetime.utcnow(), None, Future())
+        for sender, body in [('user', 'First'), ({'x': 1}, 'Poison'), ('agent', 'Third')]
+    ]
+    for item in pending:
+        message_buffer.add(item)
+    message_buffer.flush()
+    assert [item.future.result(timeout=1)['body'] for item in (pending[0], pending[2])] == ['First', 'Third']
+    assert isinstance(pending[1].future.exception(timeout=1), MessageRejected)
+    assert len(message_buffer) == 0
+
+    # A batch the database keeps refusing is retried, then failed instead of re-queued for ever
+    def unavailable(batch, conversations):
+        raise OperationalError('INSERT', {}, Exception('server closed the connection'))
+
+    monkeypatch.setattr(utils.support_chat, '_write_messages', unavailable)
+    item = PendingMessage(conversation_id, 'user', 'Lost', datetime.utcnow(), None, Future())
+    message_buffer.add(item)
+    for _ in range(MESSAGE_FLUSH_RETRIES):
+        message_buffer.flush()
+        assert not item.future.done() and len(message_buffer) == 1
+    message_buffer.flush()
+    assert isinstance(item.future.exception(timeout=1), OperationalError)
+    assert len(message_buffer) == 0
+    monkeypatch.undo()
+
+    assert client.post(url, json={'body': 'Still here', 'sender': 'agent'}).status_code == 201
+    with app.app_context():
+        conversation = db.session.get(SupportConversation, conversation_id)
+        assert (conversation.message_count, conversation.last_message) == (3, 'Still here')
+
+def test_a_failed_broadcast_does_not_rewrite_the_batch(app, client, monkeypatch):
+    conversation_id = new_conversation(client)
+
+    def unreachable(messages):
+        raise ConnectionError('broker unreachable')
+
+    monkeypatch.setattr(broker.backend, 'publish_many', unreachable)
+    failures = broker.publish_failures
+    item = PendingMessage(conversation_id, 'user', 'Hello', datetime.utcnow(), None, Future())
+    message_buffer.add(item)
+    assert message_buffer.flush() == 1
+    assert item.future.result(timeout=1)['body'] == 'Hello'
+    # Logged and counted, not handed back to the buffer as a failed write
+    assert broker.publish_failures == failures + 1
+    assert len(message_buffer) == 0
+    with app.app_context():
+        assert db.session.get(SupportConversation, conversation_id).message_count == 1
+
+def test_chat_socket_broadcasts_messages_typing_and_presence(app, client, server):
+    conversation_id = new_conversation(client)
+    url = f'{server}/api/support/conversations/{conversation_id}/ws'
+    agent = ChatClient.connect(f'{url}?name=Amina&sender=agent')
+    customer = None
+    try:
+        assert next_event(agent, 'welcome')['participants'] == []
+        customer = ChatClient.connect(f'{url}?name=Jane')
+        welcome = next_event(customer, 'welcome')
+        # Each side learns about the other; the customer may hear the agent's own
+        # joined (and answer it with a here) before its joined goes out
+        joined = next_presence(agent, 'Jane', {'joined'})
+        assert (joined['connection_id'], joined['sender']) == (welcome['connection_id'], 'user')
+        assert next_presence(customer, 'Amina', {'here', 'joined'})['sender'] == 'agent'
+        assert {p['name'] for p in chat_presence.participants(conversation_id)} == {'Amina', 'Jane'}
+
+        customer.send(json.dumps({'type': 'typing'}))
+        assert next_event(agent, 'typing')['name'] == 'Jane'
+
+        customer.send(json.dumps({'type': 'message', 'body': 'Is anyone there?', 'client_id': 'c1'}))
+        for ws in (agent, customer):
+            message = next_event(ws, 'message')
+            assert (message['body'], message['sender'], message['client_id']) == ('Is anyone there?', 'user', 'c1')
+        # Messages posted over REST reach the sockets too
+        client.post(f'/api/support/conversations/{conversation_id}/messages', json={'body': 'Yes', 'sender': 'agent'})
+        assert next_event(customer, 'message')['body'] == 'Yes'
+
+        customer.send(json.dumps({'type': 'message', 'body': ' ', 'client_id': 'c2'}))
+        assert next_event(customer, 'error') == {'error': 'body is required', 'client_id': 'c2'}
+        customer.send('not json')
+        assert next_event(customer, 'error')['error'] == 'Frames must be JSON objects'
+
+        close(customer)
+        assert next_presence(agent, 'Jane', {'left'})['connection_id'] == welcome['connection_id']
+    finally:
+        close(agent)
+        close(customer)
+
+    with app.app_context():
+        stored = db.session.query(SupportMessage.body).filter_by(conversation_id=conversation_id).order_by(SupportMessage.id)
+        assert [body for body, in stored] == ['Is anyone there?', 'Yes']
+        first_id = db.session.query(db.func.min(SupportMessage.id)).scalar()
+
+    # A reconnecting socket replays what it missed
+    again = ChatClient.connect(f'{url}?after_id={first_id}')
+    try:
+        next_event(again, 'welcome')
+        assert next_event(again, 'message')['body'] == 'Yes'
+    finally:
+        close(again)
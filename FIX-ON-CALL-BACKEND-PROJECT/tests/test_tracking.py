@@ -0,0 +1,151 @@
+import json
+import os
+import pytest
+from sqlalchemy.engine import make_url
+from database import db
+from models.booking import Booking
+from models.service import Service
+from models.user import User
+from utils.broker import MAX_NOTIFY_PAYLOAD, Broker, PostgresBackend, broker, service_channel
+from tests.conftest import TestConfig, headers_for, token_for
+
+class StreamConfig(TestConfig):
+    SSE_HEARTBEAT_SECONDS = 0.05
+    SSE_MAX_STREAM_SECONDS = 2
+
+LOCATION = {'latitude': -1.2921, 'longitude': 36.8219}
+
+@pytest.fixture
+def config():
+    return StreamConfig
+
+@pytest.fixture
+def ids(app):
+    with app.app_context():
+        users = {}
+        for email, user_type in [('driver@example.com', 'driver'), ('other@example.com', 'driver')]:
+            user = User(email=email, name=email.split('@')[0], phone='+254712345678', user_type=user_type)
+            user.set_password('1234')
+            db.session.add(user)
+            users[email] = user
+        db.session.flush()
+        service = Service(user_id=users['driver@example.com'].id, service_type='towing', location=LOCATION)
+        db.session.add(service)
+        db.session.flush()
+        booking = Booking(user_id=users['driver@example.com'].id, service_id=service.id, location=LOCATION)
+        db.session.add(booking)
+        db.session.commit()
+        return {
+            'driver': users['driver@example.com'].id,
+            'other': users['other@example.com'].id,
+            'service': service.id,
+            'booking': booking.id,
+        }
+
+def read_events(response):
+    body = b''.join(response.response).decode()
+    response.close()
+    return [
+        (block.split('\n')[0][len('event: '):], json.loads(block.split('\n')[1][len('data: '):]))
+        for block in body.split('\n\n') if block.startswith('event: ')
+    ]
+
+def test_service_stream_pushes_status_changes_until_finished(app, client, ids):
+    headers = headers_for(app, ids['driver'])
+    # EventSource cannot send headers: a stream ticket travels in the query string
+    ticket = client.post('/api/auth/stream-ticket', headers=headers).get_json()['ticket']
+    response = client.get(f"/api/services/{ids['service']}/stream?ticket={ticket}", buffered=False)
+    assert response.status_code == 200
+
+    for status in ['dispatched', 'arrived', 'completed']:
+        assert client.put(f"/api/services/{ids['service']}/status", headers=headers,
+                          json={'status': status}).status_code == 200
+
+    events = read_events(response)
+    assert [data['status'] for _, data in events] == ['pending', 'dispatched', 'arrived', 'completed']
+    assert {event for event, _ in events} == {'status'}
+    assert broker.subscriber_count(service_channel(ids['service'])) == 0
+
+    # A finished service sends its final state and closes straight away
+    response = client.get(f"/api/services/{ids['service']}/stream?ticket={ticket}", buffered=False)
+    assert [data['status'] for _, data in read_events(response)] == ['completed']
+
+def test_access_tokens_stay_out_of_urls_and_tickets_only_open_streams(app, client, ids):
+    token = token_for(app, ids['driver'])
+    url = f"/api/services/{ids['service']}/stream"
+    assert client.get(f'{url}?ticket={token}').status_code == 401
+    assert client.get(f'{url}?jwt={token}').status_code == 401
+
+    ticket = client.post('/api/auth/stream-ticket', headers={'Authorization': f'Bearer {token}'}).get_json()['ticket']
+    assert client.get('/api/auth/profile', headers={'Authorization': f'Bearer {ticket}'}).status_code == 400
+    assert client.post('/api/auth/stream-ticket', headers={'Authorization': f'Bearer {ticket}'}).status_code == 400
+    response = client.get(f"/api/bookings/{ids['booking']}/stream", headers={'Authorization': f'Bearer {ticket}'},
+                          buffered=False)
+    assert response.status_code == 200
+    response.close()
+
+def test_booking_stream_ends_on_cancel(app, client, ids):
+    headers = headers_for(app, ids['driver'])
+    response = client.get(f"/api/bookings/{ids['booking']}/stream", headers=headers, buffered=False)
+    assert client.post(f"/api/bookings/{ids['booking']}/cancel", headers=headers,
+                       json={'reason': 'fixed it'}).status_code == 200
+
+    events = read_events(response)
+    assert [data['status'] for _, data in events] == ['pending', 'cancelled']
+    assert events[-1][1]['cancellation_reason'] == 'fixed it'
+
+def test_a_failed_publish_does_not_fail_a_committed_write(app, client, ids, monkeypatch):
+    def unreachable(messages):
+        raise ConnectionError('broker unreachable')
+
+    monkeypatch.setattr(broker.backend, 'publish_many', unreachable)
+    failures = broker.publish_failures
+    headers = headers_for(app, ids['driver'])
+    assert client.put(f"/api/services/{ids['service']}/status", headers=headers,
+                      json={'status': 'dispatched'}).status_code == 200
+    assert client.post(f"/api/bookings/{ids['booking']}/cancel", headers=headers, json={}).status_code == 200
+    assert broker.publish_failures == failures + 2
+    with app.app_context():
+        assert db.session.get(Service, ids['service']).status == 'dispatched'
+        assert db.session.get(Booking, ids['booking']).status == 'cancelled'
+
+def test_streams_reject_other_users(app, client, ids):
+    headers = headers_for(app, ids['other'])
+    assert client.get(f"/api/services/{ids['service']}/stream", headers=headers).status_code == 403
+    assert client.get(f"/api/bookings/{ids['booking']}/stream", headers=headers).status_code == 403
+    assert client.get('/api/services/999999/stream', headers=headers).status_code == 404
+    assert broker.subscriber_count(service_channel(ids['service'])) == 0
+
+def test_notify_payloads_are_packed_under_the_limit():
+    backend = PostgresBackend('postgresql://unused')
+    messages = [(f'user:{i}', {'event': 'notification', 'data': {'message': 'x' * 200}}) for i in range(100)]
+    messages.append(('user:0', {'event': 'notification', 'data': {'message': 'x' * MAX_NOTIFY_PAYLOAD}}))
+
+    payloads = list(backend._payloads(messages))
+    assert len(payloads) > 1
+    assert all(len(p) <= MAX_NOTIFY_PAYLOAD for p in payloads)
+    unpacked = [tuple(item) for p in payloads for item in json.loads(p)]
+    assert unpacked == messages[:100]
+
+@pytest.mark.skipif(
+    not os.getenv('TEST_DATABASE_URL', '').startswith('postgresql'), reason='needs TEST_DATABASE_URL on Postgres'
+)
+def test_postgres_backend_relays_between_processes():
+    dsn = make_url(os.environ['TEST_DATABASE_URL']).set(drivername='postgresql').render_as_string(
+        hide_password=False
+    )
+    # Two brokers stand in for two gunicorn workers
+    worker_a = Broker(backend=PostgresBackend(dsn, pg_channel='test_events'))
+    worker_b = Broker(backend=PostgresBackend(dsn, pg_channel='test_events'))
+    try:
+        assert worker_a.backend.wait_until_listening(5) and worker_b.backend.wait_until_listening(5)
+        with worker_b.subscribe('service:1') as subscription:
+            worker_a.publish_many(
+                ('service:1', {'event': 'status', 'data': {'id': 1, 'n': i}}) for i in range(200)
+            )
+            received = [subscription.get(timeout=5) for _ in range(100)]
+        assert [message['data']['n'] for _, message in received] == list(range(100, 200))
+        assert subscription.dropped == 100
+    finally:
+        worker_a.stop()
+        worker_b.stop()
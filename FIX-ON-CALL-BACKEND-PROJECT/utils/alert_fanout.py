@@ -0,0 +1,173 @@
+"""
+Emergency alert fan-out.
+
+New EmergencyAlerts are buffered and handled in batches: one bounding-box
+query loads every available mechanic that could be in range of any alert in
+the batch, a vectorised distance matrix keeps the pairs inside each
+mechanic's own service_radius_km, and all Notification rows for the batch
+are written with a single bulk INSERT and one commit. The new notifications
+are then pushed to connected clients through the broker.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, insert
+
+from database import db
+from models.payment import Notification
+from models.user import User
+from utils.batching import WriteBehindBuffer
+from utils.broker import broker, user_channel
+from utils.geolocation import bounding_box, distance_matrix, extract_coordinates
+
+AlertEvent = namedtuple('AlertEvent', ['alert_id', 'service_id', 'user_id', 'latitude', 'longitude', 'priority'])
+
+DEFAULT_SERVICE_RADIUS_KM = 10
+NOTIFICATION_TYPE = 'emergency_alert'
+NOTIFICATION_TITLE = 'Emergency breakdown nearby'
+
+# Postgres: the whole batch as three array parameters in one statement
+UNNEST_INSERT_SQL = """
+INSERT INTO notifications (sender_id, recipient_id, title, message, type, is_read, created_at)
+SELECT t.sender_id, t.recipient_id, :title, t.message, :type, false, :now
+FROM unnest(CAST(:sender_ids AS INTEGER[]), CAST(:recipient_ids AS INTEGER[]), CAST(:messages AS TEXT[]))
+    AS t(sender_id, recipient_id, message)
+RETURNING id, sender_id, recipient_id, message
+"""
+
+
+def alert_event(alert):
+    """AlertEvent for an EmergencyAlert, or None if its location has no coordinates"""
+    position = extract_coordinates(alert.location)
+    if not position:
+        return None
+    return AlertEvent(alert.id, alert.service_id, alert.user_id, position[0], position[1], alert.priority)
+
+
+def queue_alert(alert):
+    """Schedule fan-out for a committed alert; returns False if it cannot be located"""
+    event = alert_event(alert)
+    if event is None:
+        return False
+    alert_buffer.add(event, key=event.alert_id)
+    return True
+
+
+def load_candidate_mechanics(events):
+    """Available mechanics inside the batch's bounding box, padded by the largest service radius"""
+    mechanic_filter = (
+        User.user_type == 'mechanic',
+        User.is_available.is_(True),
+        User.is_active.is_(True),
+    )
+    max_radius = db.session.query(
+        func.max(func.coalesce(User.service_radius_km, DEFAULT_SERVICE_RADIUS_KM))
+    ).filter(*mechanic_filter).scalar()
+    if not max_radius:
+        return []
+
+    lats = [e.latitude for e in events]
+    lons = [e.longitude for e in events]
+    min_lat, _, min_lon, _ = bounding_box(min(lats), min(lons), max_radius)
+    _, max_lat, _, max_lon = bounding_box(max(lats), max(lons), max_radius)
+    return User.query.with_entities(User.id, User.lat, User.lon, User.service_radius_km).filter(
+        *mechanic_filter,
+        User.lat.between(min_lat, max_lat),
+        User.lon.between(min_lon, max_lon)
+    ).all()
+
+
+def match_alerts(events, mechanics):
+    """(event index, mechanic index, distance_km) for every mechanic whose radius covers an alert"""
+    if not events or not mechanics:
+        return []
+    distances = distance_matrix(
+        [e.latitude for e in events], [e.longitude for e in events],
+        [m.lat for m in mechanics], [m.lon for m in mechanics]
+    )
+    radius = np.array(
+        [m.service_radius_km or DEFAULT_SERVICE_RADIUS_KM for m in mechanics], dtype=np.float64
+    )
+    rows, cols = np.nonzero(distances <= radius[None, :])
+    return [(int(r), int(c), float(distances[r, c])) for r, c in zip(rows, cols)]
+
+
+def alert_message(event, distance_km):
+    return (f'Service #{event.service_id}: breakdown reported {distance_km:.1f} km from you '
+            f'({event.priority} priority).')
+
+
+def insert_notifications(rows, now):
+    """
+    Bulk insert (sender_id, recipient_id, message) rows in one statement
+    Returns (id, sender_id, recipient_id, message) for each inserted row
+    """
+    if db.engine.dialect.name == 'postgresql':
+        sender_ids, recipient_ids, messages = (list(column) for column in zip(*rows))
+        return db.session.execute(db.text(UNNEST_INSERT_SQL), {
+            'sender_ids': sender_ids,
+            'recipient_ids': recipient_ids,
+            'messages': messages,
+            'title': NOTIFICATION_TITLE,
+            'type': NOTIFICATION_TYPE,
+            'now': now,
+        }).all()
+
+    ids = db.session.scalars(
+        insert(Notification).returning(Notification.id, sort_by_parameter_order=True),
+        [
+            {
+                'sender_id': sender_id,
+                'recipient_id': recipient_id,
+                'title': NOTIFICATION_TITLE,
+                'message': message,
+                'type': NOTIFICATION_TYPE,
+                'is_read': False,
+                'created_at': now,
+            }
+            for sender_id, recipient_id, message in rows
+        ]
+    ).all()
+    return [(notification_id,) + tuple(row) for notification_id, row in zip(ids, rows)]
+
+
+def notification_payload(inserted, now):
+    """Same shape as Notification.to_dict()"""
+    notification_id, sender_id, recipient_id, message = inserted
+    return {
+        'id': notification_id,
+        'sender_id': sender_id,
+        'recipient_id': recipient_id,
+        'title': NOTIFICATION_TITLE,
+        'message': message,
+        'type': NOTIFICATION_TYPE,
+        'is_read': False,
+        'created_at': now.isoformat(),
+        'read_at': None,
+    }
+
+
+def fan_out_alerts(events):
+    """Flush callback: notify every mechanic in range of any alert in the batch"""
+    mechanics = load_candidate_mechanics(events)
+    matches = match_alerts(events, mechanics)
+    if not matches:
+        db.session.rollback()
+        return []
+
+    now = datetime.utcnow()
+    rows = [(events[e].user_id, mechanics[m].id, alert_message(events[e], distance)) for e, m, distance in matches]
+    inserted = insert_notifications(rows, now)
+    db.session.commit()
+
+    payloads = [notification_payload(row, now) for row in inserted]
+    broker.publish_committed(
+        (user_channel(payload['recipient_id']), {'event': 'notification', 'data': payload})
+        for payload in payloads
+    )
+    return payloads
+
+
+alert_buffer = WriteBehindBuffer(fan_out_alerts, name='alert-fanout', interval=0.5, max_items=200)
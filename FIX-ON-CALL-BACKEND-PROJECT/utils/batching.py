@@ -0,0 +1,165 @@
+"""
+Write-behind buffering for high-frequency writes.
+
+Items are accumulated in memory and handed to a flush callback in batches,
+either when the flush interval elapses or when the buffer fills up. Keyed
+items coalesce, so only the winning value per key reaches the database.
+
+A failed flush puts its batch back for the next one. With max_retries set,
+a batch that keeps failing is dropped after that many retries and handed
+to on_drop, so one item the flush can never write does not hold up
+everything queued behind it.
+"""
+
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def keep_latest(old, new):
+    """Default merge rule for keyed items: last write wins"""
+    return new
+
+
+class WriteBehindBuffer:
+    """Thread-safe buffer flushed in batches from a background timer thread"""
+
+    def __init__(self, flush, name='write-behind', interval=1.0, max_items=500, merge=keep_latest,
+                 max_retries=None, on_drop=None):
+        self._flush_callback = flush
+        self.name = name
+        self.interval = interval
+        self.max_items = max_items
+        self._merge = merge
+        self.max_retries = max_retries
+        self._on_drop = on_drop
+        self._failures = 0
+        self._keyed = {}
+        self._items = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._app = None
+        self._atexit_registered = False
+        self.flushed_batches = 0
+        self.flushed_items = 0
+        self.failed_batches = 0
+        self.dropped_batches = 0
+
+    def init_app(self, app, interval=None, max_items=None, start=None):
+        """Bind to an app; the timer thread starts unless testing or start=False"""
+        if self._thread is not None:
+            # Re-binding (e.g. another create_app call): drain into the previous app first
+            self.stop()
+        self._app = app
+        if interval is not None:
+            self.interval = interval
+        if max_items is not None:
+            self.max_items = max_items
+        with self._lock:
+            self._keyed = {}
+            self._items = []
+        if start is None:
+            start = not app.testing
+        if start:
+            self.start()
+
+    @property
+    def running(self):
+        """Whether the timer thread is flushing in the background"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keyed) + len(self._items)
+
+    def add(self, item, key=None):
+        """
+        Buffer an item; items with the same key are merged before flushing
+        Returns the item that is now buffered (for keyed items, the merge winner)
+        """
+        with self._lock:
+            if key is None:
+                self._items.append(item)
+                stored = item
+            else:
+                stored = self._merge(self._keyed[key], item) if key in self._keyed else item
+                self._keyed[key] = stored
+            pending = len(self._keyed) + len(self._items)
+        if pending >= self.max_items:
+            self._wake.set()
+        return stored
+
+    def _drain(self):
+        with self._lock:
+            keyed, items = self._keyed, self._items
+            self._keyed, self._items = {}, []
+        return keyed, items
+
+    def flush(self):
+        """Flush everything buffered so far; returns the number of items written"""
+        with self._flush_lock:
+            keyed, items = self._drain()
+            batch = list(keyed.values()) + items
+            if not batch:
+                return 0
+            try:
+                if self._app is not None:
+                    with self._app.app_context():
+                        self._flush_callback(batch)
+                else:
+                    self._flush_callback(batch)
+            except Exception as error:
+                self.failed_batches += 1
+                self._failures += 1
+                if self.max_retries is not None and self._failures > self.max_retries:
+                    self._failures = 0
+                    self.dropped_batches += 1
+                    logger.exception('%s flush of %d items failed; dropped after %d retries',
+                                     self.name, len(batch), self.max_retries)
+                    if self._on_drop is not None:
+                        self._on_drop(batch, error)
+                    return 0
+                logger.exception('%s flush of %d items failed; re-queued', self.name, len(batch))
+                self._requeue(keyed, items)
+                return 0
+            self._failures = 0
+            self.flushed_batches += 1
+            self.flushed_items += len(batch)
+            return len(batch)
+
+    def _requeue(self, keyed, items):
+        # Newer writes that arrived during the failed flush take precedence
+        with self._lock:
+            for key, item in keyed.items():
+                self._keyed[key] = self._merge(item, self._keyed[key]) if key in self._keyed else item
+            self._items[:0] = items
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self, timeout=5.0):
+        """Stop the timer thread and flush whatever is still buffered"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
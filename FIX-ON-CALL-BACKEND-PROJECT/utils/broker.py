@@ -0,0 +1,295 @@
+"""
+Publish/subscribe for pushing events to connected clients.
+
+Streaming endpoints subscribe to one or more channels (e.g. 'user:42') and
+block on their subscription; writers publish after their transaction
+commits. Each subscriber has a bounded queue: a client that stops reading
+loses its oldest events rather than holding memory, and can catch up
+through the regular REST endpoints.
+
+Subscriptions live in the process that accepted the connection. Published
+messages travel through a backend so that every process sees them: the
+local backend delivers in-process only (single worker, tests), the
+Postgres backend relays through LISTEN/NOTIFY to every gunicorn worker.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+import psycopg
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY payloads are limited to 8000 bytes; leave room for the envelope
+MAX_NOTIFY_PAYLOAD = 7900
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def service_channel(service_id):
+    return f'service:{service_id}'
+
+
+def booking_channel(booking_id):
+    return f'booking:{booking_id}'
+
+
+def support_channel(conversation_id):
+    return f'support:{conversation_id}'
+
+
+class Subscription:
+    """A subscriber's queue of (channel, message) pairs"""
+
+    def __init__(self, broker, channels, max_pending):
+        self._broker = broker
+        self.channels = tuple(channels)
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.closed = False
+
+    def _deliver(self, channel, message):
+        while True:
+            try:
+                self._queue.put_nowait((channel, message))
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next (channel, message), or None if nothing arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalBackend:
+    """Delivers published messages straight to this process's subscribers"""
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def stop(self):
+        pass
+
+    def publish_many(self, messages):
+        self._deliver(messages)
+
+
+class PostgresBackend:
+    """
+    Relays messages through NOTIFY on one Postgres channel; a listener thread
+    in every process receives them (its own included) and delivers locally
+    """
+
+    def __init__(self, dsn, pg_channel='fix_on_call_events', reconnect_delay=1.0):
+        self.dsn = dsn
+        self.pg_channel = pg_channel
+        self.reconnect_delay = reconnect_delay
+        self._deliver = None
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._listening = threading.Event()
+        self._thread = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen, name='broker-listen', daemon=True)
+        self._thread.start()
+
+    def wait_until_listening(self, timeout=None):
+        return self._listening.wait(timeout)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        with self._publish_lock:
+            if self._publisher is not None:
+                self._publisher.close()
+                self._publisher = None
+
+    def _connect(self):
+        return psycopg.connect(self.dsn, autocommit=True)
+
+    def _payloads(self, messages):
+        """Pack messages into as few NOTIFY payloads as fit"""
+        batch, size = [], 2
+        for channel, message in messages:
+            encoded = json.dumps([channel, message], separators=(',', ':'), default=str)
+            if len(encoded) > MAX_NOTIFY_PAYLOAD:
+                logger.warning('Dropping %d-byte message for %s: too large for NOTIFY', len(encoded), channel)
+                continue
+            if batch and size + len(encoded) + 1 > MAX_NOTIFY_PAYLOAD:
+                yield '[' + ','.join(batch) + ']'
+                batch, size = [], 2
+            batch.append(encoded)
+            size += len(encoded) + 1
+        if batch:
+            yield '[' + ','.join(batch) + ']'
+
+    def publish_many(self, messages):
+        payloads = list(self._payloads(messages))
+        if not payloads:
+            return
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None or self._publisher.closed:
+                        self._publisher = self._connect()
+                    with self._publisher.cursor() as cursor:
+                        cursor.executemany(
+                            'SELECT pg_notify(%s, %s)', [(self.pg_channel, payload) for payload in payloads]
+                        )
+                    return
+                except Exception:
+                    # A stale connection gets one retry on a fresh one
+                    self._publisher = None
+                    if attempt:
+                        raise
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            try:
+                with self._connect() as conn:
+                    conn.execute(f'LISTEN "{self.pg_channel}"')
+                    self._listening.set()
+                    while not self._stopping.is_set():
+                        for notify in conn.notifies(timeout=1.0):
+                            self._deliver([tuple(item) for item in json.loads(notify.payload)])
+            except Exception:
+                self._listening.clear()
+                if self._stopping.is_set():
+                    return
+                logger.exception('Broker listener lost its connection; reconnecting')
+                time.sleep(self.reconnect_delay)
+        self._listening.clear()
+
+
+def backend_from_config(app):
+    """BROKER_BACKEND: 'local', 'postgres', or 'auto' (Postgres unless testing or not on Postgres)"""
+    name = app.config.get('BROKER_BACKEND', 'auto')
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if name == 'auto':
+        name = 'postgres' if url.get_backend_name() == 'postgresql' and not app.testing else 'local'
+    if name == 'postgres':
+        return PostgresBackend(url.set(drivername='postgresql').render_as_string(hide_password=False))
+    if name == 'local':
+        return LocalBackend()
+    raise ValueError(f'Unknown BROKER_BACKEND: {name}')
+
+
+class Broker:
+    """Fan messages out to every subscription on a channel"""
+
+    def __init__(self, max_pending=100, backend=None):
+        self.max_pending = max_pending
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+        self.published = 0
+        self.delivered = 0
+        self.publish_failures = 0
+        self.backend = None
+        self.set_backend(backend or LocalBackend())
+
+    def init_app(self, app, backend=None):
+        self.set_backend(backend or backend_from_config(app))
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def set_backend(self, backend):
+        if self.backend is not None:
+            self.backend.stop()
+        self.backend = backend
+        backend.start(self._dispatch)
+
+    def stop(self):
+        self.backend.stop()
+
+    def subscribe(self, *channels, max_pending=None):
+        subscription = Subscription(self, channels, max_pending or self.max_pending)
+        with self._lock:
+            for channel in channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._channels.get(channel, ()))
+
+    def publish(self, channel, message):
+        """Send a message to the channel's subscribers in every process"""
+        self.publish_many([(channel, message)])
+
+    def publish_many(self, messages):
+        """Send a batch of (channel, message) pairs through the backend in one go"""
+        messages = list(messages)
+        if messages:
+            self.backend.publish_many(messages)
+            self.published += len(messages)
+
+    def publish_committed(self, messages):
+        """
+        publish_many for a write that has already committed: a failure is
+        logged and counted instead of raised, so the caller still reports the
+        write it made. Returns whether the messages went out.
+        """
+        messages = list(messages)
+        try:
+            self.publish_many(messages)
+            return True
+        except Exception:
+            self.publish_failures += len(messages)
+            logger.exception('Could not publish %d message(s) after commit', len(messages))
+            return False
+
+    def _dispatch(self, messages):
+        """Deliver messages to this process's subscribers, taking the lock once"""
+        deliveries = []
+        with self._lock:
+            for channel, message in messages:
+                for subscription in self._channels.get(channel, ()):
+                    deliveries.append((subscription, channel, message))
+        for subscription, channel, message in deliveries:
+            subscription._deliver(channel, message)
+        self.delivered += len(deliveries)
+
+
+broker = Broker()
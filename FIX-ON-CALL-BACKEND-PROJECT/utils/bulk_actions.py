@@ -0,0 +1,198 @@
+"""
+Set-based admin actions on many users at once.
+
+A selection (a list of ids, or a filter on user_type / created_at /
+is_active) is changed by one conditional UPDATE ... RETURNING instead of
+loading and committing every user. Rows already in the target state are not
+touched, so the returned rows are exactly the users that changed. Large
+selections can be run in id-ordered batches, each committed on its own, with
+a progress report after every batch; a failed run resumes from the last
+reported id.
+"""
+
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import false, func, not_, select, update
+
+from database import db
+from models.user import User
+from utils.cache import response_cache
+from utils.principals import principal_cache
+from utils.spatial_index import mechanic_index
+
+# Action -> target is_active (None flips each user)
+BULK_ACTIONS = {'suspend': False, 'ban': False, 'activate': True, 'toggle-active': None}
+BULK_FILTERS = ('user_type', 'created_from', 'created_to', 'is_active')
+MAX_BULK_IDS = 10000
+BULK_BATCH_SIZE = 1000
+
+OUTCOME_UPDATED = 'updated'
+OUTCOME_UNCHANGED = 'unchanged'
+OUTCOME_NOT_FOUND = 'not_found'
+OUTCOME_SKIPPED = 'skipped'  # the acting admin's own account
+
+
+class InvalidSelection(ValueError):
+    pass
+
+
+def _parse_bound(value, name, end=False):
+    """created_from / created_to as a datetime; a bare end date covers that whole day"""
+    try:
+        if isinstance(value, str) and len(value) == 10:
+            day = date.fromisoformat(value)
+            return datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidSelection(f'{name} must be an ISO date or datetime')
+
+
+def selection_criteria(user_ids=None, filters=None):
+    """WHERE criteria for a bulk selection; raises InvalidSelection"""
+    if (user_ids is None) == (filters is None):
+        raise InvalidSelection('Provide either user_ids or filter')
+    if user_ids is not None:
+        if not isinstance(user_ids, list) or not user_ids:
+            raise InvalidSelection('user_ids must be a non-empty list')
+        if len(user_ids) > MAX_BULK_IDS:
+            raise InvalidSelection(f'At most {MAX_BULK_IDS} user_ids per request; use a filter instead')
+        if not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in user_ids):
+            raise InvalidSelection('user_ids must be integers')
+        return [User.id.in_(user_ids)]
+
+    if not isinstance(filters, dict) or not filters:
+        # An empty filter would select every user
+        raise InvalidSelection('filter must name at least one of: ' + ', '.join(BULK_FILTERS))
+    unknown = set(filters) - set(BULK_FILTERS)
+    if unknown:
+        raise InvalidSelection('Unknown filter fields: ' + ', '.join(sorted(unknown)))
+    criteria = []
+    if 'user_type' in filters:
+        criteria.append(User.user_type == filters['user_type'])
+    if 'created_from' in filters:
+        criteria.append(User.created_at >= _parse_bound(filters['created_from'], 'created_from'))
+    if 'created_to' in filters:
+        criteria.append(User.created_at < _parse_bound(filters['created_to'], 'created_to', end=True))
+    if 'is_active' in filters:
+        if not isinstance(filters['is_active'], bool):
+            raise InvalidSelection('is_active must be true or false')
+        criteria.append(User.is_active.is_(filters['is_active']))
+    return criteria
+
+
+def _apply(action, criteria, now):
+    """Run the action's UPDATE over criteria and commit; returns the changed rows"""
+    target = BULK_ACTIONS[action]
+    statement = update(User.__table__).where(*criteria)
+    if target is None:
+        is_active = not_(func.coalesce(User.is_active, false()))
+    else:
+        # IS NOT also picks up NULLs
+        statement = statement.where(User.is_active.is_not(target))
+        is_active = target
+    rows = db.session.execute(
+        statement.values(is_active=is_active, updated_at=now).returning(
+            User.id, User.is_active, User.user_type, User.is_available, User.lat, User.lon, User.specialization
+        )
+    ).all()
+    if rows:
+        response_cache.invalidate_on_commit('users')
+    db.session.commit()
+
+    # Core updates bypass the ORM change hooks that normally maintain the index and principals
+    principal_cache.invalidate(*(row.id for row in rows))
+    for row in rows:
+        if row.user_type == 'mechanic':
+            indexable = bool(row.is_active) and bool(row.is_available)
+            position = (row.lat, row.lon) if row.lat is not None and row.lon is not None else None
+            mechanic_index.apply(row.id, indexable, position, row.specialization)
+    return rows
+
+
+def _id_results(user_ids, rows, actor_id):
+    """Per-id outcomes for an explicit id list"""
+    changed = {row.id: row.is_active for row in rows}
+    unchanged_ids = [user_id for user_id in user_ids if user_id not in changed and user_id != actor_id]
+    # Only ids the update did not return need telling apart: unchanged or missing
+    existing = set(db.session.scalars(select(User.id).where(User.id.in_(unchanged_ids)))) if unchanged_ids else set()
+    results = []
+    for user_id in dict.fromkeys(user_ids):
+        if user_id in changed:
+            results.append({'id': user_id, 'outcome': OUTCOME_UPDATED, 'is_active': changed[user_id]})
+        elif user_id == actor_id:
+            results.append({'id': user_id, 'outcome': OUTCOME_SKIPPED})
+        elif user_id in existing:
+            results.append({'id': user_id, 'outcome': OUTCOME_UNCHANGED})
+        else:
+            results.append({'id': user_id, 'outcome': OUTCOME_NOT_FOUND})
+    return results
+
+
+def _row_results(rows):
+    return [{'id': row.id, 'outcome': OUTCOME_UPDATED, 'is_active': row.is_active} for row in rows]
+
+
+def run_bulk_action(action, user_ids=None, filters=None, actor_id=None):
+    """
+    Apply action to the whole selection in one statement and commit.
+    Returns {'action', 'updated', 'results'}: outcomes for every listed id,
+    or the changed users for a filter. The acting admin is never changed.
+    """
+    criteria = selection_criteria(user_ids, filters)
+    if actor_id is not None:
+        criteria.append(User.id != actor_id)
+    rows = _apply(action, criteria, datetime.utcnow())
+    results = _id_results(user_ids, rows, actor_id) if user_ids is not None else _row_results(rows)
+    return {'action': action, 'updated': len(rows), 'results': results}
+
+
+def iter_bulk_action(action, user_ids=None, filters=None, actor_id=None, batch_size=BULK_BATCH_SIZE, after_id=0):
+    """
+    Apply action in batches of ids above after_id, committing each batch.
+    Validates the selection up front (InvalidSelection), then returns a
+    generator of one progress dict per batch and a final summary; an
+    interrupted run continues from the last progress 'last_id'.
+    """
+    criteria = selection_criteria(user_ids, filters)
+    if user_ids is not None:
+        # Each batch brings its own slice of the ids
+        criteria = []
+    if actor_id is not None:
+        criteria.append(User.id != actor_id)
+    return _run_batches(action, criteria, user_ids, actor_id, batch_size, after_id)
+
+
+def _run_batches(action, criteria, user_ids, actor_id, batch_size, after_id):
+    now = datetime.utcnow()
+    if user_ids is not None:
+        pending = sorted(user_id for user_id in set(user_ids) if user_id > after_id)
+        total = len(pending)
+    else:
+        total = db.session.scalar(select(func.count()).select_from(User).where(*criteria, User.id > after_id))
+        pending = None
+
+    processed = updated = 0
+    last_id = after_id
+    while True:
+        if pending is not None:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+        else:
+            batch = list(db.session.scalars(
+                select(User.id).where(*criteria, User.id > last_id).order_by(User.id).limit(batch_size)
+            ))
+        if not batch:
+            break
+        rows = _apply(action, criteria + [User.id.in_(batch)], now)
+        processed += len(batch)
+        updated += len(rows)
+        last_id = batch[-1]
+        yield {
+            'event': 'progress',
+            'processed': processed,
+            'total': total,
+            'updated': updated,
+            'last_id': last_id,
+            'results': _id_results(batch, rows, actor_id) if user_ids is not None else _row_results(rows),
+        }
+    yield {'event': 'done', 'action': action, 'processed': processed, 'total': total, 'updated': updated,
+           'last_id': last_id}
@@ -0,0 +1,295 @@
+"""
+TTL response cache for read-heavy admin endpoints.
+
+Cached views are keyed by path and query string and tagged with the data
+they read ('services', 'users', ...). Every tag has a version number; an
+entry remembers the versions it was built from and is ignored once any of
+them moves on. Invalidating a tag is therefore a single increment, and the
+versions are read before the view runs, so a write that commits while a
+response is being built leaves that response already stale.
+
+With read replicas, an entry could otherwise hold a lagging replica's
+snapshot under versions that claim it is current. A miss therefore builds
+its response on the primary, and a client that carries the replica
+sticky header (it has just written) bypasses the cache altogether.
+
+Tags are bumped after commit for every ORM insert, update or delete of a
+tagged model (rolled-back writes invalidate nothing). Core bulk statements
+bypass those hooks and call invalidate_on_commit() themselves.
+
+Backends: the local backend is a bounded in-process LRU (per worker; other
+workers see a write only when their entry expires). The Redis backend is
+shared by every worker; bound it with Redis's own maxmemory and an LRU
+eviction policy. A Redis error is treated as a miss, never as a failure.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from database import db
+from models.booking import Booking
+from models.payment import Payment
+from models.service import EmergencyAlert, Service
+from models.support import SupportConversation, SupportMessage
+from models.user import User
+from utils.replicas import replica_router
+
+logger = logging.getLogger(__name__)
+
+# model -> tag invalidated when one of its rows is written
+MODEL_TAGS = {
+    User: 'users',
+    Service: 'services',
+    EmergencyAlert: 'services',
+    Booking: 'bookings',
+    Payment: 'payments',
+    SupportConversation: 'support',
+    SupportMessage: 'support',
+}
+
+PENDING_TAGS_KEY = 'response_cache_tags'
+
+
+class LocalBackend:
+    """In-process LRU of entries with expiry times, plus tag versions"""
+
+    name = 'local'
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Entries and tag versions in Redis, shared by every worker"""
+
+    name = 'redis'
+
+    def __init__(self, client, prefix='fix-on-call:cache:'):
+        self.client = client
+        self.prefix = prefix
+        self.evictions = None
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+
+    def versions(self, tags):
+        if not tags:
+            return []
+        return [int(v or 0) for v in self.client.mget([f'{self.prefix}tag:{tag}' for tag in tags])]
+
+    def bump(self, tags):
+        pipe = self.client.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(f'{self.prefix}tag:{tag}')
+        pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f'{self.prefix}*'):
+            self.client.delete(key)
+
+
+def backend_from_config(app):
+    """RESPONSE_CACHE_BACKEND: 'local', 'redis', or 'auto' (Redis when RESPONSE_CACHE_REDIS_URL is set)"""
+    name = app.config.get('RESPONSE_CACHE_BACKEND', 'auto')
+    url = app.config.get('RESPONSE_CACHE_REDIS_URL')
+    if name == 'auto':
+        name = 'redis' if url and not app.testing else 'local'
+    if name == 'redis':
+        try:
+            import redis
+        except ImportError:
+            logger.warning('redis is not installed; using the in-process response cache')
+            return LocalBackend(app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+        return RedisBackend(redis.Redis.from_url(url, socket_timeout=0.5))
+    if name == 'local':
+        return LocalBackend(app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+    raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {name}')
+
+
+class ResponseCache:
+    """Caches successful GET responses and invalidates them by tag on commit"""
+
+    def __init__(self, backend=None, ttl=30):
+        self.backend = backend or LocalBackend()
+        self.ttl = ttl
+        self.enabled = True
+        self._listeners_registered = False
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def init_app(self, app, backend=None):
+        self.backend = backend or backend_from_config(app)
+        self.ttl = app.config['RESPONSE_CACHE_TTL_SECONDS']
+        self.enabled = self.ttl > 0
+        self._register_listeners()
+
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+        self._listeners_registered = True
+
+    def _after_flush(self, session, flush_context):
+        tags = {
+            MODEL_TAGS[type(obj)]
+            for obj in (*session.new, *session.dirty, *session.deleted)
+            if type(obj) in MODEL_TAGS
+        }
+        if tags:
+            session.info.setdefault(PENDING_TAGS_KEY, set()).update(tags)
+
+    def _after_commit(self, session):
+        tags = session.info.pop(PENDING_TAGS_KEY, None)
+        if tags:
+            self.invalidate(*tags)
+
+    def _after_rollback(self, session):
+        session.info.pop(PENDING_TAGS_KEY, None)
+
+    def invalidate_on_commit(self, *tags):
+        """Invalidate tags when the current transaction commits (for Core writes the hooks cannot see)"""
+        db.session.info.setdefault(PENDING_TAGS_KEY, set()).update(tags)
+
+    def invalidate(self, *tags):
+        try:
+            self.backend.bump(sorted(tags))
+            self.invalidations += 1
+        except Exception:
+            self.errors += 1
+            logger.exception('response cache invalidation failed for %s', tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.backend.name,
+            'enabled': self.enabled,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'bypasses': self.bypasses,
+            'invalidations': self.invalidations,
+            'evictions': self.backend.evictions,
+            'errors': self.errors,
+            'entries': len(self.backend) if isinstance(self.backend, LocalBackend) else None,
+        }
+
+    def cached(self, *tags, ttl=None):
+        """
+        Cache a GET view's 200 responses for ttl seconds, invalidated by tags
+        Entries are shared by every caller: apply it under the view's authorization decorators.
+        """
+        tags = tuple(sorted(tags))
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+                if replica_router.is_sticky():
+                    # Reading its own writes: another worker's entry (or a lagging one) will not do
+                    self.bypasses += 1
+                    response = current_app.make_response(view(*args, **kwargs))
+                    response.headers['X-Cache'] = 'BYPASS'
+                    return response
+
+                key = request.path
+                if request.args:
+                    key += '?' + urlencode(sorted(request.args.items(multi=True)))
+                try:
+                    versions = self.backend.versions(tags)
+                    entry = self.backend.get(key)
+                except Exception:
+                    self.errors += 1
+                    logger.exception('response cache lookup failed for %s', key)
+                    return view(*args, **kwargs)
+
+                if entry is not None and entry['versions'] == versions:
+                    self.hits += 1
+                    response = current_app.response_class(entry['body'], status=200, mimetype=entry['mimetype'])
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self.misses += 1
+                # Stored under the versions read above, so it must not come from a replica behind them
+                replica_router.read_primary()
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    try:
+                        self.backend.set(key, {
+                            'versions': versions,
+                            'body': response.get_data(as_text=True),
+                            'mimetype': response.mimetype,
+                        }, ttl or self.ttl)
+                    except Exception:
+                        self.errors += 1
+                        logger.exception('response cache store failed for %s', key)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+
+            return wrapper
+
+        return decorator
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,296 @@
+"""
+Global dispatch of pending services to available mechanics.
+
+Every pending service and every available mechanic are matched in one pass
+by solving a min-cost assignment (scipy's linear_sum_assignment, a
+Jonker-Volgenant variant of the Hungarian algorithm) over an ETA-based cost
+matrix, instead of assigning jobs one at a time in arrival order.
+"""
+
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sqlalchemy import update
+
+from database import db
+from models.service import Service
+from models.user import User
+from utils.geolocation import distance_matrix, extract_coordinates, get_estimated_time
+from utils.spatial_index import mechanic_index
+from utils.broker import broker
+from utils.cache import response_cache
+from utils.tracking import service_status_message
+from utils.stats import stat_counters
+
+INFEASIBLE = 1e9
+
+# Minutes of ETA a job's priority is worth when mechanics are scarce
+PRIORITY_REWARD = {'critical': 240, 'high': 120, 'medium': 60, 'low': 0}
+# Older jobs win ties: each minute waited is worth this many minutes of ETA, up to the cap
+WAIT_REWARD_PER_MINUTE = 0.5
+MAX_WAIT_REWARD = 120
+
+# A mechanic specialised in the job is preferred over a slightly closer generalist
+SPECIALIZATION_DISCOUNT = 0.8
+SERVICE_SPECIALIZATIONS = {
+    'breakdown': {'breakdown', 'engine'},
+    'mechanic_dispatch': {'mechanic_dispatch', 'engine'},
+    'battery_jump': {'battery_jump', 'electrical', 'battery'},
+    'tyre_change': {'tyre_change', 'tyres'},
+}
+
+DispatchJob = namedtuple('DispatchJob', ['id', 'latitude', 'longitude', 'service_type', 'priority', 'created_at'])
+DispatchMechanic = namedtuple(
+    'DispatchMechanic', ['id', 'latitude', 'longitude', 'specialization', 'service_radius_km']
+)
+Assignment = namedtuple('Assignment', ['service_id', 'mechanic_id', 'distance_km', 'eta_minutes'])
+DispatchResult = namedtuple('DispatchResult', ['assignments', 'unassigned', 'solve_ms', 'committed'])
+ClaimResult = namedtuple('ClaimResult', ['assigned', 'reason', 'service_status'])
+
+# Outcome reasons for claim_assignment
+CLAIM_ASSIGNED = 'assigned'
+CLAIM_SERVICE_NOT_FOUND = 'service_not_found'
+CLAIM_SERVICE_NOT_PENDING = 'service_not_pending'
+CLAIM_MECHANIC_UNAVAILABLE = 'mechanic_unavailable'
+
+# Postgres: claim the service and the mechanic in one round trip. The mechanic
+# update only runs if the service claim returned a row; if another dispatcher
+# took the mechanic in the meantime it returns nothing and the caller rolls back.
+CLAIM_SQL = """
+WITH claimed_service AS (
+    UPDATE services
+    SET status = 'accepted', assigned_to = :mechanic_id, assigned_at = :now, updated_at = :now
+    WHERE id = :service_id AND status = 'pending'
+      AND EXISTS (
+          SELECT 1 FROM users
+          WHERE id = :mechanic_id AND user_type = 'mechanic' AND is_available AND is_active
+      )
+    RETURNING id
+), claimed_mechanic AS (
+    UPDATE users
+    SET is_available = false
+    WHERE id = :mechanic_id AND user_type = 'mechanic' AND is_available AND is_active
+      AND EXISTS (SELECT 1 FROM claimed_service)
+    RETURNING id
+)
+SELECT (SELECT id FROM claimed_service) AS service_id, (SELECT id FROM claimed_mechanic) AS mechanic_id
+"""
+
+
+def job_reward(job, now):
+    """How much ETA (in minutes) serving this job is worth relative to others"""
+    reward = PRIORITY_REWARD.get(job.priority, PRIORITY_REWARD['medium'])
+    if job.created_at:
+        waited_minutes = max((now - job.created_at).total_seconds(), 0) / 60
+        reward += min(waited_minutes * WAIT_REWARD_PER_MINUTE, MAX_WAIT_REWARD)
+    return reward
+
+
+def specialization_matches(jobs, mechanics):
+    """Boolean (jobs x mechanics) matrix: mechanic has a skill relevant to the job"""
+    vocabulary = {}
+    job_skills = [
+        [
+            vocabulary.setdefault(skill, len(vocabulary))
+            for skill in SERVICE_SPECIALIZATIONS.get(job.service_type, {job.service_type})
+        ]
+        for job in jobs
+    ]
+    mechanic_skills = [
+        [vocabulary[skill] for skill in (m.specialization or ()) if skill in vocabulary] for m in mechanics
+    ]
+
+    job_matrix = np.zeros((len(jobs), len(vocabulary)), dtype=np.float32)
+    for row, skills in enumerate(job_skills):
+        job_matrix[row, skills] = 1
+    mechanic_matrix = np.zeros((len(mechanics), len(vocabulary)), dtype=np.float32)
+    for row, skills in enumerate(mechanic_skills):
+        mechanic_matrix[row, skills] = 1
+    return (job_matrix @ mechanic_matrix.T) > 0
+
+
+def build_cost_matrix(jobs, mechanics, now=None, avg_speed_kmh=40):
+    """
+    Cost of sending each mechanic (columns) to each job (rows)
+    Returns (cost, distances, eta_minutes); out-of-radius pairs cost INFEASIBLE
+    """
+    now = now or datetime.utcnow()
+    distances = distance_matrix(
+        [j.latitude for j in jobs], [j.longitude for j in jobs],
+        [m.latitude for m in mechanics], [m.longitude for m in mechanics]
+    )
+    eta = get_estimated_time(distances, avg_speed_kmh)
+
+    cost = eta.astype(np.float64)
+    cost[specialization_matches(jobs, mechanics)] *= SPECIALIZATION_DISCOUNT
+
+    reward = np.array([job_reward(job, now) for job in jobs], dtype=np.float64)
+    cost -= reward[:, None]
+
+    radius = np.array([m.service_radius_km or 10 for m in mechanics], dtype=np.float64)
+    cost[distances > radius[None, :]] = INFEASIBLE
+    return cost, distances, eta
+
+
+def solve_assignment(jobs, mechanics, now=None, avg_speed_kmh=40):
+    """Optimal job/mechanic matching; jobs with no mechanic in range are left out"""
+    if not jobs or not mechanics:
+        return []
+    cost, distances, eta = build_cost_matrix(jobs, mechanics, now, avg_speed_kmh)
+    rows, cols = linear_sum_assignment(cost)
+
+    return [
+        Assignment(jobs[r].id, mechanics[c].id, round(float(distances[r, c]), 2), int(eta[r, c]))
+        for r, c in zip(rows, cols)
+        if cost[r, c] < INFEASIBLE
+    ]
+
+
+def load_pending_jobs(limit):
+    rows = Service.query.with_entities(
+        Service.id, Service.location, Service.service_type, Service.priority, Service.created_at
+    ).filter_by(status='pending').order_by(Service.created_at).limit(limit).with_for_update(
+        skip_locked=True
+    ).all()
+
+    jobs, unlocated = [], []
+    for service_id, location, service_type, priority, created_at in rows:
+        position = extract_coordinates(location)
+        if position:
+            jobs.append(DispatchJob(service_id, position[0], position[1], service_type, priority, created_at))
+        else:
+            unlocated.append(service_id)
+    return jobs, unlocated
+
+
+def load_available_mechanics():
+    rows = User.query.with_entities(
+        User.id, User.lat, User.lon, User.specialization, User.service_radius_km
+    ).filter(
+        User.user_type == 'mechanic',
+        User.is_available.is_(True),
+        User.is_active.is_(True),
+        User.lat.isnot(None),
+        User.lon.isnot(None)
+    ).with_for_update(skip_locked=True).all()
+    return [DispatchMechanic(*row) for row in rows]
+
+
+def _claim_statements(service_id, mechanic_id, now):
+    """Portable fallback: the same two conditional updates as separate statements"""
+    service_row = db.session.execute(
+        update(Service.__table__)
+        .where(Service.id == service_id, Service.status == 'pending')
+        .values(status='accepted', assigned_to=mechanic_id, assigned_at=now, updated_at=now)
+        .returning(Service.id)
+    ).first()
+    if service_row is None:
+        return None, None
+    mechanic_row = db.session.execute(
+        update(User.__table__)
+        .where(
+            User.id == mechanic_id,
+            User.user_type == 'mechanic',
+            User.is_available.is_(True),
+            User.is_active.is_(True)
+        )
+        .values(is_available=False)
+        .returning(User.id)
+    ).first()
+    return service_row[0], mechanic_row[0] if mechanic_row else None
+
+
+def claim_assignment(service_id, mechanic_id):
+    """
+    Atomically assign a pending service to an available mechanic.
+    Both rows are claimed with conditional UPDATE ... RETURNING, so concurrent
+    dispatchers never double-assign and no row is locked for longer than the
+    update itself. Commits on success, rolls back otherwise.
+    """
+    now = datetime.utcnow()
+    if db.engine.dialect.name == 'postgresql':
+        claimed_service, claimed_mechanic = db.session.execute(db.text(CLAIM_SQL), {
+            'service_id': service_id, 'mechanic_id': mechanic_id, 'now': now
+        }).one()
+    else:
+        claimed_service, claimed_mechanic = _claim_statements(service_id, mechanic_id, now)
+
+    if claimed_service is not None and claimed_mechanic is not None:
+        # Core UPDATEs are invisible to the counter hooks
+        stat_counters.add({'services:status:pending': -1, 'services:status:accepted': 1})
+        response_cache.invalidate_on_commit('services', 'users')
+        db.session.commit()
+        mechanic_index.remove(mechanic_id)
+        return ClaimResult(True, CLAIM_ASSIGNED, 'accepted')
+
+    db.session.rollback()
+    # Only the failure path pays for a read, to tell the caller why
+    status = db.session.query(Service.status).filter_by(id=service_id).scalar()
+    if status is None:
+        return ClaimResult(False, CLAIM_SERVICE_NOT_FOUND, None)
+    if status != 'pending':
+        return ClaimResult(False, CLAIM_SERVICE_NOT_PENDING, status)
+    return ClaimResult(False, CLAIM_MECHANIC_UNAVAILABLE, status)
+
+
+def run_dispatch(max_jobs=5000, avg_speed_kmh=40, dry_run=False):
+    """
+    Match every pending service against every available mechanic and commit
+    all assignments in a single transaction. Rows locked by a concurrent
+    dispatch run are skipped rather than waited on.
+    """
+    now = datetime.utcnow()
+    jobs, unlocated = load_pending_jobs(max_jobs)
+    mechanics = load_available_mechanics()
+
+    start = time.perf_counter()
+    assignments = solve_assignment(jobs, mechanics, now, avg_speed_kmh)
+    solve_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    assigned = {a.service_id for a in assignments}
+    unassigned = [job.id for job in jobs if job.id not in assigned] + unlocated
+
+    if dry_run or not assignments:
+        db.session.rollback()
+        return DispatchResult(assignments, unassigned, solve_ms, False)
+
+    db.session.execute(update(Service), [
+        {
+            'id': a.service_id,
+            'status': 'accepted',
+            'assigned_to': a.mechanic_id,
+            'assigned_at': now,
+            'estimated_time': now + timedelta(minutes=a.eta_minutes),
+            'updated_at': now,
+        }
+        for a in assignments
+    ])
+    db.session.execute(update(User), [
+        {'id': a.mechanic_id, 'is_available': False} for a in assignments
+    ])
+    stat_counters.add({
+        'services:status:pending': -len(assignments),
+        'services:status:accepted': len(assignments),
+    })
+    response_cache.invalidate_on_commit('services', 'users')
+    db.session.commit()
+
+    # Bulk updates bypass the ORM change hooks that normally maintain the index
+    for a in assignments:
+        mechanic_index.remove(a.mechanic_id)
+
+    broker.publish_committed(
+        service_status_message({
+            'id': a.service_id,
+            'status': 'accepted',
+            'assigned_to': a.mechanic_id,
+            'estimated_time': (now + timedelta(minutes=a.eta_minutes)).isoformat(),
+            'updated_at': now.isoformat(),
+        })
+        for a in assignments
+    )
+
+    return DispatchResult(assignments, unassigned, solve_ms, True)
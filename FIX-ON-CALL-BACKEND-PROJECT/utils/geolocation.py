@@ -1,4 +1,36 @@
 import math
+from collections import namedtuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE = 111.32
+
+BatchDistances = namedtuple('BatchDistances', ['distances', 'mask', 'nearest'])
+
+def extract_coordinates(location):
+    """Return (latitude, longitude) floats from a location dict, or None"""
+    if not isinstance(location, dict):
+        return None
+    try:
+        latitude = float(location['latitude'])
+        longitude = float(location['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Smallest lat/lon box containing every point within radius_km
+    Returns (min_lat, max_lat, min_lon, max_lon)
+    """
+    delta_lat = radius_km / KM_PER_DEGREE
+    # Longitude degrees shrink towards the poles; size the box for the widest row
+    widest_lat = min(abs(latitude) + delta_lat, 89.9)
+    delta_lon = min(radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest_lat))), 180.0)
+    return latitude - delta_lat, latitude + delta_lat, longitude - delta_lon, longitude + delta_lon
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
@@ -17,39 +49,92 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     
     return R * c
 
-def find_nearby_locations(user_location, locations, radius_km=10):
+def batch_distances(origin_lat, origin_lon, latitudes, longitudes, radius_km=None, k=None):
+    """
+    Haversine distances from one origin to many points in a single vectorized pass
+    latitudes/longitudes: sequences or NumPy arrays of equal length
+    Returns BatchDistances(distances, mask, nearest):
+      distances - float array of kilometers, one per point
+      mask      - bool array, True where distance <= radius_km (all True without a radius)
+      nearest   - indices of points inside the radius ordered by distance, at most k
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    origin_lat_rad = math.radians(origin_lat)
+
+    a = (np.sin((lat - origin_lat_rad) / 2) ** 2
+         + math.cos(origin_lat_rad) * np.cos(lat) * np.sin((lon - math.radians(origin_lon)) / 2) ** 2)
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    if radius_km is None:
+        mask = np.ones(distances.shape, dtype=bool)
+        candidates = np.arange(distances.size)
+    else:
+        mask = distances <= radius_km
+        candidates = np.flatnonzero(mask)
+
+    if k is not None and k < candidates.size:
+        candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+    nearest = candidates[np.argsort(distances[candidates], kind='stable')]
+
+    return BatchDistances(distances, mask, nearest)
+
+def distance_matrix(latitudes_a, longitudes_a, latitudes_b, longitudes_b, chunk_rows=512):
+    """
+    Pairwise haversine distances in kilometers, shape (len(a), len(b))
+    Rows are computed in chunks to bound the size of the temporaries
+    """
+    lat_a = np.radians(np.asarray(latitudes_a, dtype=np.float64))[:, None]
+    lon_a = np.radians(np.asarray(longitudes_a, dtype=np.float64))[:, None]
+    lat_b = np.radians(np.asarray(latitudes_b, dtype=np.float64))[None, :]
+    lon_b = np.radians(np.asarray(longitudes_b, dtype=np.float64))[None, :]
+    cos_b = np.cos(lat_b)
+
+    out = np.empty((lat_a.shape[0], lat_b.shape[1]), dtype=np.float64)
+    for start in range(0, lat_a.shape[0], chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        a = (np.sin((lat_b - lat_a[rows]) / 2) ** 2
+             + np.cos(lat_a[rows]) * cos_b * np.sin((lon_b - lon_a[rows]) / 2) ** 2)
+        out[rows] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return out
+
+def find_nearby_locations(user_location, locations, radius_km=10, limit=None):
     """
     Find locations within radius of user location
     user_location: {'latitude': float, 'longitude': float}
     locations: list of dicts with 'location' key containing lat/lon
+    Returns copies of the matching dicts with 'distance_km' set, nearest first
     """
-    nearby = []
-    
-    for loc in locations:
-        if 'location' in loc and 'latitude' in loc['location'] and 'longitude' in loc['location']:
-            distance = calculate_distance(
-                user_location['latitude'],
-                user_location['longitude'],
-                loc['location']['latitude'],
-                loc['location']['longitude']
-            )
-            
-            if distance <= radius_km:
-                loc['distance_km'] = round(distance, 2)
-                nearby.append(loc)
-    
-    # Sort by distance
-    nearby.sort(key=lambda x: x['distance_km'])
-    return nearby
+    valid = [
+        loc for loc in locations
+        if loc.get('location') and 'latitude' in loc['location'] and 'longitude' in loc['location']
+    ]
+    if not valid:
+        return []
+
+    result = batch_distances(
+        user_location['latitude'],
+        user_location['longitude'],
+        [loc['location']['latitude'] for loc in valid],
+        [loc['location']['longitude'] for loc in valid],
+        radius_km=radius_km,
+        k=limit
+    )
+
+    return [
+        dict(valid[i], distance_km=round(float(result.distances[i]), 2))
+        for i in result.nearest
+    ]
 
 def get_estimated_time(distance_km, avg_speed_kmh=40):
     """
     Estimate travel time based on distance
-    Returns time in minutes
+    Accepts a single distance or an array of distances
+    Returns time in minutes (int, or int array for array input)
     """
-    if distance_km <= 0:
-        return 0
-    
-    hours = distance_km / avg_speed_kmh
-    minutes = hours * 60
-    return round(minutes)
+    distances = np.asarray(distance_km, dtype=np.float64)
+    minutes = np.where(distances <= 0, 0.0, np.rint(distances / avg_speed_kmh * 60))
+
+    if minutes.ndim == 0:
+        return int(minutes)
+    return minutes.astype(np.int64)
@@ -0,0 +1,229 @@
+"""
+In-process background jobs.
+
+Work that does not have to finish before a response is sent (lookups,
+fan-out, notification sends) is handed to a small pool of worker threads
+through a bounded queue. When the queue is full the caller runs the job
+itself, so a backlog slows requests down instead of dropping work or
+growing memory without bound. Results are kept per job id for a while so
+clients can fetch them after the request has returned.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JobResult = namedtuple('JobResult', ['id', 'status', 'result', 'error', 'finished_at'])
+
+_Job = namedtuple('_Job', ['id', 'func', 'args', 'kwargs'])
+_STOP = object()
+
+
+class JobQueue:
+    """Bounded thread-pool job queue with caller-runs backpressure"""
+
+    def __init__(self, name='jobs', workers=4, max_queue=1000, max_results=10000, result_ttl=900):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_results = max_results
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._app = None
+        self._atexit_registered = False
+        self.submitted = 0
+        self.ran_inline = 0
+        self.failed = 0
+
+    def init_app(self, app, workers=None, max_queue=None, start=None):
+        """Bind to an app; workers start unless testing or start=False"""
+        if self._threads:
+            # Re-binding (e.g. another create_app call): finish work for the previous app first
+            self.stop()
+        self._app = app
+        if workers is not None:
+            self.workers = workers
+        if max_queue is not None:
+            self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._results = OrderedDict()
+        if start is None:
+            start = not app.testing
+        if start:
+            self.start()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def submit(self, func, *args, job_id=None, **kwargs):
+        """
+        Queue func(*args, **kwargs) and return its job id
+        If the queue is full the job runs in the calling thread before returning
+        """
+        job = _Job(job_id or uuid.uuid4().hex, func, args, kwargs)
+        self._store(job.id, JOB_QUEUED)
+        self.submitted += 1
+        # Without workers, tests drive the queue explicitly with join(); anything else runs inline
+        if self.running or (self._app is not None and self._app.testing):
+            try:
+                self._queue.put_nowait(job)
+                return job.id
+            except queue.Full:
+                logger.warning('%s queue full (%d); running job %s inline', self.name, self.max_queue, job.id)
+        self.ran_inline += 1
+        self._execute(job)
+        return job.id
+
+    def result(self, job_id):
+        """JobResult for a job id, or None if unknown or expired"""
+        with self._lock:
+            self._expire()
+            return self._results.get(job_id)
+
+    def join(self, timeout=None):
+        """
+        Wait until every queued job has finished; returns False on timeout
+        Without running workers the queued jobs are executed in this thread
+        """
+        if not self.running:
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    return True
+                self._execute(job)
+                self._queue.task_done()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def start(self):
+        if self.running:
+            return
+        self._threads = [
+            threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self, timeout=10.0):
+        """Graceful shutdown: let workers finish queued jobs, then stop them"""
+        threads, self._threads = self._threads, []
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            # Blocks while the queue is full, so stop markers go in behind pending work
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if any(thread.is_alive() for thread in threads):
+            logger.warning('%s workers did not stop within %.1fs', self.name, timeout)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job):
+        self._store(job.id, JOB_RUNNING)
+        try:
+            if self._app is not None:
+                with self._app.app_context():
+                    result = job.func(*job.args, **job.kwargs)
+            else:
+                result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            self.failed += 1
+            logger.exception('%s job %s failed', self.name, job.id)
+            self._store(job.id, JOB_FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._store(job.id, JOB_DONE, result=result, finished_at=time.time())
+
+    def _store(self, job_id, status, result=None, error=None, finished_at=None):
+        with self._lock:
+            self._results[job_id] = JobResult(job_id, status, result, error, finished_at)
+            self._results.move_to_end(job_id)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        while self._results:
+            oldest = next(iter(self._results.values()))
+            if oldest.finished_at is None or oldest.finished_at >= cutoff:
+                break
+            self._results.popitem(last=False)
+
+
+class PeriodicTask:
+    """Submits a job to a JobQueue every `interval` seconds from a timer thread"""
+
+    def __init__(self, func, interval, name='periodic', queue=None):
+        self.func = func
+        self.interval = interval
+        self.name = name
+        self.queue = queue
+        self._stopping = threading.Event()
+        self._thread = None
+        self._atexit_registered = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            (self.queue or job_queue).submit(self.func)
+
+
+job_queue = JobQueue(name='jobs')
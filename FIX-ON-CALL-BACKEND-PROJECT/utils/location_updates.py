@@ -0,0 +1,110 @@
+"""
+Mechanic GPS ingestion.
+
+Pings are coalesced per mechanic in memory (newest recorded_at wins) and
+written to users.current_location/lat/lon in bulk by a write-behind
+buffer. The in-process mechanic index is moved immediately, so nearby
+lookups in this worker see the new position before the flush.
+"""
+
+import json
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from database import db
+from utils.batching import WriteBehindBuffer
+from utils.spatial_index import mechanic_index
+from utils.validators import validate_coordinates
+
+LocationPing = namedtuple('LocationPing', ['mechanic_id', 'latitude', 'longitude', 'recorded_at', 'extra'])
+
+# Optional telemetry copied into current_location alongside the coordinates
+EXTRA_FIELDS = ('accuracy', 'heading', 'speed')
+
+UPDATE_CHUNK_SIZE = 500
+
+
+def parse_ping(mechanic_id, point):
+    """Build a LocationPing from a request payload; raises ValueError when invalid"""
+    if not isinstance(point, dict):
+        raise ValueError('Each point must be an object')
+    try:
+        latitude = float(point['latitude'])
+        longitude = float(point['longitude'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('latitude and longitude are required numbers')
+    if not validate_coordinates(latitude, longitude):
+        raise ValueError('Coordinates out of range')
+
+    recorded_at = point.get('recorded_at')
+    if recorded_at:
+        try:
+            recorded_at = datetime.fromisoformat(str(recorded_at).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('recorded_at must be an ISO 8601 timestamp')
+        # Stored as naive UTC like every other timestamp; naive input is taken as UTC already
+        if recorded_at.tzinfo is not None:
+            recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        recorded_at = datetime.utcnow()
+
+    extra = {field: point[field] for field in EXTRA_FIELDS if point.get(field) is not None}
+    return LocationPing(mechanic_id, latitude, longitude, recorded_at, extra)
+
+
+def _newest(old, new):
+    return new if new.recorded_at >= old.recorded_at else old
+
+
+def record_location(ping):
+    """Buffer a ping and move the mechanic in the local index right away"""
+    if location_buffer.add(ping, key=ping.mechanic_id) is ping:
+        mechanic_index.move(ping.mechanic_id, ping.latitude, ping.longitude)
+
+
+def _location_json(ping):
+    location = {
+        'latitude': ping.latitude,
+        'longitude': ping.longitude,
+        'recorded_at': ping.recorded_at.isoformat(),
+    }
+    location.update(ping.extra)
+    return json.dumps(location)
+
+
+def flush_locations(pings):
+    """Write buffered pings with one UPDATE ... FROM (VALUES ...) per chunk"""
+    postgres = db.engine.dialect.name == 'postgresql'
+    for start in range(0, len(pings), UPDATE_CHUNK_SIZE):
+        chunk = pings[start:start + UPDATE_CHUNK_SIZE]
+        if postgres:
+            params = {}
+            values = []
+            for i, ping in enumerate(chunk):
+                values.append(
+                    f'(CAST(:id{i} AS INTEGER), CAST(:loc{i} AS JSON), '
+                    f'CAST(:lat{i} AS DOUBLE PRECISION), CAST(:lon{i} AS DOUBLE PRECISION))'
+                )
+                params.update({
+                    f'id{i}': ping.mechanic_id,
+                    f'loc{i}': _location_json(ping),
+                    f'lat{i}': ping.latitude,
+                    f'lon{i}': ping.longitude,
+                })
+            db.session.execute(db.text(
+                'UPDATE users AS u SET current_location = v.location, lat = v.lat, lon = v.lon '
+                f'FROM (VALUES {", ".join(values)}) AS v(id, location, lat, lon) '
+                "WHERE u.id = v.id AND u.user_type = 'mechanic'"
+            ), params)
+        else:
+            db.session.execute(db.text(
+                'UPDATE users SET current_location = :location, lat = :lat, lon = :lon '
+                "WHERE id = :id AND user_type = 'mechanic'"
+            ), [
+                {'id': p.mechanic_id, 'location': _location_json(p), 'lat': p.latitude, 'lon': p.longitude}
+                for p in chunk
+            ])
+    db.session.commit()
+
+
+location_buffer = WriteBehindBuffer(flush_locations, name='location-flush', interval=2.0, merge=_newest)
@@ -0,0 +1,69 @@
+"""
+Lookups of available mechanics around a point.
+"""
+
+from models.user import User
+from utils.geolocation import batch_distances, bounding_box
+from utils.spatial_index import mechanic_index
+
+# Index hits re-checked in the first round per mechanic wanted; each further round doubles
+RECHECK_OVERFETCH = 2
+
+
+def find_nearby_mechanics(latitude, longitude, radius_km, specialization=None, limit=None):
+    """Look up available mechanics near a point through the in-process spatial index"""
+    mechanic_index.ensure_loaded()
+    # Every hit in the radius, nearest first: some may fail the re-check below
+    hits = mechanic_index.radius_search(latitude, longitude, radius_km, specialization)
+    nearby = []
+    start, chunk_size = 0, limit * RECHECK_OVERFETCH if limit else len(hits)
+    while start < len(hits):
+        chunk = hits[start:start + chunk_size]
+        start += len(chunk)
+        chunk_size *= 2
+        # Re-check availability: the index may lag writes made by other workers
+        mechanics = User.query.filter(
+            User.id.in_([mechanic_id for mechanic_id, _ in chunk]),
+            User.user_type == 'mechanic',
+            User.is_available.is_(True),
+            User.is_active.is_(True)
+        ).all()
+        by_id = {m.id: m for m in mechanics}
+
+        for mechanic_id, distance in chunk:
+            mechanic = by_id.get(mechanic_id)
+            if mechanic:
+                mechanic_data = mechanic.to_dict()
+                mechanic_data['distance_km'] = round(distance, 2)
+                nearby.append(mechanic_data)
+                if limit and len(nearby) == limit:
+                    return nearby
+    return nearby
+
+
+def query_mechanics_in_radius(latitude, longitude, radius_km, specialization=None):
+    """Bounding-box prefilter on the indexed lat/lon columns, then exact haversine refinement"""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    candidates = User.query.filter(
+        User.user_type == 'mechanic',
+        User.lat.between(min_lat, max_lat),
+        User.lon.between(min_lon, max_lon),
+        User.is_available.is_(True),
+        User.is_active.is_(True)
+    ).all()
+
+    if specialization:
+        candidates = [m for m in candidates if specialization in (m.specialization or [])]
+    if not candidates:
+        return []
+
+    result = batch_distances(
+        latitude, longitude, [m.lat for m in candidates], [m.lon for m in candidates], radius_km=radius_km
+    )
+
+    nearby = []
+    for i in result.nearest:
+        mechanic_data = candidates[i].to_dict()
+        mechanic_data['distance_km'] = round(float(result.distances[i]), 2)
+        nearby.append(mechanic_data)
+    return nearby
@@ -1,29 +1,26 @@
-from flask_mail import Message
 from flask import current_app
+from database import db
+from models.outbox import OUTBOX_EMAIL, OUTBOX_SMS
+from utils.outbox import notification_outbox
 
 def send_email(to_email, subject, body):
-    """Send email notification"""
+    """Queue an email notification in the outbox (sent by its workers; commits the session)"""
     try:
-        msg = Message(
-            subject=subject,
-            recipients=[to_email],
-            body=body,
-            sender=current_app.config['MAIL_DEFAULT_SENDER']
-        )
-        current_app.extensions['mail'].send(msg)
+        notification_outbox.enqueue(OUTBOX_EMAIL, to_email, body, subject=subject)
         return True
     except Exception as e:
-        current_app.logger.error(f"Email send failed: {str(e)}")
+        db.session.rollback()
+        current_app.logger.error(f"Email queueing failed: {str(e)}")
         return False
 
 def send_sms(phone_number, message):
-    """Send SMS notification (placeholder for Africa's Talking integration)"""
+    """Queue an SMS notification in the outbox (sent by its workers; commits the session)"""
     try:
-        # TODO: Integrate Africa's Talking API
-        current_app.logger.info(f"SMS to {phone_number}: {message}")
+        notification_outbox.enqueue(OUTBOX_SMS, phone_number, message)
         return True
     except Exception as e:
-        current_app.logger.error(f"SMS send failed: {str(e)}")
+        db.session.rollback()
+        current_app.logger.error(f"SMS queueing failed: {str(e)}")
         return False
 
 def notify_service_request(user, service):
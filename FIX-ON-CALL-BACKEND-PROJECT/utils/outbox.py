@@ -0,0 +1,416 @@
+"""
+Outbox for email and SMS notifications.
+
+send_email and send_sms (utils.notifications) only insert a row into
+notification_outbox; a pool of OUTBOX_WORKERS threads per process sends
+them. A worker claims up to OUTBOX_BATCH_SIZE due messages with one
+UPDATE (on Postgres over FOR UPDATE SKIP LOCKED, so the workers of every
+process share the table without waiting on each other), commits, and
+sends the batch's emails over one SMTP connection (mail.connect()): the
+connect / STARTTLS / login handshake is paid per batch, not per email.
+
+A claim lasts OUTBOX_CLAIM_SECONDS, after which the messages of a worker
+that died mid-batch are due again. A message that fails temporarily (a
+4xx reply, no connection) is retried after an exponential backoff,
+OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1) capped at
+OUTBOX_MAX_BACKOFF_SECONDS, with some jitter so a recovered SMTP server is
+not hit by the whole backlog at once. A permanent refusal (5xx) or the
+OUTBOX_MAX_ATTEMPTS'th failure dead-letters it: it stays with status
+'dead' and its last error until an admin requeues it. Sent messages are
+purged after OUTBOX_RETENTION_DAYS.
+
+Delivery is at least once: a message whose claim runs out while its worker
+is still sending it can go out twice.
+"""
+
+import atexit
+import logging
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import BadHeaderError, Message
+from sqlalchemy import bindparam, delete, func, select, update
+
+from database import db
+from models.outbox import (
+    OUTBOX_DEAD, OUTBOX_EMAIL, OUTBOX_PENDING, OUTBOX_SENDING, OUTBOX_SENT, OUTBOX_SMS, OutboxMessage
+)
+from utils.jobs import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# sent_per_second is measured over this many recent seconds
+THROUGHPUT_WINDOW_SECONDS = 60
+# Sent rows are purged this many at a time
+PURGE_BATCH_SIZE = 5000
+
+ClaimedMessage = namedtuple('ClaimedMessage', 'id channel recipient subject body attempts')
+
+
+def deliver_sms(phone_number, message):
+    """Send one SMS (placeholder for Africa's Talking integration)"""
+    # TODO: Integrate Africa's Talking API
+    current_app.logger.info(f"SMS to {phone_number}: {message}")
+
+
+def _permanent(error):
+    """Whether retrying cannot help: a 5xx SMTP reply, or a message that cannot be built"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return min(code for code, _ in error.recipients.values()) >= 500
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return isinstance(error, (BadHeaderError, AssertionError))
+
+
+def _describe(error):
+    return f'{type(error).__name__}: {error}'[:1000]
+
+
+class NotificationOutbox:
+    """Pool of worker threads that send notification_outbox messages in batches"""
+
+    def __init__(self, name='outbox'):
+        self.name = name
+        self.workers = 2
+        self.batch_size = 50
+        self.poll_interval = 2.0
+        self.claim_seconds = 300.0
+        self.max_attempts = 8
+        self.backoff = 30.0
+        self.max_backoff = 3600.0
+        self.jitter = 0.2
+        self.retention_days = 7.0
+        self._app = None
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._purge_task = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+        self._reset_counters()
+
+    def init_app(self, app, start=None):
+        """Bind to an app; workers start unless testing or start=False"""
+        if self._threads:
+            # Re-binding (e.g. another create_app call): the messages stay queued in the table
+            self.stop()
+        self._app = app
+        self.workers = app.config['OUTBOX_WORKERS']
+        self.batch_size = app.config['OUTBOX_BATCH_SIZE']
+        self.poll_interval = app.config['OUTBOX_POLL_SECONDS']
+        self.claim_seconds = app.config['OUTBOX_CLAIM_SECONDS']
+        self.max_attempts = app.config['OUTBOX_MAX_ATTEMPTS']
+        self.backoff = app.config['OUTBOX_BACKOFF_SECONDS']
+        self.max_backoff = app.config['OUTBOX_MAX_BACKOFF_SECONDS']
+        self.retention_days = app.config['OUTBOX_RETENTION_DAYS']
+        self._reset_counters()
+        if self._purge_task is not None:
+            self._purge_task.stop()
+            self._purge_task = None
+        if start is None:
+            start = not app.testing
+        if start:
+            self.start()
+            interval = app.config['OUTBOX_PURGE_INTERVAL_SECONDS']
+            if interval:
+                self._purge_task = PeriodicTask(self.purge_sent, interval, name='outbox-purge')
+                self._purge_task.start()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    # ------------------------------------------------------------------
+    # Queueing
+    # ------------------------------------------------------------------
+    def enqueue(self, channel, recipient, body, subject=None, commit=True):
+        """
+        Queue a message for the workers; returns the OutboxMessage
+        With commit=False it is written by the caller's own commit, and only if that succeeds.
+        """
+        message = OutboxMessage(channel=channel, recipient=recipient, subject=subject, body=body)
+        db.session.add(message)
+        if commit:
+            db.session.commit()
+        self.wake()
+        return message
+
+    def wake(self):
+        """Have an idle worker of this process look for due messages now rather than at its next poll"""
+        self._wake.set()
+
+    def requeue_dead(self, ids=None):
+        """Give dead-lettered messages (all, or those ids) a fresh set of attempts; returns the count"""
+        query = update(OutboxMessage).where(OutboxMessage.status == OUTBOX_DEAD)
+        if ids is not None:
+            query = query.where(OutboxMessage.id.in_(ids))
+        requeued = db.session.execute(query.values(
+            status=OUTBOX_PENDING, attempts=0, next_attempt_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if requeued:
+            self.wake()
+        return requeued
+
+    def purge_sent(self, older_than_days=None):
+        """Delete messages sent more than older_than_days ago, in batches; returns the count"""
+        older_than_days = self.retention_days if older_than_days is None else older_than_days
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        purged = 0
+        while True:
+            batch = select(OutboxMessage.id).where(
+                OutboxMessage.status == OUTBOX_SENT, OutboxMessage.sent_at < cutoff
+            ).limit(PURGE_BATCH_SIZE)
+            deleted = db.session.execute(
+                delete(OutboxMessage.__table__).where(OutboxMessage.__table__.c.id.in_(batch))
+            ).rowcount
+            db.session.commit()
+            purged += deleted
+            if deleted < PURGE_BATCH_SIZE:
+                return purged
+
+    # ------------------------------------------------------------------
+    # Sending
+    # ------------------------------------------------------------------
+    def process_batch(self, limit=None):
+        """Claim, send and record one batch of due messages; returns how many were claimed"""
+        started = time.monotonic()
+        token, claimed = self._claim(limit or self.batch_size)
+        if not claimed:
+            return 0
+        results, connections = self._deliver(claimed)
+        outcome = self._record(token, claimed, results)
+        self._count(outcome, connections, time.monotonic() - started)
+        return len(claimed)
+
+    def drain(self, max_batches=None):
+        """Send due messages from this thread until none are left; returns how many were processed"""
+        processed = batches = 0
+        while max_batches is None or batches < max_batches:
+            claimed = self.process_batch()
+            if not claimed:
+                break
+            processed += claimed
+            batches += 1
+        return processed
+
+    def backoff_seconds(self, attempts):
+        """Delay before the retry that follows failed attempt number `attempts`"""
+        delay = min(self.backoff * 2 ** max(attempts - 1, 0), self.max_backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _claim(self, limit):
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due = select(OutboxMessage.id).where(
+            OutboxMessage.status.in_((OUTBOX_PENDING, OUTBOX_SENDING)),
+            OutboxMessage.next_attempt_at <= now,
+        ).order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(limit)
+        if db.engine.dialect.name == 'postgresql':
+            due = due.with_for_update(skip_locked=True)
+        # The attempt is counted when claimed, so a message that keeps killing its worker still runs out
+        db.session.execute(update(OutboxMessage).where(OutboxMessage.id.in_(due)).values(
+            status=OUTBOX_SENDING,
+            claim_token=token,
+            attempts=OutboxMessage.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=self.claim_seconds),
+        ).execution_options(synchronize_session=False))
+        rows = db.session.execute(select(
+            OutboxMessage.id, OutboxMessage.channel, OutboxMessage.recipient, OutboxMessage.subject,
+            OutboxMessage.body, OutboxMessage.attempts,
+        ).where(OutboxMessage.claim_token == token).order_by(OutboxMessage.id)).all()
+        # Hold no transaction (or lock) while talking to the SMTP server
+        db.session.commit()
+        return token, [ClaimedMessage(*row) for row in rows]
+
+    def _deliver(self, claimed):
+        """Send a claimed batch; returns ({message id: (error or None, permanent)}, SMTP connections opened)"""
+        results = {}
+        emails = [message for message in claimed if message.channel == OUTBOX_EMAIL]
+        connections = self._send_emails(emails, results) if emails else 0
+        for message in claimed:
+            if message.channel == OUTBOX_SMS:
+                try:
+                    deliver_sms(message.recipient, message.body)
+                    results[message.id] = (None, False)
+                except Exception as e:
+                    results[message.id] = (_describe(e), False)
+            elif message.channel != OUTBOX_EMAIL:
+                results[message.id] = (f'Unknown channel: {message.channel}', True)
+        return results, connections
+
+    def _send_emails(self, emails, results):
+        mail = current_app.extensions['mail']
+        sender = current_app.config['MAIL_DEFAULT_SENDER']
+        opened = 0
+        try:
+            with mail.connect() as connection:
+                opened = 1
+                for message in emails:
+                    try:
+                        connection.send(Message(
+                            subject=message.subject or '',
+                            recipients=[message.recipient],
+                            body=message.body,
+                            sender=sender,
+                        ))
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException, BadHeaderError,
+                            AssertionError) as e:
+                        # Refused (the connection stays usable) or not sendable at all
+                        results[message.id] = (_describe(e), _permanent(e))
+                    else:
+                        results[message.id] = (None, False)
+        except Exception as e:
+            # No connection, or it broke: whatever the batch had left is retried
+            logger.warning('%s: SMTP connection failed after %d of %d emails: %s',
+                           self.name, len(results), len(emails), e)
+            for message in emails:
+                results.setdefault(message.id, (_describe(e), False))
+        return opened
+
+    def _record(self, token, claimed, results):
+        now = datetime.utcnow()
+        outcome = {'sent': 0, 'retried': 0, 'dead': 0}
+        rows = []
+        for message in claimed:
+            error, permanent = results.get(message.id, ('Not attempted', False))
+            if error is None:
+                status, next_attempt_at = OUTBOX_SENT, now
+                outcome['sent'] += 1
+            elif permanent or message.attempts >= self.max_attempts:
+                status, next_attempt_at = OUTBOX_DEAD, now
+                outcome['dead'] += 1
+                logger.warning('%s: dead-lettered %s message %d to %s after %d attempts: %s',
+                               self.name, message.channel, message.id, message.recipient, message.attempts, error)
+            else:
+                status = OUTBOX_PENDING
+                next_attempt_at = now + timedelta(seconds=self.backoff_seconds(message.attempts))
+                outcome['retried'] += 1
+            rows.append({
+                'message_id': message.id,
+                'new_status': status,
+                'retry_at': next_attempt_at,
+                'error': error,
+                'sent': now if error is None else None,
+            })
+
+        table = OutboxMessage.__table__
+        # A claim that ran out and was taken over is the new claimant's to record
+        db.session.execute(update(table).where(
+            table.c.id == bindparam('message_id'), table.c.claim_token == token
+        ).values(
+            status=bindparam('new_status'),
+            next_attempt_at=bindparam('retry_at'),
+            last_error=func.coalesce(bindparam('error'), table.c.last_error),
+            sent_at=bindparam('sent'),
+            claim_token=None,
+        ), rows)
+        db.session.commit()
+        return outcome
+
+    # ------------------------------------------------------------------
+    # Throughput
+    # ------------------------------------------------------------------
+    def _reset_counters(self):
+        with self._lock:
+            self.counters = dict.fromkeys(('batches', 'claimed', 'sent', 'retried', 'dead', 'connections'), 0)
+            self.busy_seconds = 0.0
+            self._recent = deque()  # (monotonic time, sent) per batch
+            self._started = time.monotonic()
+
+    def _count(self, outcome, connections, seconds):
+        now = time.monotonic()
+        with self._lock:
+            for key, value in outcome.items():
+                self.counters[key] += value
+            self.counters['claimed'] += sum(outcome.values())
+            self.counters['batches'] += 1
+            self.counters['connections'] += connections
+            self.busy_seconds += seconds
+            self._recent.append((now, outcome['sent']))
+            while self._recent[0][0] < now - THROUGHPUT_WINDOW_SECONDS:
+                self._recent.popleft()
+
+    def stats(self):
+        """Counters and throughput of this process's workers since init_app"""
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.counters)
+            recent = sum(sent for at, sent in self._recent if at >= now - THROUGHPUT_WINDOW_SECONDS)
+            window = min(THROUGHPUT_WINDOW_SECONDS, now - self._started)
+            busy = self.busy_seconds
+        return {
+            'workers': sum(thread.is_alive() for thread in self._threads),
+            **counters,
+            'busy_seconds': round(busy, 3),
+            # Over the last THROUGHPUT_WINDOW_SECONDS, idle time included
+            'sent_per_second': round(recent / window, 2) if window > 0 else 0.0,
+            # While sending: what the workers can sustain
+            'sent_per_busy_second': round(counters['sent'] / busy, 2) if busy else 0.0,
+            'emails_per_connection': (
+                round(counters['sent'] / counters['connections'], 2) if counters['connections'] else 0.0
+            ),
+        }
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self, timeout=10.0):
+        """Stop the workers after their current batch; queued messages stay in the table"""
+        self._stopping.set()
+        self._wake.set()
+        threads, self._threads = self._threads, []
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if self._purge_task is not None:
+            self._purge_task.stop()
+            self._purge_task = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self._app.app_context():
+                    processed = self.process_batch()
+            except Exception:
+                logger.exception('%s batch failed', self.name)
+                processed = 0
+            if not processed:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+notification_outbox = NotificationOutbox()
+
+
+def queue_summary():
+    """Message counts by status, and when the oldest unsent message was queued"""
+    counts = dict(db.session.query(OutboxMessage.status, func.count()).group_by(OutboxMessage.status).all())
+    oldest = db.session.query(func.min(OutboxMessage.created_at)).filter(
+        OutboxMessage.status.in_((OUTBOX_PENDING, OUTBOX_SENDING))
+    ).scalar()
+    return {
+        'by_status': {status: counts.get(status, 0)
+                      for status in (OUTBOX_PENDING, OUTBOX_SENDING, OUTBOX_SENT, OUTBOX_DEAD)},
+        'oldest_unsent_at': oldest.isoformat() if oldest else None,
+    }
@@ -0,0 +1,175 @@
+"""
+Request principals without a user query per request.
+
+Access tokens carry the user's role and active flag as claims
+(token_claims). A token whose role claim does not match a route is
+rejected by require_role without touching the database; a role cannot
+change after sign-up, so the claim stays true for the token's lifetime.
+
+The active flag can change at any time (suspend, ban, ...), so a matching
+token is checked against a short-TTL per-process cache of (role,
+is_active) loaded from the users table: one query per user per TTL, none
+on a hit. ORM commits that change a user's role or active flag, and the
+bulk admin actions, evict the user at once in this process; other workers
+pick the change up when their entry expires. Tokens without the claims
+(issued before they existed) simply take the cache path.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import g, jsonify
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import event, inspect
+
+from database import db
+
+PENDING_PRINCIPALS_KEY = 'principal_cache_pending'
+
+Principal = namedtuple('Principal', 'id role is_active')
+
+
+def token_claims(user):
+    """Additional access token claims for a user"""
+    return {'role': user.user_type, 'active': bool(user.is_active)}
+
+
+class PrincipalCache:
+    """Per-process TTL cache of user id -> Principal (None for a missing user)"""
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners_registered = False
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.ttl = app.config['PRINCIPAL_CACHE_TTL_SECONDS']
+        self.max_entries = app.config['PRINCIPAL_CACHE_MAX_ENTRIES']
+        self.clear()
+        self._register_listeners()
+        app.extensions['principal_cache'] = self
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._entries.get(user_id)
+            if item is not None and item[0] > time.monotonic():
+                self.hits += 1
+                return item[1]
+        self.misses += 1
+        return self.load(user_id)
+
+    def load(self, user_id):
+        """Read a user's principal from the database and cache it"""
+        from models.user import User
+
+        row = db.session.query(User.user_type, User.is_active).filter(User.id == user_id).first()
+        principal = Principal(user_id, row.user_type, bool(row.is_active)) if row else None
+        if self.ttl > 0:
+            with self._lock:
+                self._entries.pop(user_id, None)
+                self._entries[user_id] = (time.monotonic() + self.ttl, principal)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return principal
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        item = self._entries.get(user_id)
+        return item is not None and item[0] > time.monotonic()
+
+    # ------------------------------------------------------------------
+    # ORM change tracking
+    # ------------------------------------------------------------------
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        event.listen(db.session, 'after_flush', self._collect_changes)
+        event.listen(db.session, 'after_commit', self._apply_changes)
+        event.listen(db.session, 'after_rollback', self._discard_changes)
+        self._listeners_registered = True
+
+    def _collect_changes(self, session, flush_context):
+        from models.user import User
+
+        changed = {
+            obj.id for obj in session.dirty
+            if isinstance(obj, User) and (
+                _attribute_changed(obj, 'is_active') or _attribute_changed(obj, 'user_type')
+            )
+        }
+        changed.update(obj.id for obj in session.deleted if isinstance(obj, User))
+        if changed:
+            session.info.setdefault(PENDING_PRINCIPALS_KEY, set()).update(changed)
+
+    def _apply_changes(self, session):
+        changed = session.info.pop(PENDING_PRINCIPALS_KEY, None)
+        if changed:
+            self.invalidate(*changed)
+
+    def _discard_changes(self, session):
+        session.info.pop(PENDING_PRINCIPALS_KEY, None)
+
+
+def _attribute_changed(obj, name):
+    return inspect(obj).attrs[name].history.has_changes()
+
+
+principal_cache = PrincipalCache()
+
+
+def current_principal():
+    """Principal of the request's JWT identity (None for an unknown user); memoized per request"""
+    if 'principal' not in g:
+        try:
+            user_id = int(get_jwt_identity())
+        except (TypeError, ValueError):
+            g.principal = None
+        else:
+            g.principal = principal_cache.get(user_id)
+    return g.principal
+
+
+def current_user_has_role(*roles):
+    principal = current_principal()
+    return principal is not None and principal.is_active and principal.role in roles
+
+
+def require_role(*roles):
+    """
+    Allow only active users with one of roles; use under @jwt_required()
+    A token with a non-matching role claim is refused without a lookup.
+    """
+    error = ' or '.join(role.capitalize() for role in roles) + ' access required'
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            claims = get_jwt()
+            if claims.get('role') not in (None, *roles) or claims.get('active') is False:
+                return jsonify({'success': False, 'error': error}), 403
+            try:
+                int(get_jwt_identity())
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'error': 'Invalid token identity'}), 401
+            if not current_user_has_role(*roles):
+                return jsonify({'success': False, 'error': error}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,288 @@
+"""
+Read-replica routing.
+
+Views marked with @replica_reads (dashboards, admin lists, exports,
+history pages) send their plain SELECTs to a read replica; everything else
+stays on the primary. A session picks its replica once and sends all its
+routed reads there, so the queries of one request (a count and its page)
+see the same snapshot. It reads from the primary once it has written
+anything (read-after-write within a request).
+
+A response to a request that committed a write carries a
+X-Replica-Sticky-Until header, the Unix time until which the client's
+reads must see the write; a client that sends it back with its next
+requests reads from the primary until then (read-after-write across
+requests). The client carries it, so it holds whichever worker or host
+the next request lands on.
+
+A background thread measures replica lag every REPLICA_LAG_CHECK_SECONDS;
+requests only look at the last result. A replica more than
+REPLICA_MAX_LAG_SECONDS behind, one that cannot be reached, or one whose
+last check is older than REPLICA_LAG_STALE_SECONDS is skipped, and with no
+usable replica reads fall back to the primary. Lag comes from
+REPLICA_LAG_QUERY (seconds), or on Postgres from the WAL replay position;
+other databases are only checked for reachability.
+
+Responses cached by utils.cache are built on the primary and never served
+to a sticky client; see ResponseCache.cached.
+
+Each replica gets its own engine and pool (REPLICA_ENGINE_OPTIONS). With
+no DATABASE_REPLICA_URLS configured the router is a no-op.
+"""
+
+import atexit
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+
+logger = logging.getLogger(__name__)
+
+USE_REPLICA_KEY = 'replica_reads'
+WROTE_KEY = 'replica_wrote'
+PINNED_KEY = 'replica_engine'
+STICKY_HEADER = 'X-Replica-Sticky-Until'
+
+POSTGRES_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.lag = None
+        self.healthy = True
+        self.error = None
+        self.checked_at = None
+
+
+class ReplicaRouter:
+    """Picks the engine for routed reads and tracks replica lag and sticky writers"""
+
+    def __init__(self):
+        self.replicas = []
+        self.max_lag = 5.0
+        self.lag_check_seconds = 10.0
+        self.lag_stale_seconds = 30.0
+        self.sticky_seconds = 5.0
+        self.lag_query = None
+        self._cycle = itertools.cycle(())
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._atexit_registered = False
+        self._listeners_registered = False
+        self.replica_reads = 0
+        self.fallbacks = 0
+
+    def init_app(self, app, start=None):
+        """Bind to an app; the lag check thread starts unless testing or start=False"""
+        self.dispose()
+        self.max_lag = app.config['REPLICA_MAX_LAG_SECONDS']
+        self.lag_check_seconds = app.config['REPLICA_LAG_CHECK_SECONDS']
+        self.lag_stale_seconds = app.config['REPLICA_LAG_STALE_SECONDS']
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        self.lag_query = app.config.get('REPLICA_LAG_QUERY')
+        options = app.config['REPLICA_ENGINE_OPTIONS']
+        self.replicas = [
+            Replica(f'replica{i}', create_engine(url, **options))
+            for i, url in enumerate(app.config['DATABASE_REPLICA_URLS'])
+        ]
+        self._cycle = itertools.cycle(self.replicas)
+        self.replica_reads = 0
+        self.fallbacks = 0
+        self._register_listeners()
+        app.after_request(self._mark_sticky)
+        app.extensions['replica_router'] = self
+        if start is None:
+            start = not app.testing
+        if start and self.replicas:
+            self.start()
+
+    def dispose(self):
+        self.stop()
+        for replica in self.replicas:
+            replica.engine.dispose()
+        self.replicas = []
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    # ------------------------------------------------------------------
+    # Lag
+    # ------------------------------------------------------------------
+    def measure_lag(self, replica):
+        """Replication lag of a replica in seconds"""
+        sql = self.lag_query or (POSTGRES_LAG_SQL if replica.engine.dialect.name == 'postgresql' else 'SELECT 0')
+        with replica.engine.connect() as connection:
+            return float(connection.execute(text(sql)).scalar() or 0.0)
+
+    def check(self, replica):
+        """Measure a replica's lag and record whether it is usable"""
+        try:
+            lag = self.measure_lag(replica)
+        except Exception as e:
+            logger.warning('replica %s unavailable: %s', replica.name, e)
+            replica.lag, replica.error, replica.healthy = None, str(e), False
+        else:
+            replica.lag, replica.error, replica.healthy = lag, None, lag <= self.max_lag
+        replica.checked_at = time.monotonic()
+        return replica.healthy
+
+    def refresh(self):
+        """Check every replica; run by the lag check thread"""
+        for replica in self.replicas:
+            self.check(replica)
+
+    def usable(self, replica):
+        """Whether the last check found a replica usable, and is recent enough to go by"""
+        return (
+            replica.healthy
+            and replica.checked_at is not None
+            and time.monotonic() - replica.checked_at <= self.lag_stale_seconds
+        )
+
+    def engine_for_read(self):
+        """Next usable replica engine (round robin), or None to read from the primary"""
+        with self._lock:
+            candidates = [next(self._cycle) for _ in self.replicas]
+        for replica in candidates:
+            if self.usable(replica):
+                self.replica_reads += 1
+                return replica.engine
+        self.fallbacks += 1
+        return None
+
+    @property
+    def running(self):
+        """Whether the lag check thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='replica-lag', daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.stop)
+            self._atexit_registered = True
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('replica lag check failed')
+            if self._stopping.wait(self.lag_check_seconds):
+                return
+
+    # ------------------------------------------------------------------
+    # Read-after-write
+    # ------------------------------------------------------------------
+    def is_sticky(self):
+        """Whether the client of this request asked to read its own recent writes"""
+        try:
+            until = float(request.headers.get(STICKY_HEADER, ''))
+        except ValueError:
+            return False
+        # Nothing legitimate asks for longer than sticky_seconds from now
+        return time.time() < until <= time.time() + self.sticky_seconds
+
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        from database import db
+
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        self._listeners_registered = True
+
+    def _after_flush(self, session, flush_context):
+        session.info[WROTE_KEY] = True
+
+    def _after_commit(self, session):
+        if self.enabled and session.info.get(WROTE_KEY) and has_request_context():
+            g.replica_wrote = True
+
+    def read_primary(self):
+        """Pin this request's session to the primary, e.g. to build a response that will be cached"""
+        from database import db
+
+        db.session.info[PINNED_KEY] = None
+
+    def _mark_sticky(self, response):
+        if g.get('replica_wrote'):
+            # Truncated, not rounded: a time past now + sticky_seconds would be refused
+            until = int((time.time() + self.sticky_seconds) * 1000) / 1000
+            response.headers[STICKY_HEADER] = f'{until:.3f}'
+        return response
+
+    def stats(self):
+        return {
+            'replicas': [
+                {'name': r.name, 'healthy': r.healthy, 'lag_seconds': r.lag, 'error': r.error}
+                for r in self.replicas
+            ],
+            'replica_reads': self.replica_reads,
+            'fallbacks': self.fallbacks,
+        }
+
+
+replica_router = ReplicaRouter()
+
+
+def _routable(clause):
+    # Plain SELECTs only: no locking reads, no DML, no raw text
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """Session that sends SELECTs of @replica_reads views to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if isinstance(clause, UpdateBase):
+            # Core INSERT / UPDATE / DELETE: later reads in this session need to see it
+            self.info[WROTE_KEY] = True
+        elif (
+            bind is None
+            and self.info.get(USE_REPLICA_KEY)
+            and not self.info.get(WROTE_KEY)
+            and _routable(clause)
+        ):
+            # Chosen once per session; None pins it to the primary
+            if PINNED_KEY not in self.info:
+                self.info[PINNED_KEY] = replica_router.engine_for_read()
+            engine = self.info[PINNED_KEY]
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_reads(view):
+    """Serve a read-only view's queries from a replica (unless its client just wrote)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from database import db
+
+        if replica_router.enabled and not replica_router.is_sticky():
+            db.session.info[USE_REPLICA_KEY] = True
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,237 @@
+"""
+Daily revenue rollups for the admin revenue trend.
+
+Completed payments are summed per day of their created_at into the
+revenue_daily table by an after_flush hook, so marking a payment completed
+(or refunding, re-dating or deleting a completed one) moves the rollup in
+the same transaction. Like stat_counters, each flush writes to one random
+shard row per day and readers sum the shards.
+
+Series for any range are aggregated in SQL from the rollup, bucketed by
+day, week (starting Monday) or month with date_trunc on Postgres and the
+equivalent date() modifiers on SQLite. A periodic reconciliation rebuilds
+the rollup from the payments table and corrects drift.
+"""
+
+import logging
+import random
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Date, cast, event, func
+
+from database import db
+from models.payment import Payment
+from models.stats import RevenueDaily
+from utils.jobs import PeriodicTask
+from utils.stats import SHARDS, current_values, previous_values, upsert_increments
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('day', 'week', 'month')
+# Arbitrary key for the Postgres advisory lock that serialises reconciliations
+RECONCILE_LOCK_KEY = 4242011
+# Payment attributes the rollup depends on
+TRACKED_ATTRIBUTES = ('status', 'amount', 'created_at')
+
+
+def bucket_expr(column, granularity, dialect):
+    """SQL expression for the first day of the day/week/month containing column"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+    if dialect == 'postgresql':
+        return cast(func.date_trunc(granularity, column), Date)
+    if granularity == 'day':
+        return func.date(column)
+    if granularity == 'week':
+        # Forward to Sunday (or stay on it), then back to that week's Monday
+        return func.date(column, 'weekday 0', '-6 days')
+    return func.date(column, 'start of month')
+
+
+def bucket_start(day, granularity):
+    """Python counterpart of bucket_expr"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return day + timedelta(days=1)
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def _contribution(values):
+    """(day, amount) a payment with these values adds to the rollup, or None"""
+    if values['status'] != 'completed' or values['created_at'] is None:
+        return None
+    return values['created_at'].date(), float(values['amount'] or 0.0)
+
+
+def flush_revenue_deltas(session):
+    """{day: [amount, payment_count]} deltas implied by the payments being flushed"""
+    deltas = defaultdict(lambda: [0.0, 0])
+
+    def apply(contribution, sign):
+        if contribution:
+            day, amount = contribution
+            deltas[day][0] += sign * amount
+            deltas[day][1] += sign
+
+    for obj in session.new:
+        if isinstance(obj, Payment):
+            apply(_contribution(current_values(obj, TRACKED_ATTRIBUTES)), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Payment):
+            apply(_contribution(previous_values(obj, TRACKED_ATTRIBUTES)), -1)
+    for obj in session.dirty:
+        if isinstance(obj, Payment) and session.is_modified(obj, include_collections=False):
+            before = _contribution(previous_values(obj, TRACKED_ATTRIBUTES))
+            after = _contribution(current_values(obj, TRACKED_ATTRIBUTES))
+            if before != after:
+                apply(before, -1)
+                apply(after, 1)
+    return {day: (amount, count) for day, (amount, count) in deltas.items() if amount or count}
+
+
+class RevenueRollup:
+    """Keeps revenue_daily in step with completed payments and serves revenue series from it"""
+
+    def __init__(self, shards=SHARDS):
+        self.shards = shards
+        self._listeners_registered = False
+        self._reconciler = None
+
+    def init_app(self, app, reconcile_interval=None):
+        self._register_listeners()
+        if self._reconciler is not None:
+            self._reconciler.stop()
+            self._reconciler = None
+        if reconcile_interval and not app.testing:
+            self._reconciler = PeriodicTask(self.reconcile, reconcile_interval, name='revenue-reconcile')
+            self._reconciler.start()
+
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        event.listen(db.session, 'after_flush', self._after_flush)
+        for attr in TRACKED_ATTRIBUTES:
+            event.listen(getattr(Payment, attr), 'set', _noop_set, active_history=True)
+        self._listeners_registered = True
+
+    def _after_flush(self, session, flush_context):
+        deltas = flush_revenue_deltas(session)
+        if deltas:
+            self._upsert(session.connection(), deltas)
+
+    def _upsert(self, connection, deltas):
+        shard = random.randrange(self.shards)
+        now = datetime.utcnow()
+        rows = [
+            {'day': day, 'shard': shard, 'amount': amount, 'payment_count': count, 'updated_at': now}
+            for day, (amount, count) in sorted(deltas.items())
+        ]
+        upsert_increments(connection, RevenueDaily.__table__, ('day', 'shard'), rows)
+
+    def add(self, deltas):
+        """Apply {day: (amount, payment_count)} in the current transaction (for bulk SQL the hooks cannot see)"""
+        deltas = {day: delta for day, delta in deltas.items() if delta[0] or delta[1]}
+        if deltas:
+            self._upsert(db.session.connection(), deltas)
+
+    def series(self, start, end, granularity='month'):
+        """
+        Revenue per bucket for the days start..end (inclusive), zero-filled
+        Returns [{'start': date, 'amount': float, 'payment_count': int}]; the first
+        and last buckets only count the days inside the range.
+        """
+        bucket = bucket_expr(RevenueDaily.day, granularity, db.engine.dialect.name).label('bucket')
+        rows = db.session.query(
+            bucket, func.sum(RevenueDaily.amount), func.sum(RevenueDaily.payment_count)
+        ).filter(
+            RevenueDaily.day >= start,
+            RevenueDaily.day <= end
+        ).group_by(bucket).all()
+        totals = {_as_date(day): (float(amount or 0.0), int(count or 0)) for day, amount, count in rows}
+
+        series = []
+        cursor = bucket_start(start, granularity)
+        while cursor <= end:
+            amount, count = totals.get(cursor, (0.0, 0))
+            series.append({'start': cursor, 'amount': round(amount, 2), 'payment_count': count})
+            cursor = next_bucket(cursor, granularity)
+        return series
+
+    def read(self):
+        """{day: (amount, payment_count)} as stored"""
+        rows = db.session.query(
+            RevenueDaily.day, func.sum(RevenueDaily.amount), func.sum(RevenueDaily.payment_count)
+        ).group_by(RevenueDaily.day)
+        return {_as_date(day): (float(amount or 0.0), int(count or 0)) for day, amount, count in rows}
+
+    def recount(self):
+        """{day: (amount, payment_count)} recomputed from the payments table"""
+        day = bucket_expr(Payment.created_at, 'day', db.engine.dialect.name).label('day')
+        rows = db.session.query(day, func.sum(Payment.amount), func.count()).filter(
+            Payment.status == 'completed',
+            Payment.created_at.isnot(None)
+        ).group_by(day)
+        return {_as_date(day): (float(amount or 0.0), int(count)) for day, amount, count in rows}
+
+    def reconcile(self, fix=True):
+        """
+        Rebuild the rollup from payments and compare with what is stored
+        Returns {day: (amount, payment_count)} differences; with fix=True they are added back.
+        Runs in its own transaction: anything pending in the session is committed first.
+        """
+        db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+            locked = db.session.execute(
+                db.text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': RECONCILE_LOCK_KEY}
+            ).scalar()
+            if not locked:
+                db.session.rollback()
+                return {}
+
+        stored = self.read()
+        actual = self.recount()
+        drift = {}
+        for day in set(stored) | set(actual):
+            stored_amount, stored_count = stored.get(day, (0.0, 0))
+            actual_amount, actual_count = actual.get(day, (0.0, 0))
+            # Float sums differ in the last bits depending on addition order
+            amount = round(actual_amount - stored_amount, 2)
+            if amount or actual_count != stored_count:
+                drift[day] = (amount, actual_count - stored_count)
+        if drift:
+            logger.warning('revenue_daily drifted on %d days', len(drift))
+            if fix:
+                self.add(drift)
+        db.session.commit()
+        return drift
+
+    def ensure_initialized(self):
+        """Fill an empty revenue_daily table (new install or upgrade) from the payments table"""
+        if db.session.query(RevenueDaily.day).first() is None:
+            self.reconcile()
+
+
+def _noop_set(target, value, oldvalue, initiator):
+    return value
+
+
+revenue_rollup = RevenueRollup()
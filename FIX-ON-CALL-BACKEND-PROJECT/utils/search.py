@@ -0,0 +1,118 @@
+"""
+Token search for admin lookups.
+
+Searchable fields are folded into a maintained search_text column: lower-case
+alphanumeric words of the name and email, plus the phone number normalized to
+its international digits (0712 345 678, +254 712 345 678 and 712345678 are
+all stored as 254712345678). A query matches rows containing every query
+word as a word prefix, with phone-like words normalized the same way, so
+'0712' finds '+254712...'.
+
+Selective terms on Postgres are matched through a GIN index on
+to_tsvector('simple', search_text) with prefix tsquery terms, and the matches
+sorted. Common terms are cheaper to serve by walking the newest-first index
+with a plain LIKE filter until a page is full. The planner cannot estimate
+prefix matches, so search_is_selective() makes that call from the index's
+most-common-word statistics. SQLite (tests) always takes the LIKE path.
+"""
+
+import re
+import time
+
+from sqlalchemy import and_, false, func, literal_column, or_
+
+COUNTRY_CODE = '254'
+TSVECTOR_CONFIG = 'simple'
+USER_SEARCH_INDEX = 'idx_users_search'
+
+# Below this estimated share of matching rows, fetching the matches through the search
+# index and sorting them beats walking the newest-first index until a page is filled
+SELECTIVE_MATCH_FRACTION = 0.002
+COMMON_WORDS_TTL_SECONDS = 600
+
+_common_words_cache = {}
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def normalize_phone(value):
+    """International digits for a (possibly partial) phone number, e.g. '0712 345' -> '254712345'"""
+    digits = re.sub(r'\D', '', value or '')
+    if not digits:
+        return ''
+    if digits.startswith(COUNTRY_CODE):
+        return digits
+    if digits.startswith('0'):
+        return COUNTRY_CODE + digits[1:]
+    if digits[0] in '17':
+        # Local number typed without its leading 0
+        return COUNTRY_CODE + digits
+    return digits
+
+
+def search_words(value):
+    return _WORD.findall((value or '').lower())
+
+
+def search_text_for(name, email, phone):
+    """search_text column value for a user"""
+    words = search_words(name) + search_words(email)
+    phone = normalize_phone(phone)
+    if phone:
+        words.append(phone)
+    return ' '.join(dict.fromkeys(words))
+
+
+def query_words(term):
+    """Words of a search term; a term that looks like a phone number becomes one normalized word"""
+    if re.fullmatch(r'[\d\s()+-]+', term or '') and sum(c.isdigit() for c in term) >= 3:
+        return [normalize_phone(term)]
+    return [normalize_phone(word) if word.isdigit() else word for word in search_words(term)]
+
+
+def search_clause(column, term, indexed=False):
+    """
+    Filter matching rows whose search_text column contains every word of term as a word prefix
+    indexed: match through the Postgres GIN index instead of a per-row LIKE
+    """
+    words = query_words(term)
+    if not words:
+        return false()
+    if indexed:
+        # Words are [^\W_]+ only, so they are safe tsquery operands
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        # Literals, not parameters, so the expression matches the index definition
+        document = func.to_tsvector(literal_column(f"'{TSVECTOR_CONFIG}'"), func.coalesce(column, literal_column("''")))
+        return document.op('@@')(func.to_tsquery(TSVECTOR_CONFIG, tsquery))
+    return and_(*(
+        or_(column.like(f'{word}%'), column.like(f'% {word}%'))
+        for word in words
+    ))
+
+
+def common_word_frequencies(index_name):
+    """{word: share of rows} for the most common words in a search index, from Postgres statistics"""
+    from database import db
+
+    cached = _common_words_cache.get(index_name)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    row = db.session.execute(db.text(
+        'SELECT most_common_elems::text::text[], most_common_elem_freqs FROM pg_stats WHERE tablename = :index'
+    ), {'index': index_name}).first()
+    # The frequency array ends with min, max and null fraction: zip stops before them
+    frequencies = dict(zip(row[0], row[1])) if row and row[0] else {}
+    _common_words_cache[index_name] = (time.monotonic() + COMMON_WORDS_TTL_SECONDS, frequencies)
+    return frequencies
+
+
+def search_is_selective(term, dialect, index_name=USER_SEARCH_INDEX):
+    """Whether term is expected to match few enough rows that sorting its matches is the cheaper plan"""
+    if dialect != 'postgresql':
+        return False
+    frequencies = common_word_frequencies(index_name)
+    fraction = 1.0
+    for word in query_words(term):
+        # A word missing from the statistics is rarer than every common word
+        fraction *= min(1.0, sum(freq for common, freq in frequencies.items() if common.startswith(word)))
+    return fraction < SELECTIVE_MATCH_FRACTION
@@ -0,0 +1,45 @@
+"""
+Follow-up work for a new service request.
+
+POST /api/services/request writes the service (and its emergency alert)
+in one transaction and answers with the nearby mechanics from the spatial
+index. A client that sends Prefer: respond-async gets its answer before
+the lookup, which then runs on the background job queue; the job result is
+what GET /api/services/<id>/nearby-mechanics serves.
+"""
+
+from database import db
+from models.service import Service
+from models.user import User
+from utils.jobs import job_queue
+from utils.mechanic_lookup import find_nearby_mechanics
+
+NEARBY_RADIUS_KM = 10
+NEARBY_LIMIT = 5
+
+
+def nearby_job_id(service_id):
+    return f'service-request-{service_id}'
+
+
+def nearby_mechanics_for(location, radius_km=NEARBY_RADIUS_KM, limit=NEARBY_LIMIT):
+    """Closest available mechanics to a service location, any available ones if it has no coordinates"""
+    latitude = (location or {}).get('latitude')
+    longitude = (location or {}).get('longitude')
+    if latitude and longitude:
+        return find_nearby_mechanics(float(latitude), float(longitude), radius_km, limit=limit)
+    mechanics = User.query.filter_by(user_type='mechanic', is_available=True, is_active=True).limit(limit).all()
+    return [m.to_dict() for m in mechanics]
+
+
+def process_service_request(service_id):
+    """Background job: look up the mechanics near a new service"""
+    service = db.session.get(Service, service_id)
+    if service is None:
+        return {'service_id': service_id, 'nearby_mechanics': []}
+    return {'service_id': service_id, 'nearby_mechanics': nearby_mechanics_for(service.location)}
+
+
+def enqueue_service_request(service_id):
+    """Schedule the follow-up work for a committed service; returns the job id"""
+    return job_queue.submit(process_service_request, service_id, job_id=nearby_job_id(service_id))
@@ -0,0 +1,170 @@
+"""
+A local SMTP sink for development, tests and benchmarks.
+
+Speaks just enough SMTP for smtplib (no TLS, no AUTH) and keeps every
+message it accepts in memory instead of delivering it. Recipients can be
+set to be refused, permanently (550) or temporarily (451), to exercise
+retries and dead-lettering.
+
+    python -m utils.smtp_sink [--port 1025]
+
+then point MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=False at it.
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+from collections import namedtuple
+
+SinkMessage = namedtuple('SinkMessage', 'mail_from recipients data connection')
+
+
+class _Session(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        sink = self.server.sink
+        connection = sink._opened()
+        if sink.greeting_delay:
+            time.sleep(sink.greeting_delay)
+        self.reply('220 fixoncall-sink ready')
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 fixoncall-sink')
+            elif verb == 'MAIL':
+                mail_from, recipients = _address(command), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = _address(command)
+                refusal = sink.refused.get(recipient)
+                if refusal:
+                    self.reply(refusal)
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = self._read_data()
+                if data is None:
+                    return
+                sink._accept(SinkMessage(mail_from, recipients, data, connection))
+                mail_from, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                mail_from, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            if line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+
+def _address(command):
+    _, _, argument = command.partition(':')
+    return argument.strip().split(' ')[0].strip('<>')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """Threaded SMTP server on localhost that records the messages it accepts"""
+
+    def __init__(self, host='127.0.0.1', port=0, greeting_delay=0.0):
+        self._server = _Server((host, port), _Session)
+        self._server.sink = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self.messages = []
+        self.connections = 0
+        # recipient -> SMTP reply to RCPT TO, e.g. '550 No such user'
+        self.refused = {}
+        # Seconds before the greeting, standing in for a remote server's connect / TLS / login round trips
+        self.greeting_delay = greeting_delay
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def refuse(self, recipient, reply='550 No such user'):
+        self.refused[recipient] = reply
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _opened(self):
+        with self._lock:
+            self.connections += 1
+            return self.connections
+
+    def _accept(self, message):
+        with self._lock:
+            self.messages.append(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink: accepts and prints every message')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port)
+    accepted = sink._accept
+
+    def show(message):
+        accepted(message)
+        print(f'--- connection {message.connection}: {message.mail_from} -> {", ".join(message.recipients)}')
+        print(message.data.decode(errors='replace'))
+
+    sink._accept = show
+    print(f'SMTP sink listening on {sink.host}:{sink.port}')
+    try:
+        sink._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+In-process spatial index of available mechanics.
+
+Mechanics are bucketed into a uniform latitude/longitude grid so that
+nearby lookups only visit the cells overlapping the search radius instead
+of hydrating and scanning every mechanic row. The index is per process:
+it is loaded lazily from the database, kept current from committed ORM
+changes to ``User`` and periodically rebuilt to pick up writes made by
+other workers.
+"""
+
+import math
+import threading
+import time
+
+from sqlalchemy import event, inspect
+
+from utils.geolocation import KM_PER_DEGREE, batch_distances, bounding_box
+
+MAX_SEARCH_RADIUS_KM = 20037.5  # half the Earth's circumference
+
+# User attributes that decide whether / where a mechanic is indexed
+TRACKED_ATTRIBUTES = ('user_type', 'is_active', 'is_available', 'lat', 'lon', 'specialization')
+
+
+class MechanicIndex:
+    """Uniform grid index over available mechanic positions"""
+
+    def __init__(self, cell_size_km=2.0, refresh_seconds=300):
+        self.cell_size_km = cell_size_km
+        self.refresh_seconds = refresh_seconds
+        self._cell_deg = cell_size_km / KM_PER_DEGREE
+        self._cells = {}    # (row, col) -> {mechanic_id: (lat, lon)}
+        self._entries = {}  # mechanic_id -> (lat, lon, cell, specialization)
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._listeners_registered = False
+
+    def init_app(self, app):
+        self.cell_size_km = app.config.get('MECHANIC_INDEX_CELL_KM', self.cell_size_km)
+        self.refresh_seconds = app.config.get('MECHANIC_INDEX_REFRESH_SECONDS', self.refresh_seconds)
+        self._cell_deg = self.cell_size_km / KM_PER_DEGREE
+        self.clear()
+        self._register_listeners()
+        app.extensions['mechanic_index'] = self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, mechanic_id):
+        return mechanic_id in self._entries
+
+    # ------------------------------------------------------------------
+    # Mutation
+    # ------------------------------------------------------------------
+    def _cell_for(self, latitude, longitude):
+        return (math.floor(latitude / self._cell_deg), math.floor(longitude / self._cell_deg))
+
+    def upsert(self, mechanic_id, latitude, longitude, specialization=None):
+        cell = self._cell_for(latitude, longitude)
+        specs = frozenset(specialization or ())
+        with self._lock:
+            previous = self._entries.get(mechanic_id)
+            if previous and previous[2] != cell:
+                self._discard_from_cell(mechanic_id, previous[2])
+            self._cells.setdefault(cell, {})[mechanic_id] = (latitude, longitude)
+            self._entries[mechanic_id] = (latitude, longitude, cell, specs)
+
+    def move(self, mechanic_id, latitude, longitude):
+        """Update the position of an indexed mechanic, keeping its attributes"""
+        with self._lock:
+            previous = self._entries.get(mechanic_id)
+            if previous is None:
+                return False
+            self.upsert(mechanic_id, latitude, longitude, previous[3])
+            return True
+
+    def remove(self, mechanic_id):
+        with self._lock:
+            previous = self._entries.pop(mechanic_id, None)
+            if previous:
+                self._discard_from_cell(mechanic_id, previous[2])
+
+    def _discard_from_cell(self, mechanic_id, cell):
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(mechanic_id, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def apply(self, mechanic_id, indexable, position=None, specialization=None):
+        """Insert, move or drop a mechanic depending on its current state"""
+        if indexable and position:
+            self.upsert(mechanic_id, position[0], position[1], specialization)
+        else:
+            self.remove(mechanic_id)
+
+    def clear(self):
+        with self._lock:
+            self._cells = {}
+            self._entries = {}
+            self._loaded_at = None
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+    def rebuild(self, rows):
+        """Replace the index contents from (id, lat, lon, specialization) rows"""
+        cells = {}
+        entries = {}
+        for mechanic_id, latitude, longitude, specialization in rows:
+            if latitude is None or longitude is None:
+                continue
+            cell = self._cell_for(latitude, longitude)
+            cells.setdefault(cell, {})[mechanic_id] = (latitude, longitude)
+            entries[mechanic_id] = (latitude, longitude, cell, frozenset(specialization or ()))
+        with self._lock:
+            self._cells = cells
+            self._entries = entries
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self):
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    def ensure_loaded(self):
+        """Load available mechanics from the database if empty or stale"""
+        if not self.is_stale():
+            return
+        from models.user import User
+
+        rows = User.query.with_entities(
+            User.id, User.lat, User.lon, User.specialization
+        ).filter_by(user_type='mechanic', is_available=True, is_active=True).filter(
+            User.lat.isnot(None), User.lon.isnot(None)
+        ).all()
+        self.rebuild(rows)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def _candidate_cells(self, latitude, longitude, radius_km):
+        min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+        row_min, col_min = self._cell_for(min_lat, min_lon)
+        row_max, col_max = self._cell_for(max_lat, max_lon)
+        window = (row_max - row_min + 1) * (col_max - col_min + 1)
+        if window >= len(self._cells):
+            return list(self._cells.values())
+        cells = []
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                bucket = self._cells.get((row, col))
+                if bucket:
+                    cells.append(bucket)
+        return cells
+
+    def radius_search(self, latitude, longitude, radius_km, specialization=None, limit=None):
+        """Return [(mechanic_id, distance_km)] within radius, nearest first"""
+        with self._lock:
+            buckets = self._candidate_cells(latitude, longitude, radius_km)
+            entries = self._entries
+            ids, latitudes, longitudes = [], [], []
+            for bucket in buckets:
+                for mechanic_id, (lat, lon) in bucket.items():
+                    if specialization and specialization not in entries[mechanic_id][3]:
+                        continue
+                    ids.append(mechanic_id)
+                    latitudes.append(lat)
+                    longitudes.append(lon)
+        if not ids:
+            return []
+        result = batch_distances(latitude, longitude, latitudes, longitudes, radius_km=radius_km, k=limit)
+        return [(ids[i], float(result.distances[i])) for i in result.nearest]
+
+    def nearest(self, latitude, longitude, k, max_radius_km=None, specialization=None):
+        """Return the k nearest mechanics, optionally bounded by max_radius_km"""
+        limit_km = min(max_radius_km or MAX_SEARCH_RADIUS_KM, MAX_SEARCH_RADIUS_KM)
+        radius_km = min(self.cell_size_km, limit_km)
+        while True:
+            hits = self.radius_search(latitude, longitude, radius_km, specialization)
+            # Everything within radius_km is found, so the first k hits are exact
+            if len(hits) >= k or radius_km >= limit_km:
+                return hits[:k]
+            radius_km = min(radius_km * 2, limit_km)
+
+    # ------------------------------------------------------------------
+    # ORM synchronisation
+    # ------------------------------------------------------------------
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        from database import db
+
+        event.listen(db.session, 'after_flush', self._collect_changes)
+        event.listen(db.session, 'after_commit', self._apply_changes)
+        event.listen(db.session, 'after_rollback', self._discard_changes)
+        self._listeners_registered = True
+
+    def _collect_changes(self, session, flush_context):
+        from models.user import User
+
+        pending = session.info.setdefault('mechanic_index_pending', {})
+        for obj in session.new:
+            if isinstance(obj, User):
+                pending[obj.id] = _snapshot(obj)
+        for obj in session.dirty:
+            if isinstance(obj, User) and _tracked_changes(obj):
+                pending[obj.id] = _snapshot(obj)
+        for obj in session.deleted:
+            if isinstance(obj, User):
+                pending[obj.id] = (False, None, None)
+
+    def _apply_changes(self, session):
+        pending = session.info.pop('mechanic_index_pending', None)
+        if not pending or self._loaded_at is None:
+            return
+        for mechanic_id, (indexable, position, specialization) in pending.items():
+            self.apply(mechanic_id, indexable, position, specialization)
+
+    def _discard_changes(self, session):
+        session.info.pop('mechanic_index_pending', None)
+
+
+def _tracked_changes(user):
+    state = inspect(user)
+    return any(state.attrs[name].history.has_changes() for name in TRACKED_ATTRIBUTES)
+
+
+def _snapshot(user):
+    indexable = user.user_type == 'mechanic' and bool(user.is_active) and bool(user.is_available)
+    position = (user.lat, user.lon) if user.lat is not None and user.lon is not None else None
+    return indexable, position, user.specialization
+
+
+mechanic_index = MechanicIndex()
@@ -0,0 +1,262 @@
+"""
+Materialized counters for the admin dashboard.
+
+Counts of users, services, payments and approved partner applications are
+kept in the stat_counters table instead of being recounted on every page
+view. An after_flush hook turns the inserts, deletes and tracked attribute
+changes of each flush into counter deltas and upserts them in the same
+transaction, so a rolled-back request never moves a counter. Each counter
+is split over a few shard rows picked at random per flush, which keeps
+concurrent writers from queueing on a single hot row; readers sum them.
+
+Bulk UPDATEs bypass the ORM and must report their effect with add().
+A periodic reconciliation recounts everything from the source tables,
+reports drift and corrects it.
+"""
+
+import logging
+import random
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import db
+from models.payment import Payment
+from models.service import Service
+from models.stats import StatCounter
+from models.support import SupportConversation, SupportConversationArchive, SupportConversationTag
+from models.user import User
+from utils.jobs import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+SHARDS = 8
+# Arbitrary key for the Postgres advisory lock that serialises reconciliations
+RECONCILE_LOCK_KEY = 4242010
+
+ACTIVE_SERVICE_STATUSES = ('pending', 'accepted', 'confirmed', 'dispatched', 'arrived', 'in_progress', 'in_service')
+
+
+def partner_application_approved(channel, tags):
+    return channel == 'partner_application' and any(
+        tag.strip().lower() == 'approved' for tag in (tags or '').split(',')
+    )
+
+
+def _user_keys(v):
+    return ('users', f"users:type:{v['user_type']}")
+
+
+def _service_keys(v):
+    return ('services', f"services:status:{v['status']}", f"services:type:{v['service_type']}")
+
+
+def _payment_keys(v):
+    return ('payments', f"payments:status:{v['status']}")
+
+
+def _partner_application_keys(v):
+    return ('partner_applications:approved',) if partner_application_approved(v['channel'], v['tags']) else ()
+
+
+# model -> (attributes the counters depend on, counter names for a row with those values)
+TRACKED_MODELS = {
+    User: (('user_type',), _user_keys),
+    Service: (('status', 'service_type'), _service_keys),
+    Payment: (('status',), _payment_keys),
+    SupportConversation: (('channel', 'tags'), _partner_application_keys),
+}
+
+
+def current_values(obj, attributes):
+    return {attr: getattr(obj, attr) for attr in attributes}
+
+
+def previous_values(obj, attributes):
+    state = inspect(obj)
+    values = {}
+    for attr in attributes:
+        history = state.attrs[attr].history
+        if history.deleted:
+            values[attr] = history.deleted[0]
+        elif history.unchanged:
+            values[attr] = history.unchanged[0]
+        else:
+            values[attr] = getattr(obj, attr)
+    return values
+
+
+def flush_deltas(session):
+    """Counter deltas implied by the objects being flushed"""
+    deltas = Counter()
+    for obj in session.new:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked:
+            deltas.update(tracked[1](current_values(obj, tracked[0])))
+    for obj in session.deleted:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked:
+            deltas.subtract(tracked[1](previous_values(obj, tracked[0])))
+    for obj in session.dirty:
+        tracked = TRACKED_MODELS.get(type(obj))
+        if tracked and session.is_modified(obj, include_collections=False):
+            before = tracked[1](previous_values(obj, tracked[0]))
+            after = tracked[1](current_values(obj, tracked[0]))
+            if before != after:
+                deltas.subtract(before)
+                deltas.update(after)
+    return {name: delta for name, delta in deltas.items() if delta}
+
+
+def upsert_increments(connection, table, key_columns, rows):
+    """
+    Insert rows, or add their value columns onto the existing rows with the same key
+    Every column outside key_columns and updated_at is treated as an increment.
+    """
+    increments = [name for name in rows[0] if name not in key_columns and name != 'updated_at']
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        set_ = {name: table.c[name] + insert.excluded[name] for name in increments}
+        set_['updated_at'] = insert.excluded.updated_at
+        connection.execute(insert.values(rows).on_conflict_do_update(
+            index_elements=[table.c[name] for name in key_columns], set_=set_
+        ))
+        return
+    for row in rows:
+        result = connection.execute(
+            table.update()
+            .where(*(table.c[name] == row[name] for name in key_columns))
+            .values(updated_at=row['updated_at'], **{name: table.c[name] + row[name] for name in increments})
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(row))
+
+
+def _upsert(connection, deltas, shard):
+    now = datetime.utcnow()
+    # Sorted so concurrent writers lock rows in the same order
+    rows = [{'name': name, 'shard': shard, 'value': delta, 'updated_at': now} for name, delta in sorted(deltas.items())]
+    upsert_increments(connection, StatCounter.__table__, ('name', 'shard'), rows)
+
+
+class StatCounters:
+    """Keeps stat_counters in step with the ORM and reconciles it periodically"""
+
+    def __init__(self, shards=SHARDS):
+        self.shards = shards
+        self._listeners_registered = False
+        self._reconciler = None
+
+    def init_app(self, app, reconcile_interval=None):
+        self._register_listeners()
+        if self._reconciler is not None:
+            self._reconciler.stop()
+            self._reconciler = None
+        if reconcile_interval and not app.testing:
+            self._reconciler = PeriodicTask(self.reconcile, reconcile_interval, name='stats-reconcile')
+            self._reconciler.start()
+
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        event.listen(db.session, 'after_flush', self._after_flush)
+        # Load the previous value when a tracked attribute is assigned, even if it
+        # was expired, so a status change can be taken off the old status counter
+        for model, (attributes, _) in TRACKED_MODELS.items():
+            for attr in attributes:
+                event.listen(getattr(model, attr), 'set', _noop_set, active_history=True)
+        self._listeners_registered = True
+
+    def _after_flush(self, session, flush_context):
+        deltas = flush_deltas(session)
+        if deltas:
+            _upsert(session.connection(), deltas, random.randrange(self.shards))
+
+    def add(self, deltas):
+        """Apply counter deltas in the current transaction (for bulk SQL the hooks cannot see)"""
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if deltas:
+            _upsert(db.session.connection(), deltas, random.randrange(self.shards))
+
+    def read(self, prefix=None):
+        """{counter name: value}, optionally only names starting with prefix"""
+        query = db.session.query(StatCounter.name, func.sum(StatCounter.value)).group_by(StatCounter.name)
+        if prefix:
+            query = query.filter(StatCounter.name.startswith(prefix))
+        return {name: int(value) for name, value in query.all()}
+
+    def recount(self):
+        """Every counter recomputed from the source tables"""
+        actual = Counter()
+        for user_type, count in db.session.query(User.user_type, func.count()).group_by(User.user_type):
+            for name in _user_keys({'user_type': user_type}):
+                actual[name] += count
+        for status, service_type, count in db.session.query(
+            Service.status, Service.service_type, func.count()
+        ).group_by(Service.status, Service.service_type):
+            for name in _service_keys({'status': status, 'service_type': service_type}):
+                actual[name] += count
+        for status, count in db.session.query(Payment.status, func.count()).group_by(Payment.status):
+            for name in _payment_keys({'status': status}):
+                actual[name] += count
+        actual['partner_applications:approved'] += db.session.query(func.count()).select_from(
+            SupportConversationTag
+        ).join(SupportConversation).filter(
+            SupportConversation.channel == 'partner_application',
+            SupportConversationTag.tag == 'approved'
+        ).scalar()
+        # Archived applications still count (their tags are only in the tags column)
+        actual['partner_applications:approved'] += sum(
+            1 for channel, tags in db.session.query(
+                SupportConversationArchive.channel, SupportConversationArchive.tags
+            ).filter(SupportConversationArchive.channel == 'partner_application')
+            if partner_application_approved(channel, tags)
+        )
+        return actual
+
+    def reconcile(self, fix=True):
+        """
+        Recount from scratch and compare with the stored counters
+        Returns {name: actual - stored} for every drifting counter; with fix=True the
+        difference is added back, which stays correct while other writers commit.
+        Runs in its own transaction: anything pending in the session is committed first.
+        """
+        db.session.commit()
+        if db.engine.dialect.name == 'postgresql':
+            # Counters and source rows read from one snapshot; one reconciler at a time
+            db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+            locked = db.session.execute(
+                db.text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': RECONCILE_LOCK_KEY}
+            ).scalar()
+            if not locked:
+                db.session.rollback()
+                return {}
+
+        stored = self.read()
+        actual = self.recount()
+        drift = {
+            name: actual.get(name, 0) - stored.get(name, 0)
+            for name in set(stored) | set(actual)
+            if actual.get(name, 0) != stored.get(name, 0)
+        }
+        if drift:
+            logger.warning('stat_counters drifted on %d counters: %s', len(drift), drift)
+            if fix:
+                self.add(drift)
+        db.session.commit()
+        return drift
+
+    def ensure_initialized(self):
+        """Fill an empty stat_counters table (new install or upgrade) from the source tables"""
+        if db.session.query(StatCounter.name).first() is None:
+            self.reconcile()
+
+
+def _noop_set(target, value, oldvalue, initiator):
+    return value
+
+
+stat_counters = StatCounters()
@@ -0,0 +1,94 @@
+"""
+Server-sent event responses fed by broker subscriptions, and the
+WebSocket extension for two-way streams (support chat).
+
+EventSource cannot set headers, so a browser opens a stream with a stream
+ticket in the URL instead of its access token: POST /api/auth/stream-ticket
+returns a token that expires after STREAM_TICKET_SECONDS and that only
+@stream_jwt_required views accept, passed as ?ticket=<ticket>. An access
+token is never taken from the URL, where proxies and logs would keep it.
+"""
+
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from flask import Response, current_app, g, jsonify, stream_with_context
+from flask_jwt_extended import (
+    create_access_token, get_jwt, get_jwt_identity, get_jwt_request_location, verify_jwt_in_request,
+)
+from flask_sock import Sock
+
+RECONNECT_MS = 3000
+STREAM_TICKET_SCOPE = 'stream'
+
+sock = Sock()
+
+
+def create_stream_ticket():
+    """A stream ticket for the user of the current access token"""
+    claims = {key: value for key, value in get_jwt().items() if key in ('role', 'active')}
+    return create_access_token(
+        identity=get_jwt_identity(),
+        additional_claims={**claims, 'scope': STREAM_TICKET_SCOPE},
+        expires_delta=timedelta(seconds=current_app.config['STREAM_TICKET_SECONDS']),
+    )
+
+
+def stream_tickets_only_open_streams(jwt_header, jwt_data):
+    """JWT verification hook: a stream ticket is refused outside @stream_jwt_required views"""
+    return jwt_data.get('scope') != STREAM_TICKET_SCOPE or g.get('stream_view', False)
+
+
+def stream_jwt_required(view):
+    """jwt_required() for event streams: an access token in the header, or a stream ticket in ?ticket="""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.stream_view = True
+        verify_jwt_in_request(locations=['headers', 'query_string'])
+        if get_jwt_request_location() == 'query_string' and get_jwt().get('scope') != STREAM_TICKET_SCOPE:
+            return jsonify({'success': False, 'error': 'Open streams with a stream ticket, not an access token'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def sse_response(subscription, initial=(), until=None):
+    """
+    Stream a broker subscription as text/event-stream
+    initial: messages sent first, e.g. the current state
+    until: predicate on a message; the stream ends after the first match
+    Subscribe before reading any state sent in `initial`, so no update is missed.
+    """
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    max_seconds = current_app.config['SSE_MAX_STREAM_SECONDS']
+
+    def events():
+        with subscription:
+            yield f'retry: {RECONNECT_MS}\n\n'
+            for message in initial:
+                yield sse_event(message['event'], message['data'])
+                if until is not None and until(message):
+                    return
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                item = subscription.get(timeout=heartbeat)
+                if item is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                _, message = item
+                yield sse_event(message['event'], message['data'])
+                if until is not None and until(message):
+                    return
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Also covers clients that disconnect before the generator first runs
+    response.call_on_close(subscription.close)
+    return response
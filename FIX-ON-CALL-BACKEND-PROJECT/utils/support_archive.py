@@ -0,0 +1,191 @@
+"""
+Archival of closed support conversations.
+
+Conversations closed (closed_at) more than SUPPORT_ARCHIVE_AFTER_DAYS ago
+are moved with their messages from the hot tables into
+support_conversations_archive and support_messages_archive, so the inbox,
+its indexes and the search index only carry live threads.
+
+Each batch is one transaction: INSERT ... SELECT into the archive, then
+DELETE from the hot tables (tag links and search documents included).
+Candidates are read in id order, on Postgres with FOR UPDATE SKIP LOCKED,
+so a conversation a request is writing to is skipped rather than waited
+for, and one reopened before its batch is no longer a candidate. A run
+keeps no bookkeeping: an interrupted batch rolls back whole and the next
+run carries on with whatever is still eligible. After every batch the
+archiver sleeps in proportion to the time the batch took, which caps its
+share of the database at SUPPORT_ARCHIVE_DUTY_CYCLE.
+
+The archive is searched on demand with substring matching; it is not
+full-text indexed, being read rarely.
+"""
+
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, delete, exists, insert, literal, or_, select
+
+from database import db
+from models.support import (
+    CLOSED_STATUSES, SupportConversation, SupportConversationArchive, SupportConversationTag, SupportMessage,
+    SupportMessageArchive
+)
+from utils.cache import response_cache
+from utils.jobs import PeriodicTask
+from utils.support_search import delete_documents
+
+logger = logging.getLogger(__name__)
+
+HOT_TABLES = ('support_conversations', 'support_messages', 'support_conversation_tags')
+ARCHIVE_TABLES = ('support_conversations_archive', 'support_messages_archive')
+
+
+def table_sizes(tables=HOT_TABLES + ARCHIVE_TABLES):
+    """{table: {'rows': exact row count, 'bytes': size with indexes, None where unknown}}"""
+    connection = db.session.connection()
+    sizes = {}
+    for table in tables:
+        rows = connection.execute(select(db.func.count()).select_from(db.table(table))).scalar()
+        size = None
+        if connection.dialect.name == 'postgresql':
+            size = connection.execute(
+                db.text('SELECT pg_total_relation_size(CAST(:table AS regclass))'), {'table': table}
+            ).scalar()
+        elif connection.dialect.name == 'sqlite':
+            try:
+                with connection.begin_nested():
+                    size = connection.execute(db.text(
+                        'SELECT sum(pgsize) FROM dbstat WHERE name IN '
+                        '(SELECT name FROM sqlite_master WHERE tbl_name = :table)'
+                    ), {'table': table}).scalar()
+            except Exception:
+                # SQLite built without the dbstat table
+                size = None
+        sizes[table] = {'rows': rows, 'bytes': size}
+    return sizes
+
+
+def _candidate_ids(cutoff, after_id, batch_size):
+    query = select(SupportConversation.id).where(
+        SupportConversation.status.in_(CLOSED_STATUSES),
+        SupportConversation.closed_at < cutoff,
+        SupportConversation.id > after_id,
+    ).order_by(SupportConversation.id).limit(batch_size)
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    return db.session.scalars(query).all()
+
+
+def _archive_batch(ids, now):
+    """Move conversations ids and their messages in the current transaction; returns the message count"""
+    conversations = SupportConversation.__table__
+    messages = SupportMessage.__table__
+    conversation_columns = [column.name for column in conversations.columns]
+    message_columns = [column.name for column in messages.columns]
+
+    db.session.execute(insert(SupportConversationArchive.__table__).from_select(
+        conversation_columns + ['archived_at'],
+        select(*conversations.c, literal(now, DateTime)).where(conversations.c.id.in_(ids)),
+    ))
+    db.session.execute(insert(SupportMessageArchive.__table__).from_select(
+        message_columns,
+        select(*messages.c).where(messages.c.conversation_id.in_(ids)),
+    ))
+    delete_documents(db.session.connection(), ids)
+    # Core deletes: the flush hooks (counters, search) are not involved
+    db.session.execute(delete(SupportConversationTag.__table__).where(
+        SupportConversationTag.__table__.c.conversation_id.in_(ids)
+    ))
+    # The DELETE's row count is reliable on every driver, unlike INSERT ... SELECT's
+    moved = db.session.execute(delete(messages).where(messages.c.conversation_id.in_(ids))).rowcount
+    db.session.execute(delete(conversations).where(conversations.c.id.in_(ids)))
+    return moved
+
+
+class SupportArchiver:
+    """Moves old closed conversations to the archive tables, on demand or periodically"""
+
+    def __init__(self):
+        self.after_days = 90
+        self.batch_size = 500
+        self.duty_cycle = 0.5
+        self._task = None
+
+    def init_app(self, app):
+        self.after_days = app.config['SUPPORT_ARCHIVE_AFTER_DAYS']
+        self.batch_size = app.config['SUPPORT_ARCHIVE_BATCH_SIZE']
+        self.duty_cycle = app.config['SUPPORT_ARCHIVE_DUTY_CYCLE']
+        if self._task is not None:
+            self._task.stop()
+            self._task = None
+        interval = app.config['SUPPORT_ARCHIVE_INTERVAL_SECONDS']
+        if interval and not app.testing:
+            self._task = PeriodicTask(self.run, interval, name='support-archive')
+            self._task.start()
+
+    def run(self, older_than_days=None, batch_size=None, max_batches=None, max_seconds=None, after_id=0,
+            duty_cycle=None):
+        """
+        Archive eligible conversations in batches until none are left or a limit is hit
+        Returns a report with the counts moved, last_id (pass it as after_id to
+        continue past skipped rows), whether the run finished, and the table
+        sizes before and after.
+        """
+        older_than_days = self.after_days if older_than_days is None else older_than_days
+        batch_size = batch_size or self.batch_size
+        duty_cycle = min(max(duty_cycle or self.duty_cycle, 0.01), 1.0)
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+        before = table_sizes()
+        db.session.commit()
+        report = {'conversations': 0, 'messages': 0, 'batches': 0, 'last_id': after_id, 'finished': False}
+        started = time.monotonic()
+        while True:
+            if max_batches is not None and report['batches'] >= max_batches:
+                break
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                break
+            batch_started = time.monotonic()
+            ids = _candidate_ids(cutoff, report['last_id'], batch_size)
+            if not ids:
+                db.session.rollback()
+                report['finished'] = True
+                break
+            report['messages'] += _archive_batch(ids, datetime.utcnow())
+            db.session.commit()
+            report['conversations'] += len(ids)
+            report['batches'] += 1
+            report['last_id'] = ids[-1]
+            # Throttle: idle long enough that the batches take duty_cycle of the time
+            time.sleep((time.monotonic() - batch_started) * (1 - duty_cycle) / duty_cycle)
+
+        if report['conversations']:
+            response_cache.invalidate('support')
+        report['elapsed_seconds'] = round(time.monotonic() - started, 3)
+        report['sizes'] = {'before': before, 'after': table_sizes()}
+        db.session.commit()
+        logger.info(
+            'Archived %d support conversations (%d messages) in %d batches',
+            report['conversations'], report['messages'], report['batches']
+        )
+        return report
+
+
+support_archiver = SupportArchiver()
+
+
+def search_archive(term):
+    """Query of archived conversations whose header fields or any message contain term"""
+    query = SupportConversationArchive.query
+    if term:
+        query = query.filter(or_(
+            *(getattr(SupportConversationArchive, name).icontains(term, autoescape=True) for name in (
+                'customer_name', 'customer_email', 'customer_phone', 'request_id'
+            )),
+            exists().where(
+                SupportMessageArchive.conversation_id == SupportConversationArchive.id,
+                SupportMessageArchive.body.icontains(term, autoescape=True),
+            ),
+        ))
+    return query
@@ -0,0 +1,241 @@
+"""
+Support chat messages: incremental reads and micro-batched writes.
+
+Chat views page through a conversation by message id instead of
+re-downloading its history: ?after_id=<last id seen> returns what arrived
+since, ?before_id=<oldest id shown> the page before it, both read from the
+(conversation_id, id) index. Ids rather than timestamps are the cursor, so
+a poll never skips a message that was stamped earlier but committed later.
+
+A poll with ?wait=<seconds> and nothing new blocks until a new message is
+published on the conversation's broker channel (from any worker, through
+the broker backend) or the wait runs out. It subscribes before reading, so
+a message committed in between is not missed, and holds no database
+connection while it waits.
+
+New messages, from the REST endpoint or a chat socket, are queued in
+message_buffer and written in micro-batches: every message queued within
+SUPPORT_MESSAGE_FLUSH_SECONDS goes into one transaction, with one summary
+update per conversation, and is then broadcast on the conversation's
+channel. post_message returns a Future of the stored message; callers that
+need the row (the REST endpoint) wait on it, sockets get theirs back
+through the broadcast. Without the buffer's timer thread (tests) a post
+flushes at once.
+
+Messages are checked with message_error before they are queued. Should a
+row still fail to write, the batch is retried one message per transaction
+so the others commit and only the bad message's Future fails; a batch that
+keeps failing for other reasons (the database is down) is retried a few
+times and then refused.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from database import db
+from models.support import SupportConversation, SupportMessage
+from utils.batching import WriteBehindBuffer
+from utils.broker import broker, support_channel
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_EVENT = 'message'
+# Flushes of one batch before its messages are refused
+MESSAGE_FLUSH_RETRIES = 3
+
+# client_id: the poster's own reference, echoed in the broadcast so it can match its message
+PendingMessage = namedtuple('PendingMessage', 'conversation_id sender body created_at client_id future')
+
+
+class ConversationNotFound(LookupError):
+    pass
+
+
+class MessageRejected(ValueError):
+    """The database would not take the message"""
+
+
+def sender_error(sender):
+    """Why sender cannot be stored on a message, or None"""
+    if not isinstance(sender, str) or not sender.strip():
+        return 'sender must be a non-empty string'
+    if len(sender) > SupportMessage.sender.type.length:
+        return f'sender must be at most {SupportMessage.sender.type.length} characters'
+    return None
+
+
+def message_error(body, sender):
+    """Why a message cannot be posted, or None; body is expected stripped"""
+    if not isinstance(body, str) or not body:
+        return 'body is required'
+    if len(body) > current_app.config['SUPPORT_MAX_MESSAGE_CHARS']:
+        return 'body is too long'
+    return sender_error(sender)
+
+
+def message_event(data):
+    return {'event': MESSAGE_EVENT, 'data': data}
+
+
+def message_page(conversation_id, after_id=None, before_id=None, limit=50):
+    """
+    Up to limit messages of a conversation, oldest first, and whether more lie
+    beyond the page: the oldest ones after after_id when only after_id is
+    given, otherwise the newest ones before before_id (or overall).
+    """
+    query = SupportMessage.query.filter(SupportMessage.conversation_id == conversation_id)
+    if after_id is not None:
+        query = query.filter(SupportMessage.id > after_id)
+    if before_id is not None:
+        query = query.filter(SupportMessage.id < before_id)
+    if after_id is not None and before_id is None:
+        messages = query.order_by(SupportMessage.id.asc()).limit(limit + 1).all()
+        return messages[:limit], len(messages) > limit
+    messages = query.order_by(SupportMessage.id.desc()).limit(limit + 1).all()
+    return messages[:limit][::-1], len(messages) > limit
+
+
+def wait_for_messages(conversation_id, after_id, limit, wait):
+    """
+    message_page(after_id=...) that blocks up to wait seconds while it is
+    empty; returns ([], False) if nothing arrives. Ends the request's session
+    before waiting.
+    """
+    with broker.subscribe(support_channel(conversation_id)) as subscription:
+        messages, has_more = message_page(conversation_id, after_id=after_id, limit=limit)
+        if messages or wait <= 0:
+            return messages, has_more
+        # Give the pooled connection back for the length of the wait
+        db.session.remove()
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], False
+            item = subscription.get(timeout=remaining)
+            if item is None:
+                return [], False
+            _, message = item
+            if message['event'] == MESSAGE_EVENT and message['data']['id'] > after_id:
+                return message_page(conversation_id, after_id=after_id, limit=limit)
+
+
+def post_message(conversation_id, body, sender='user', client_id=None):
+    """Queue a message for the next batch; returns a Future of its to_dict() (plus client_id)"""
+    future = Future()
+    message_buffer.add(PendingMessage(conversation_id, sender, body, datetime.utcnow(), client_id, future))
+    if not message_buffer.running:
+        message_buffer.flush()
+    return future
+
+
+def _row_error(error):
+    """Whether a failed write is down to the rows written rather than the database"""
+    return isinstance(error, DBAPIError) and not isinstance(error, OperationalError) \
+        and not error.connection_invalidated
+
+
+def _write_messages(batch, conversations):
+    """Write PendingMessages in one transaction, then settle their Futures and broadcast them"""
+    written = []
+    for pending in batch:
+        message = SupportMessage(
+            conversation_id=pending.conversation_id,
+            sender=pending.sender,
+            body=pending.body,
+            created_at=pending.created_at,
+        )
+        db.session.add(message)
+        written.append((pending, message))
+
+    by_conversation = {}
+    for _, message in written:
+        by_conversation.setdefault(message.conversation_id, []).append(message)
+    for conversation_id, messages in by_conversation.items():
+        conversations[conversation_id].record_messages(messages)
+    # Ids are assigned here; serialize before the commit expires the rows
+    db.session.flush()
+    stored = []
+    for pending, message in written:
+        data = message.to_dict()
+        if pending.client_id is not None:
+            data['client_id'] = pending.client_id
+        stored.append((pending, data))
+    db.session.commit()
+
+    for pending, data in stored:
+        pending.future.set_result(data)
+    return [data for _, data in stored]
+
+
+def _broadcast(stored):
+    # Best effort: the messages are committed, and a raise here would make the buffer retry the batch
+    broker.publish_committed((support_channel(data['conversation_id']), message_event(data)) for data in stored)
+    return stored
+
+
+def _reject(pending, error):
+    logger.warning('Support message for conversation %s rejected: %s', pending.conversation_id, error)
+    pending.future.set_exception(MessageRejected('Message could not be stored'))
+
+
+def persist_messages(batch):
+    """Flush callback: write a batch of PendingMessages in one transaction, then broadcast them"""
+    conversations = {
+        conversation.id: conversation
+        for conversation in SupportConversation.query.filter(
+            SupportConversation.id.in_({pending.conversation_id for pending in batch})
+        )
+    }
+    to_write = []
+    for pending in batch:
+        if pending.future.done():
+            # Already settled in an earlier attempt at this batch
+            continue
+        if pending.conversation_id not in conversations:
+            pending.future.set_exception(ConversationNotFound('Conversation not found'))
+            continue
+        to_write.append(pending)
+    if not to_write:
+        db.session.rollback()
+        return []
+
+    try:
+        return _broadcast(_write_messages(to_write, conversations))
+    except DBAPIError as error:
+        db.session.rollback()
+        if not _row_error(error):
+            raise
+        if len(to_write) == 1:
+            _reject(to_write[0], error)
+            return []
+    # One bad row fails the whole transaction: write them one by one so the rest still commit
+    stored = []
+    for pending in to_write:
+        try:
+            stored += _broadcast(_write_messages([pending], conversations))
+        except DBAPIError as error:
+            db.session.rollback()
+            if not _row_error(error):
+                raise
+            _reject(pending, error)
+    return stored
+
+
+def refuse_messages(batch, error):
+    """on_drop callback: fail the Futures of a batch that could not be written"""
+    for pending in batch:
+        if not pending.future.done():
+            pending.future.set_exception(error)
+
+
+message_buffer = WriteBehindBuffer(
+    persist_messages, name='support-messages', interval=0.05, max_items=200,
+    max_retries=MESSAGE_FLUSH_RETRIES, on_drop=refuse_messages,
+)
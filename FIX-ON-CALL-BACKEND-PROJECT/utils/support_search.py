@@ -0,0 +1,232 @@
+"""
+Full-text search over support conversations.
+
+Each conversation has one search document: a header (customer name, email,
+phone and request id) and a body (every message). On Postgres it is a row
+of two tsvectors in support_search with a GIN index on header || body, the
+header weighted above the body for ts_rank. On SQLite it is a row of an
+FTS5 table, ranked by bm25 with the same header weighting. Text is folded
+into the same lower-case words and international phone digits as the admin
+user search (utils.search), and query words match as prefixes.
+
+The index is maintained in the writing transaction from the ORM flush:
+a new conversation inserts its document, a header change rewrites the
+header, and a new message only appends its words to the body. Databases
+without a search table fall back to substring matching, unranked.
+"""
+
+from sqlalchemy import DDL, column, event, func, inspect, literal_column, or_, table, text
+
+from database import db
+from models.support import SupportConversation, SupportMessage
+from utils.search import TSVECTOR_CONFIG, search_text_for, search_words
+
+SEARCH_TABLE = 'support_search'
+HEADER_FIELDS = ('customer_name', 'customer_email', 'customer_phone', 'request_id')
+# bm25 column weights (header, body); Postgres uses tsvector weights A and D instead
+FTS5_WEIGHTS = (10.0, 1.0)
+
+CREATE_DDL = {
+    'postgresql': [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "conversation_id INTEGER PRIMARY KEY, "
+        "header TSVECTOR NOT NULL DEFAULT ''::tsvector, "
+        "body TSVECTOR NOT NULL DEFAULT ''::tsvector)",
+        f"CREATE INDEX IF NOT EXISTS idx_support_search_document ON {SEARCH_TABLE} USING gin ((header || body))",
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(header, body)",
+    ],
+}
+
+_search = table(SEARCH_TABLE, column('conversation_id'), column('rowid'), column('header'), column('body'))
+
+
+def supported(dialect):
+    return dialect in CREATE_DDL
+
+
+def create_search_table(connection):
+    """Create the search table (and index) if missing; returns False on unsupported databases"""
+    statements = CREATE_DDL.get(connection.dialect.name)
+    if statements is None:
+        return False
+    for statement in statements:
+        connection.execute(text(statement))
+    return True
+
+
+# Created and dropped together with the conversations table
+for _dialect, _statements in CREATE_DDL.items():
+    for _statement in _statements:
+        event.listen(SupportConversation.__table__, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+event.listen(SupportConversation.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+
+def header_text(conversation):
+    return ' '.join(filter(None, [
+        search_text_for(conversation.customer_name, conversation.customer_email, conversation.customer_phone),
+        ' '.join(search_words(conversation.request_id)),
+    ]))
+
+
+def body_text(body):
+    return ' '.join(search_words(body))
+
+
+# ----------------------------------------------------------------------
+# Index writes
+# ----------------------------------------------------------------------
+def _set_headers(connection, headers):
+    """Insert or replace the header of {conversation_id: header text}"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            f"INSERT INTO {SEARCH_TABLE} (conversation_id, header) "
+            f"VALUES (:id, setweight(to_tsvector('{TSVECTOR_CONFIG}', :header), 'A')) "
+            "ON CONFLICT (conversation_id) DO UPDATE SET header = EXCLUDED.header"
+        ), [{'id': cid, 'header': header} for cid, header in headers.items()])
+        return
+    for cid, header in headers.items():
+        updated = connection.execute(
+            text(f'UPDATE {SEARCH_TABLE} SET header = :header WHERE rowid = :id'), {'id': cid, 'header': header}
+        )
+        if not updated.rowcount:
+            connection.execute(
+                text(f"INSERT INTO {SEARCH_TABLE} (rowid, header, body) VALUES (:id, :header, '')"),
+                {'id': cid, 'header': header}
+            )
+
+
+def _append_bodies(connection, bodies):
+    """Append words to the body of each conversation in [(conversation_id, text)]"""
+    if connection.dialect.name == 'postgresql':
+        statement = (
+            f"UPDATE {SEARCH_TABLE} SET body = body || to_tsvector('{TSVECTOR_CONFIG}', :body) "
+            "WHERE conversation_id = :id"
+        )
+    else:
+        statement = f"UPDATE {SEARCH_TABLE} SET body = body || ' ' || :body WHERE rowid = :id"
+    connection.execute(text(statement), [{'id': cid, 'body': body} for cid, body in bodies])
+
+
+def delete_documents(connection, conversation_ids):
+    """Drop the documents of conversations removed outside the ORM (e.g. archived)"""
+    if not supported(connection.dialect.name) or not conversation_ids:
+        return
+    key = 'conversation_id' if connection.dialect.name == 'postgresql' else 'rowid'
+    connection.execute(
+        text(f'DELETE FROM {SEARCH_TABLE} WHERE {key} = :id'), [{'id': cid} for cid in conversation_ids]
+    )
+
+
+class SupportSearchIndex:
+    """Keeps the support search table in step with ORM writes"""
+
+    def __init__(self):
+        self._listeners_registered = False
+
+    def init_app(self, app):
+        self._register_listeners()
+
+    def _register_listeners(self):
+        if self._listeners_registered:
+            return
+        event.listen(db.session, 'after_flush', self._after_flush)
+        self._listeners_registered = True
+
+    def _after_flush(self, session, flush_context):
+        connection = session.connection()
+        if not supported(connection.dialect.name):
+            return
+        headers = {}
+        for obj in session.new:
+            if isinstance(obj, SupportConversation):
+                headers[obj.id] = header_text(obj)
+        for obj in session.dirty:
+            if isinstance(obj, SupportConversation) and _header_changed(obj):
+                headers[obj.id] = header_text(obj)
+        bodies = [
+            (obj.conversation_id, body_text(obj.body))
+            for obj in sorted((o for o in session.new if isinstance(o, SupportMessage)), key=lambda m: m.id)
+        ]
+        deleted = [obj.id for obj in session.deleted if isinstance(obj, SupportConversation)]
+        if headers:
+            _set_headers(connection, headers)
+        if bodies:
+            _append_bodies(connection, bodies)
+        if deleted:
+            delete_documents(connection, deleted)
+
+    def rebuild(self, batch_size=500):
+        """Rewrite every document from the conversations and their messages; returns the count"""
+        connection = db.session.connection()
+        if not create_search_table(connection):
+            return 0
+        connection.execute(text(f'DELETE FROM {SEARCH_TABLE}'))
+        rebuilt = 0
+        last_id = 0
+        while True:
+            conversations = SupportConversation.query.filter(
+                SupportConversation.id > last_id
+            ).order_by(SupportConversation.id).limit(batch_size).all()
+            if not conversations:
+                break
+            ids = [c.id for c in conversations]
+            bodies = {}
+            for cid, body in db.session.query(SupportMessage.conversation_id, SupportMessage.body).filter(
+                SupportMessage.conversation_id.in_(ids)
+            ).order_by(SupportMessage.conversation_id, SupportMessage.created_at, SupportMessage.id):
+                bodies.setdefault(cid, []).append(body_text(body))
+            connection = db.session.connection()
+            _set_headers(connection, {c.id: header_text(c) for c in conversations})
+            if bodies:
+                _append_bodies(connection, [(cid, ' '.join(words)) for cid, words in bodies.items()])
+            rebuilt += len(ids)
+            last_id = ids[-1]
+            db.session.commit()
+        db.session.commit()
+        return rebuilt
+
+
+def _header_changed(conversation):
+    state = inspect(conversation)
+    return any(state.attrs[name].history.has_changes() for name in HEADER_FIELDS)
+
+
+support_search = SupportSearchIndex()
+
+
+# ----------------------------------------------------------------------
+# Queries
+# ----------------------------------------------------------------------
+def ranked_matches(words, dialect):
+    """
+    Subquery of (conversation_id, rank) for conversations whose document
+    contains every one of words (from query_words) as a word prefix; a
+    higher rank is a better match. None when the database has no search table.
+    """
+    if not supported(dialect):
+        return None
+    # Words are [^\W_]+ only, so they need no escaping inside either query syntax
+    if dialect == 'postgresql':
+        document = _search.c.header.op('||')(_search.c.body)
+        tsquery = func.to_tsquery(TSVECTOR_CONFIG, ' & '.join(f'{word}:*' for word in words))
+        return db.select(
+            _search.c.conversation_id.label('conversation_id'),
+            func.ts_rank(document, tsquery).label('rank'),
+        ).where(document.op('@@')(tsquery)).subquery('matches')
+
+    fts = literal_column(SEARCH_TABLE)
+    return db.select(
+        _search.c.rowid.label('conversation_id'),
+        # bm25 is lower for better matches
+        (-func.bm25(fts, *FTS5_WEIGHTS)).label('rank'),
+    ).where(fts.op('MATCH')(' AND '.join(f'"{word}"*' for word in words))).subquery('matches')
+
+
+def substring_clause(term):
+    """Unranked fallback: the term anywhere in the header fields or the last message"""
+    return or_(*(
+        getattr(SupportConversation, name).icontains(term, autoescape=True)
+        for name in (*HEADER_FIELDS, 'last_message')
+    ))
@@ -0,0 +1,232 @@
+"""
+Real-time support chat over WebSocket.
+
+Each socket joins one conversation's broker channel (support:<id>). Frames
+from the client are JSON objects:
+
+    {"type": "message", "body": "...", "client_id": "..."}
+    {"type": "typing", "typing": true}
+
+and the server sends {"event": ..., "data": ...} objects: a welcome with
+the socket's connection id and who is present, then every message, typing
+and presence event on the conversation. Messages are queued for the
+micro-batched writer (utils.support_chat) and reach every subscriber,
+the poster included, through the broadcast after they commit; client_id
+lets the poster match its own, and errors about a frame carry its
+client_id too. ?after_id= on connect first replays the messages missed
+since that id.
+
+Typing and presence are never stored. Presence travels as joined / here /
+left events on the channel: every worker that has sockets on a
+conversation learns its participants from them, a socket answers another
+socket's joined with here, and every socket repeats here at a third of
+SUPPORT_PRESENCE_TTL_SECONDS so that participants of a worker that died
+expire.
+"""
+
+import json
+import threading
+import time
+import uuid
+
+from database import db
+from utils.broker import broker, support_channel
+from utils.support_chat import MESSAGE_EVENT, message_error, message_event, message_page, post_message
+
+PRESENCE_EVENT = 'presence'
+TYPING_EVENT = 'typing'
+WELCOME_EVENT = 'welcome'
+ERROR_EVENT = 'error'
+
+JOINED, HERE, LEFT = 'joined', 'here', 'left'
+
+# Replayed messages are read in pages of this many
+REPLAY_PAGE_SIZE = 200
+
+
+def error_event(error, client_id=None):
+    data = {'error': error}
+    if client_id is not None:
+        data['client_id'] = client_id
+    return {'event': ERROR_EVENT, 'data': data}
+
+
+class ChatPresence:
+    """Participants of each conversation as announced on its channel, seen from this worker"""
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self._participants = {}  # conversation id -> {connection id: (participant, expires)}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config['SUPPORT_PRESENCE_TTL_SECONDS']
+        self.clear()
+
+    def update(self, conversation_id, participant, status):
+        with self._lock:
+            participants = self._participants.setdefault(conversation_id, {})
+            if status == LEFT:
+                participants.pop(participant['connection_id'], None)
+            else:
+                participants[participant['connection_id']] = (participant, time.monotonic() + self.ttl)
+            if not participants:
+                del self._participants[conversation_id]
+
+    def participants(self, conversation_id):
+        now = time.monotonic()
+        with self._lock:
+            participants = self._participants.get(conversation_id, {})
+            for connection_id in [key for key, (_, expires) in participants.items() if expires <= now]:
+                del participants[connection_id]
+            return [participant for participant, _ in participants.values()]
+
+    def forget(self, conversation_id):
+        """Drop a conversation once this worker has no sockets on it (it stops hearing its events)"""
+        with self._lock:
+            self._participants.pop(conversation_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._participants.clear()
+
+
+chat_presence = ChatPresence()
+
+
+class ChatConnection:
+    """One socket's session on a conversation"""
+
+    def __init__(self, ws, conversation_id, name, sender):
+        self.ws = ws
+        self.conversation_id = conversation_id
+        self.channel = support_channel(conversation_id)
+        self.participant = {'connection_id': uuid.uuid4().hex, 'name': name, 'sender': sender}
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._replayed_id = 0
+
+    @property
+    def connection_id(self):
+        return self.participant['connection_id']
+
+    def send(self, message):
+        # The relay thread and the receive loop both write to the socket
+        with self._send_lock:
+            self.ws.send(json.dumps(message, default=str))
+
+    def announce(self, status):
+        broker.publish(self.channel, {'event': PRESENCE_EVENT, 'data': {**self.participant, 'status': status}})
+
+    def serve(self, subscription, after_id=None):
+        self.send({'event': WELCOME_EVENT, 'data': {
+            'connection_id': self.connection_id,
+            'participants': chat_presence.participants(self.conversation_id),
+        }})
+        if after_id is not None:
+            self._replay(after_id)
+        # The socket may stay open for hours; hold no database connection meanwhile
+        db.session.remove()
+
+        relay = threading.Thread(target=self._relay, args=(subscription,), name='support-socket', daemon=True)
+        relay.start()
+        self.announce(JOINED)
+        refresh = chat_presence.ttl / 3
+        next_refresh = time.monotonic() + refresh
+        try:
+            while True:
+                frame = self.ws.receive(timeout=max(0.0, next_refresh - time.monotonic()))
+                if frame is not None:
+                    self._handle(frame)
+                if time.monotonic() >= next_refresh:
+                    self.announce(HERE)
+                    next_refresh = time.monotonic() + refresh
+        finally:
+            self._closed.set()
+            self.announce(LEFT)
+            relay.join(5)
+
+    def _replay(self, after_id):
+        while True:
+            messages, has_more = message_page(self.conversation_id, after_id=after_id, limit=REPLAY_PAGE_SIZE)
+            for message in messages:
+                self.send(message_event(message.to_dict()))
+                self._replayed_id = message.id
+            if not has_more:
+                return
+            after_id = messages[-1].id
+
+    def _relay(self, subscription):
+        """Forward the conversation's events to the socket until it closes"""
+        while not self._closed.is_set():
+            item = subscription.get(timeout=0.5)
+            if item is None:
+                continue
+            _, message = item
+            data = message['data']
+            if message['event'] == PRESENCE_EVENT:
+                chat_presence.update(self.conversation_id, data, data['status'])
+                if data['connection_id'] == self.connection_id:
+                    continue
+                if data['status'] == JOINED:
+                    self.announce(HERE)
+            elif message['event'] == TYPING_EVENT and data['connection_id'] == self.connection_id:
+                continue
+            elif message['event'] == MESSAGE_EVENT and data['id'] <= self._replayed_id:
+                # Committed while the replay ran: already sent
+                continue
+            try:
+                self.send(message)
+            except Exception:
+                # Closed under us; the receive loop ends the session
+                return
+
+    def _handle(self, frame):
+        try:
+            payload = json.loads(frame)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            self.send(error_event('Frames must be JSON objects'))
+            return
+
+        kind = payload.get('type')
+        if kind == MESSAGE_EVENT:
+            self._post(payload)
+        elif kind == TYPING_EVENT:
+            broker.publish(self.channel, {'event': TYPING_EVENT, 'data': {
+                **self.participant, 'typing': bool(payload.get('typing', True)),
+            }})
+        else:
+            self.send(error_event(f'Unknown frame type: {kind}'))
+
+    def _post(self, payload):
+        body = payload.get('body')
+        body = body.strip() if isinstance(body, str) else ''
+        client_id = payload.get('client_id')
+        error = message_error(body, self.participant['sender'])
+        if error:
+            self.send(error_event(error, client_id))
+            return
+
+        def refused(future):
+            error = future.exception()
+            if error is not None and not self._closed.is_set():
+                self.send(error_event(str(error), client_id))
+
+        # The stored message comes back through the broadcast
+        post_message(self.conversation_id, body, sender=self.participant['sender'], client_id=client_id) \
+            .add_done_callback(refused)
+
+
+def serve_chat(ws, conversation_id, name='', sender='user', after_id=None):
+    """Run a chat socket until the client disconnects"""
+    connection = ChatConnection(ws, conversation_id, name, sender)
+    # Subscribe before replaying so no message falls in between
+    subscription = broker.subscribe(connection.channel)
+    try:
+        connection.serve(subscription, after_id=after_id)
+    finally:
+        subscription.close()
+        if not broker.subscriber_count(connection.channel):
+            chat_presence.forget(conversation_id)
@@ -0,0 +1,65 @@
+"""
+Live status tracking for services and bookings.
+
+Status changes are published on the service:<id> / booking:<id> broker
+channels after they commit; GET /api/services/<id>/stream and
+/api/bookings/<id>/stream relay them to the viewer as server-sent events.
+"""
+
+from utils.broker import booking_channel, broker, service_channel
+
+STATUS_EVENT = 'status'
+TERMINAL_SERVICE_STATUSES = {'completed', 'cancelled', 'rejected'}
+TERMINAL_BOOKING_STATUSES = {'completed', 'cancelled'}
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def service_status(service):
+    """The part of a service a tracker needs"""
+    return {
+        'id': service.id,
+        'status': service.status,
+        'assigned_to': service.assigned_to,
+        'estimated_time': _iso(service.estimated_time),
+        'updated_at': _iso(service.updated_at),
+    }
+
+
+def booking_status(booking):
+    return {
+        'id': booking.id,
+        'status': booking.status,
+        'mechanic_id': booking.mechanic_id,
+        'cancellation_reason': booking.cancellation_reason,
+        'updated_at': _iso(booking.updated_at),
+    }
+
+
+def status_message(data):
+    return {'event': STATUS_EVENT, 'data': data}
+
+
+def service_status_message(data):
+    """(channel, message) for a service_status() dict"""
+    return service_channel(data['id']), status_message(data)
+
+
+def publish_service_status(data):
+    """Best effort, after the status change has committed"""
+    broker.publish_committed([service_status_message(data)])
+
+
+def publish_booking_status(data):
+    """Best effort, after the status change has committed"""
+    broker.publish_committed([(booking_channel(data['id']), status_message(data))])
+
+
+def service_finished(message):
+    return message['event'] == STATUS_EVENT and message['data']['status'] in TERMINAL_SERVICE_STATUSES
+
+
+def booking_finished(message):
+    return message['event'] == STATUS_EVENT and message['data']['status'] in TERMINAL_BOOKING_STATUSES
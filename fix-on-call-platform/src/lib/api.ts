@@ -9,18 +9,31 @@ const api = axios.create({
   },
 });
 
+// Set by the API after a write: until then, send it back so reads see that write
+const STICKY_HEADER = 'X-Replica-Sticky-Until';
+
 // Add token to requests
 api.interceptors.request.use((config) => {
   const token = localStorage.getItem('token');
   if (token) {
     config.headers.Authorization = `Bearer ${token}`;
   }
+  const stickyUntil = localStorage.getItem('replicaStickyUntil');
+  if (stickyUntil && Number(stickyUntil) > Date.now() / 1000) {
+    config.headers[STICKY_HEADER] = stickyUntil;
+  }
   return config;
 });
 
 // Handle token expiration
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    const stickyUntil = response.headers[STICKY_HEADER.toLowerCase()];
+    if (stickyUntil) {
+      localStorage.setItem('replicaStickyUntil', stickyUntil);
+    }
+    return response;
+  },
   (error) => {
     if (error.response?.status === 401) {
       localStorage.removeItem('token');
@@ -36,6 +49,8 @@ export const authAPI = {
   login: (data: any) => api.post('/auth/login', data),
   getProfile: () => api.get('/auth/profile'),
   updateProfile: (data: any) => api.put('/auth/profile', data),
+  // Short-lived ticket for EventSource URLs: `${API_URL}/services/${id}/stream?ticket=${ticket}`
+  getStreamTicket: () => api.post('/auth/stream-ticket'),
 };
 
 export const servicesAPI = {